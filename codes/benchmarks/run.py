@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark the read, forcing, global mean/time series, annual mean, t-test and plotting stages of forcing_tools
+on synthetic CMIP6-like data. Runs offline.
+
+    python benchmarks/run.py --resolution 2.5 --years 30 --members 1 --results ~/forcing_tools_bench.jsonl
+
+Every run appends one JSON line (version, git commit, parameters, per-stage seconds and peak
+traced memory) to the results file and prints the ratio to the previous run with the same parameters.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+import forcing_tools
+from forcing_tools import forcings, stats, plot, catalog, reader
+import synthetic
+
+# default results file, kept outside the source tree so runs never show up as repository changes
+RESULTS = os.path.join(tempfile.gettempdir(), "forcing_tools_bench.jsonl")
+
+def measure(name, func, results):
+    ''' Run func, record wall time and peak traced memory (numpy allocations are traced) under name '''
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    value = func()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    results[name] = {"seconds": round(seconds, 4), "peak_mb": round(peak / 2**20, 2)}
+    print("{:<24s} {:>9.3f} s {:>10.1f} MB".format(name, seconds, peak / 2**20))
+    return value
+
+def _coastlines_available():
+    ''' Plotting needs the Natural Earth coastlines; they cannot be downloaded offline '''
+
+    try:
+        import cartopy.io.shapereader as shapereader
+        shapereader.natural_earth(resolution="110m", category="physical", name="coastline")
+        return True
+    except Exception:
+        return False
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def run(args):
+    ''' Generate the data and time every stage; returns the per-stage results '''
+
+    workdir = args.data or tempfile.mkdtemp(prefix="forcing_tools_bench_")
+    chunks = {"time": args.chunk_time} if args.chunk_time else None
+    results = {}
+    try:
+        if not os.path.exists(os.path.join(workdir, "index.json")):
+            print("writing synthetic data to", workdir)
+            synthetic.write_tree(workdir, members=args.members, resolution=args.resolution, years=args.years,
+                                 variables=tuple(synthetic.VARIABLES), chunks=chunks,
+                                 missing_fraction=args.missing_fraction)
+            catalog.Catalog.build(workdir, os.path.join(workdir, "index.json"))
+
+        cat = measure("catalog_load", lambda: catalog.Catalog.load(os.path.join(workdir, "index.json")), results)
+        source_id = "SYNTH-ESM"
+        data_aer = measure("read_open", lambda: cat.open_dataset(source_id, "piClim-spAer-aer", chunks=chunks), results)
+        data_control = cat.open_dataset(source_id, "piClim-control", chunks=chunks)
+
+        files = cat.files(source_id, "piClim-control")
+        measure("read_netcdf", lambda: reader.read_files({v: (p[0], v) for v, p in files.items()}), results)
+        measure("read_netcdf_pool", lambda: reader.read_files({v: (p[0], v) for v, p in files.items()}, max_workers=4), results)
+
+        if args.members > 1:
+            ensemble = cat.open_ensemble(source_id, "piClim-control", chunks=chunks)
+            measure("ensemble_mean", lambda: [x.compute() for x in reader.ensemble_mean(ensemble["rsdt"])], results)
+
+        allsky = measure("forcing_allsky", lambda: [x.compute() for x in forcings.compute_forcings_allsky(data_aer, data_control)], results)
+        measure("forcing_cloudy", lambda: [x.compute() for x in forcings.compute_cloudy_sky(data_aer, data_control)], results)
+        measure("forcing_all_components", lambda: forcings.compute_all_components(data_aer, data_control).compute(), results)
+        # the cloudy-sky division alone on in-memory fields: NumPy sequence vs the compiled gufunc
+        fields = [x.values for x in forcings.compute_forcings_allsky(data_aer, data_control)
+                  + forcings.compute_forcings_clearsky(data_aer, data_control)]
+        fields += [data_aer["clt"].values, data_control["clt"].values]
+        measure("cloudy_division_numpy", lambda: forcings.cloudy_sky_division(*fields, engine="numpy"), results)
+        if forcings.numba is not None:
+            forcings.cloudy_sky_division(*[f[:1] for f in fields], engine="numba")  # compile outside the timing
+            measure("cloudy_division_numba", lambda: forcings.cloudy_sky_division(*fields, engine="numba"), results)
+        aprp_aer = cat.open_dataset(source_id, "piClim-spAer-aer", chunks=chunks, variables=forcings.APRP_VARIABLES)
+        aprp_control = cat.open_dataset(source_id, "piClim-control", chunks=chunks, variables=forcings.APRP_VARIABLES)
+        measure("forcing_aprp", lambda: forcings.compute_aprp(aprp_aer, aprp_control).compute(), results)
+
+        sw = allsky[0]
+        measure("global_mean", lambda: stats.global_mean(sw), results)
+        measure("time_series", lambda: stats.time_series(data_aer, sw, plot=False).compute(), results)
+        measure("annual_mean", lambda: stats.annual_mean(data_aer["rsut"]).compute(), results)
+        measure("t_test_nd", lambda: stats.t_test_nd(sw.values, args.years, 0), results)
+        measure("t_test_streaming", lambda: stats.t_test_streaming(sw, 0, n=args.years), results)
+
+        if not args.no_plot:
+            coastlines = not args.no_coastlines and _coastlines_available()
+            if not coastlines and not args.no_coastlines:
+                print("coastlines not available offline; plotting without them")
+            def _plot():
+                plot.plot_data(data_aer, sw, dtype="xarray", coastlines=coastlines)
+                plt.savefig(os.path.join(workdir, "bench_plot.pdf"))
+                plt.close("all")
+            measure("plot_data", _plot, results)
+    finally:
+        if args.data is None and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return results
+
+def compare(record, path):
+    ''' Print the ratio of every stage to the last stored run with the same parameters '''
+
+    previous = None
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry["params"] == record["params"]:
+                    previous = entry
+    if previous is None:
+        return
+    print("\ncompared to {} ({}):".format(previous.get("commit"), previous.get("date")))
+    for stage, result in record["stages"].items():
+        if stage in previous["stages"] and previous["stages"][stage]["seconds"] > 0:
+            ratio = result["seconds"] / previous["stages"][stage]["seconds"]
+            flag = "  <-- slower" if ratio > 1.2 else ""
+            print("{:<24s} x{:.2f}{}".format(stage, ratio, flag))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--resolution", type=float, default=2.5, help="grid spacing in degrees (2.5 to 0.25)")
+    parser.add_argument("--years", type=int, default=30)
+    parser.add_argument("--members", type=int, default=1)
+    parser.add_argument("--chunk-time", type=int, default=None, help="time steps per chunk on disk and in dask")
+    parser.add_argument("--missing-fraction", type=float, default=0.0, help="fraction of cells set to _FillValue")
+    parser.add_argument("--data", default=None, help="reuse/keep synthetic data in this directory")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary data directory")
+    parser.add_argument("--no-plot", action="store_true")
+    parser.add_argument("--no-coastlines", action="store_true", help="plot without the Natural Earth coastlines")
+    parser.add_argument("--results", default=RESULTS,
+                        help="JSON lines file the run is appended to. Default: %(default)s")
+    args = parser.parse_args(argv)
+
+    stages = run(args)
+    record = {"date": time.strftime("%Y-%m-%dT%H:%M:%S"), "version": forcing_tools.__version__, "commit": git_commit(),
+              "python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+              "params": {"resolution": args.resolution, "years": args.years, "members": args.members,
+                         "chunk_time": args.chunk_time, "missing_fraction": args.missing_fraction},
+              "stages": stages}
+    compare(record, args.results)
+    with open(args.results, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic CMIP6-like RFMIP data for benchmarking forcing_tools
+
+Writes monthly Amon fields with realistic magnitudes, CF attributes, cell bounds,
+a noleap calendar and _FillValue, laid out as <root>/<experiment>/<variable>/<DRS name>.nc
+like the RFMIP data the scripts and notebooks read.
+"""
+
+import os
+import numpy as np
+import xarray as xr
+
+FILL_VALUE = np.float32(1.0e20)
+
+# standard_name, long_name, units, typical range
+VARIABLES = {
+    "rsdt": ("toa_incoming_shortwave_flux", "TOA Incident Shortwave Radiation", "W m-2", (0.0, 520.0)),
+    "rsut": ("toa_outgoing_shortwave_flux", "TOA Outgoing Shortwave Radiation", "W m-2", (0.0, 250.0)),
+    "rlut": ("toa_outgoing_longwave_flux", "TOA Outgoing Longwave Radiation", "W m-2", (120.0, 320.0)),
+    "rsutcs": ("toa_outgoing_shortwave_flux_assuming_clear_sky", "TOA Outgoing Clear-Sky Shortwave Radiation", "W m-2", (0.0, 180.0)),
+    "rlutcs": ("toa_outgoing_longwave_flux_assuming_clear_sky", "TOA Outgoing Clear-Sky Longwave Radiation", "W m-2", (140.0, 330.0)),
+    "clt": ("cloud_area_fraction", "Total Cloud Cover Percentage", "%", (0.0, 100.0)),
+    "rsds": ("surface_downwelling_shortwave_flux_in_air", "Surface Downwelling Shortwave Radiation", "W m-2", (0.0, 400.0)),
+    "rsus": ("surface_upwelling_shortwave_flux_in_air", "Surface Upwelling Shortwave Radiation", "W m-2", (0.0, 150.0)),
+    "rsdscs": ("surface_downwelling_shortwave_flux_in_air_assuming_clear_sky", "Surface Downwelling Clear-Sky Shortwave Radiation", "W m-2", (0.0, 450.0)),
+    "rsuscs": ("surface_upwelling_shortwave_flux_in_air_assuming_clear_sky", "Surface Upwelling Clear-Sky Shortwave Radiation", "W m-2", (0.0, 170.0)),
+}
+
+def make_grid(resolution):
+    ''' Regular global grid with bounds; resolution in degrees (2.5 to 0.25) '''
+
+    n_lat = int(round(180.0 / resolution))
+    n_lon = int(round(360.0 / resolution))
+    lat_edges = np.linspace(-90.0, 90.0, n_lat + 1)
+    lon_edges = np.linspace(0.0, 360.0, n_lon + 1)
+    lat = 0.5 * (lat_edges[1:] + lat_edges[:-1])
+    lon = 0.5 * (lon_edges[1:] + lon_edges[:-1])
+    return lat, lon, np.stack([lat_edges[:-1], lat_edges[1:]], 1), np.stack([lon_edges[:-1], lon_edges[1:]], 1)
+
+def make_dataset(variable, experiment_id="piClim-control", source_id="SYNTH-ESM", member_id="r1i1p1f1",
+                 resolution=2.5, years=30, start_year=1, seed=0, missing_fraction=0.0):
+    ''' One variable of one simulation as an xarray.Dataset
+        Parameters:
+        -----------
+        variable:         string
+                          one of VARIABLES
+        resolution:       float64
+                          grid spacing in degrees. Default: 2.5
+        years:            integer
+                          number of years of monthly data. Default: 30
+        seed:             integer
+                          random seed; the experiment and member change the noise. Default: 0
+        missing_fraction: float64
+                          fraction of cells set to the fill value. Default: 0
+
+        Returns:
+        --------
+        data: xarray.Dataset
+    '''
+
+    standard_name, long_name, units, (low, high) = VARIABLES[variable]
+    lat, lon, lat_bnds, lon_bnds = make_grid(resolution)
+    n_time = 12 * years
+    edges = xr.date_range("{:04d}-01-01".format(start_year), periods=n_time + 1, freq="MS", calendar="noleap", use_cftime=True)
+    time = edges[:-1]
+    time_bnds = np.stack([edges[:-1], edges[1:]], axis=1)
+
+    rng = np.random.default_rng([seed, sum(map(ord, experiment_id)), sum(map(ord, member_id)), sum(map(ord, variable))])
+    # smooth climatology (latitude and seasonal cycle) plus float32 noise
+    month = np.arange(n_time) % 12
+    season = np.cos(2 * np.pi * (month[:, None, None] - 6) / 12) * np.sin(np.deg2rad(lat))[None, :, None]
+    base = np.cos(np.deg2rad(lat))[None, :, None] * np.ones((1, 1, lon.size))
+    values = np.empty((n_time, lat.size, lon.size), dtype="float32")
+    values[:] = low + (high - low) * (0.35 + 0.35 * base + 0.2 * season)
+    values += rng.standard_normal(values.shape, dtype="float32") * np.float32(0.05 * (high - low))
+    np.clip(values, low, high, out=values)
+    if missing_fraction > 0:
+        values[rng.random(values.shape) < missing_fraction] = np.nan
+
+    data = xr.Dataset(
+        {variable: (("time", "lat", "lon"), values,
+                    {"standard_name": standard_name, "long_name": long_name, "units": units,
+                     "cell_methods": "area: time: mean", "cell_measures": "area: areacella"}),
+         "time_bnds": (("time", "bnds"), time_bnds),
+         "lat_bnds": (("lat", "bnds"), lat_bnds),
+         "lon_bnds": (("lon", "bnds"), lon_bnds)},
+        coords={"time": ("time", time, {"standard_name": "time", "axis": "T", "bounds": "time_bnds"}),
+                "lat": ("lat", lat, {"standard_name": "latitude", "units": "degrees_north", "axis": "Y", "bounds": "lat_bnds"}),
+                "lon": ("lon", lon, {"standard_name": "longitude", "units": "degrees_east", "axis": "X", "bounds": "lon_bnds"})},
+        attrs={"Conventions": "CF-1.7 CMIP-6.2", "activity_id": "RFMIP", "source_id": source_id,
+               "experiment_id": experiment_id, "variant_label": member_id, "table_id": "Amon",
+               "grid_label": "gn", "frequency": "mon", "variable_id": variable,
+               "title": "synthetic {} data for benchmarking forcing_tools".format(source_id)})
+    # time and time_bnds share their units in the files, as CF asks
+    data["time"].encoding.update(units="days since {:04d}-01-01".format(start_year), calendar="noleap")
+    return data
+
+def drs_name(variable, experiment_id, source_id, member_id, start_year, years):
+    ''' CMIP6 DRS file name '''
+
+    return "{}_Amon_{}_{}_{}_gn_{:04d}01-{:04d}12".format(variable, source_id, experiment_id, member_id,
+                                                          start_year, start_year + years - 1)
+
+def write_tree(root, source_ids=("SYNTH-ESM",), experiments=("piClim-spAer-aer", "piClim-control"),
+               variables=("rsdt", "rsut", "rlut", "rsutcs", "rlutcs", "clt"), members=1, resolution=2.5,
+               years=30, chunks=None, fmt="netcdf", missing_fraction=0.0, zarr_format=2):
+    ''' Write a synthetic RFMIP tree
+        Parameters:
+        -----------
+        root:        string
+                     output directory; files go to <root>/<experiment>/<variable>/
+        members:     integer
+                     number of realizations r1i1p1f1 ... Default: 1
+        chunks:      dict
+                     on-disk chunks, e.g. {"time": 12}. Default: None (one chunk per variable)
+        fmt:         string
+                     'netcdf' or 'zarr' (needs the zarr package). Default: 'netcdf'
+        zarr_format: integer
+                     Zarr format of the stores; 2 like the Pangeo CMIP6 bucket. Default: 2
+
+        Returns:
+        --------
+        paths: list of written files/stores
+    '''
+
+    paths = []
+    for s, source_id in enumerate(source_ids):
+        for experiment_id in experiments:
+            for m in range(1, members + 1):
+                member_id = "r{}i1p1f1".format(m)
+                for variable in variables:
+                    data = make_dataset(variable, experiment_id, source_id, member_id, resolution=resolution,
+                                        years=years, seed=s, missing_fraction=missing_fraction)
+                    directory = os.path.join(root, experiment_id, variable)
+                    os.makedirs(directory, exist_ok=True)
+                    name = drs_name(variable, experiment_id, source_id, member_id, 1, years)
+                    sizes = [data.sizes[d] if chunks is None or d not in chunks else chunks[d] for d in data[variable].dims]
+                    if fmt == "zarr":
+                        path = os.path.join(directory, name + ".zarr")
+                        encoding = {variable: {"chunks": tuple(sizes), "_FillValue": FILL_VALUE}}
+                        data.to_zarr(path, mode="w", encoding=encoding, consolidated=True, zarr_format=zarr_format)
+                    else:
+                        path = os.path.join(directory, name + ".nc")
+                        encoding = {variable: {"chunksizes": tuple(sizes), "_FillValue": FILL_VALUE,
+                                               "missing_value": FILL_VALUE, "zlib": False}}
+                        data.to_netcdf(path, encoding=encoding, format="NETCDF4")
+                    paths.append(path)
+    return paths
+
+def write_store_catalog(paths, csv_path, activity_id="RFMIP", institution_id="SYNTH"):
+    ''' Write a catalog CSV in the format of the Pangeo cmip6-zarr-consolidated-stores CSV
+        for Zarr stores written by write_tree(fmt="zarr"), so forcing_tools.stores can be
+        exercised against local stores standing in for the bucket
+        Parameters:
+        -----------
+        paths:    list of strings
+                  Zarr stores named by drs_name
+        csv_path: string
+                  output CSV
+
+        Returns:
+        --------
+        csv_path: string
+    '''
+
+    import pandas as pd
+
+    rows = []
+    for path in paths:
+        variable, table_id, source_id, experiment_id, member_id, grid_label = \
+            os.path.basename(path.rstrip("/"))[:-len(".zarr")].split("_")[:6]
+        rows.append(dict(activity_id=activity_id, institution_id=institution_id, source_id=source_id,
+                         experiment_id=experiment_id, member_id=member_id, table_id=table_id,
+                         variable_id=variable, grid_label=grid_label, zstore=os.path.abspath(path),
+                         dcpp_init_year="", version="20190101"))
+    pd.DataFrame(rows).to_csv(csv_path, index=False)
+    return csv_path
@@ -18,6 +18,20 @@ __version__ = "1.0"
 __bibtex__ = """
 """
 
-from .forcing import (compute_forcings_allsky, compute_forcings_clearsky, compute_cloudy_sky)
-from .stats import (global_mean, time_series, t_test, t_test_nd)
-from .plot import (plot_data, plot_annual_data)
+from .forcings import (compute_forcings_allsky, compute_forcings_clearsky, compute_cloudy_sky,
+                       compute_all_components, stack_models, compute_multi_model, compute_aprp)
+from .stats import (global_mean, time_series, t_test, t_test_nd, t_test_streaming, Moments,
+                    annual_mean, seasonal_mean, climatology)
+from .plot import (plot_data, plot_annual_data, plot_significance, render_batch)
+from .catalog import (Catalog, parse_filename)
+from .reader import (open_ensemble, ensemble_mean, merged_members, read_files)
+from .grid import (cell_area, cell_bounds, grid_fingerprint, global_grid)
+from .regridding import (regrid, conservative_weights)
+from .cache import ResultCache
+from .atomic import (atomic_path, write_json)
+from .trace import (tracing, traced, summary)
+from .writer import (write_forcings, read_forcings, quantize)
+from .precision import (set_precision, precision)
+from .bootstrap import bootstrap_test
+from .incremental import IncrementalStats
+from .stores import (StoreCatalog, ChunkCache)
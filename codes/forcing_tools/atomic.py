@@ -0,0 +1,58 @@
+import os
+import json
+import shutil
+import tempfile
+import contextlib
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+@contextlib.contextmanager
+def atomic_path(path, keep_extension=False):
+    ''' Write to a temporary path next to path and move it onto path when the block succeeds
+        Every file written by forcing_tools (indexes, caches, states, NetCDF/Zarr outputs, figures) goes
+        through here, so a crash or an exception never leaves a partial file under the final name. The
+        temporary path is removed if the block fails; a directory (e.g. a Zarr store) replaces an old one.
+
+            with atomic_path("forcings.nc") as tmp_path:
+                data.to_netcdf(tmp_path)
+
+        Parameters:
+        -----------
+        path:           string
+                        final file or directory
+        keep_extension: boolean
+                        keep the extension at the end of the temporary name, for writers that infer the
+                        format from it (plt.savefig) or append it (scipy.sparse.save_npz). Default: False
+
+        Returns:
+        --------
+        tmp_path: string
+                  temporary path in the directory of path, unique per call (also between threads); it
+                  does not exist yet, so the block can create a file or a directory there
+    '''
+
+    root, extension = os.path.splitext(path) if keep_extension else (path, "")
+    directory, name = os.path.split(os.path.abspath(root))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=name + ".tmp", suffix=extension, dir=directory)
+    os.close(fd)
+    os.remove(tmp_path)  # keep the random name only: the block may write a directory, and mkstemp files are 0600
+    try:
+        yield tmp_path
+        if os.path.isdir(tmp_path) and os.path.isdir(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        _remove(tmp_path)
+        raise
+
+def write_json(path, content):
+    ''' Write content to path as JSON atomically (see atomic_path) '''
+
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, "w") as f:
+            json.dump(content, f)
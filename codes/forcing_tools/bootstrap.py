@@ -0,0 +1,124 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import xarray as xr
+from .trace import traced
+
+METHODS = ("block", "permutation")
+
+def default_block_length(n_time):
+    ''' Rule of thumb block length n**(1/3) for the moving-block bootstrap of a mean '''
+
+    return max(1, int(round(n_time ** (1.0 / 3.0))))
+
+def _resample_batch(args):
+    ''' p-values and percentile intervals of the mean for a batch of cells (time, cells)
+        Every batch draws the same resamples from seed, so results do not depend on the batching.
+    '''
+
+    values, pop_mean, method, n_resamples, block_length, alpha, seed = args
+    values = np.asarray(values, dtype="float64")
+    n_time = values.shape[0]
+    finite = np.all(np.isfinite(values), axis=0)
+    values = np.where(finite, values, 0.0)
+    mean = values.mean(axis=0)
+    n_blocks = -(-n_time // block_length)
+    rng = np.random.default_rng(seed)
+
+    if method == "block":
+        # resample means as (resample x block start) counts times the sums of all blocks: one matrix product
+        n_starts = n_time - block_length + 1
+        starts = rng.integers(0, n_starts, size=(n_resamples, n_blocks))
+        index = (np.arange(n_resamples)[:, None] * n_starts + starts).ravel()
+        counts = np.bincount(index, minlength=n_resamples * n_starts).reshape(n_resamples, n_starts).astype("float64")
+        cumulative = np.concatenate([np.zeros((1, values.shape[1])), np.cumsum(values, axis=0)])
+        block_sums = cumulative[block_length:] - cumulative[:-block_length]
+        null = counts @ block_sums / (n_blocks * block_length) - mean
+    else:
+        # sign flips of whole blocks of the anomalies from pop_mean
+        signs = np.repeat(rng.choice([-1.0, 1.0], size=(n_resamples, n_blocks)), block_length, axis=1)[:, :n_time]
+        null = signs @ (values - pop_mean) / n_time
+
+    observed = np.abs(mean - pop_mean)
+    p_value = (np.count_nonzero(np.abs(null) >= observed, axis=0) + 1) / (n_resamples + 1)
+    lower, upper = mean + np.quantile(null, [alpha / 2, 1 - alpha / 2], axis=0)
+    for result in (p_value, lower, upper):
+        result[~finite] = np.nan
+    return p_value, lower, upper
+
+@traced
+def bootstrap_test(data, pop_mean=0, method="block", n_resamples=10000, block_length=None, alpha=0.05,
+                   seed=0, max_workers=None, batch_size=None):
+    ''' Resampling test of the time mean at every grid cell for autocorrelated data
+    Unlike stats.t_test, the sample size does not have to be given: serial correlation is kept by
+    resampling whole blocks of consecutive time steps. All cells use the same resamples, drawn from seed,
+    so the result is reproducible; max_workers and batch_size change the intervals by rounding at most.
+    Parameters:
+    -----------
+    data:         xarray DataArray or numpy array
+                  sample with time as first axis (or a 'time' dimension), e.g. monthly forcing (time, lat, lon)
+    pop_mean:     float or array
+                  the null hypothesis H0, a scalar or one value per cell. Default: 0
+    method:       string
+                  'block' for the moving-block bootstrap, 'permutation' for random sign flips of blocks of
+                  the anomalies from pop_mean (assumes a distribution symmetric about the mean). Default: 'block'
+    n_resamples:  integer
+                  Default: 10000
+    block_length: integer
+                  time steps per block; 1 gives the ordinary bootstrap. Default: None (n_time**(1/3))
+    alpha:        float
+                  the confidence interval covers 1 - alpha. Default: 0.05
+    seed:         integer
+                  seed of the resamples. Default: 0
+    max_workers:  integer
+                  processes; 1 runs in this process. Default: None (number of cores)
+    batch_size:   integer
+                  cells per task. Default: None (about 256 MB of resampled means per task)
+
+    Returns:
+    --------
+    p_value:  numpy array or xarray DataArray
+              two-sided p-value at each grid cell, same shape as the p_value of t_test (data without time)
+    ci_lower: same as p_value
+              lower bound of the percentile confidence interval of the mean
+    ci_upper: same as p_value
+              upper bound of the percentile confidence interval of the mean
+    '''
+
+    if method not in METHODS:
+        raise ValueError("method must be one of {}, not {!r}".format(METHODS, method))
+
+    template = None
+    if isinstance(data, xr.DataArray):
+        if "time" in data.dims and data.dims[0] != "time":
+            data = data.transpose("time", ...)
+        template = data.isel({data.dims[0]: 0}, drop=True)
+        values = data.values
+    else:
+        values = np.asarray(data)
+
+    n_time = values.shape[0]
+    cell_shape = values.shape[1:]
+    values = values.reshape(n_time, -1)
+    n_cells = values.shape[1]
+    block_length = default_block_length(n_time) if block_length is None else int(block_length)
+    if not 1 <= block_length <= n_time:
+        raise ValueError("block_length must be between 1 and the number of time steps ({})".format(n_time))
+    pop_mean = np.broadcast_to(np.asarray(pop_mean, dtype="float64"), cell_shape).reshape(-1)
+    if batch_size is None:
+        batch_size = max(1, 2**25 // n_resamples)
+
+    tasks = [(values[:, start:start + batch_size], pop_mean[start:start + batch_size], method, n_resamples,
+              block_length, alpha, seed) for start in range(0, n_cells, batch_size)]
+    max_workers = os.cpu_count() if max_workers is None else max_workers
+    if max_workers <= 1 or len(tasks) == 1:
+        results = [_resample_batch(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(tasks))) as pool:
+            results = list(pool.map(_resample_batch, tasks))
+
+    outputs = [np.concatenate([r[i] for r in results]).reshape(cell_shape) for i in range(3)]
+    if template is not None:
+        outputs = [xr.DataArray(output, dims=template.dims, coords=template.coords, name=name)
+                   for output, name in zip(outputs, ("p_value", "ci_lower", "ci_upper"))]
+    return tuple(outputs)
@@ -0,0 +1,291 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import numpy as np
+import xarray as xr
+from .atomic import atomic_path, write_json
+
+class ResultCache:
+    """
+    On-disk cache for results of forcing_tools functions.
+    Entries are keyed by the identity of the input files (path, size, mtime), the function name,
+    the order and selection of its positional arguments and its keyword parameters. Arrays are stored as chunked, compressed NetCDF4 files and the
+    least recently used entries are evicted once the cache grows beyond max_size bytes.
+    """
+
+    def __init__(self, directory, max_size=20 * 2**30):
+        """
+        directory: folder holding the cache; created if missing
+        max_size:  size limit in bytes. Default: 20 GiB
+        """
+
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def file_identity(files):
+        ''' Return (path, size, mtime) for every file, sorted by path '''
+
+        identity = []
+        for path in sorted({os.path.abspath(p) for p in files}):
+            stat = os.stat(path)
+            identity.append((path, stat.st_size, stat.st_mtime_ns))
+        return identity
+
+    def key(self, func_name, files, params=None, args=()):
+        ''' Compute the cache key of a function call
+            Parameters:
+            -----------
+            func_name: string
+                       name of the cached function
+            files:     list of strings
+                       input files the result depends on
+            params:    dict
+                       keyword parameters of the call. Default: None
+            args:      tuple
+                       positional arguments of the call; their order and selection (see fingerprint) are
+                       part of the key. Default: ()
+
+            Returns:
+            --------
+            key: string
+                 sha256 hex digest
+        '''
+
+        content = json.dumps({"func": func_name, "files": self.file_identity(files),
+                              "args": [fingerprint(arg) for arg in args],
+                              "params": sorted((k, fingerprint(v)) for k, v in (params or {}).items())})
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def cached(self, func, *args, files=None, **kwargs):
+        ''' Call func(*args, **kwargs) or load its result from the cache
+            Parameters:
+            -----------
+            func:   function
+                    e.g. forcing_tools.compute_forcings_allsky; may return a DataArray, Dataset, ndarray,
+                    scalar or a tuple of those
+            args:   positional arguments of func, usually xarray Datasets; their order and selection
+                    (dims, shape, coordinates, dask graph or data) are part of the key
+            files:  list of strings
+                    input files the result depends on. Default None: every file the xarray arguments
+                    were opened from, also all files of xr.open_mfdataset
+            kwargs: keyword arguments of func; part of the key
+
+            Returns:
+            --------
+            result: same structure as returned by func; arrays are loaded lazily from the cache
+        '''
+
+        if files is None:
+            files = _source_files(args)
+            if not files:
+                raise ValueError("cannot derive the input files of {}; pass files explicitly".format(func.__name__))
+
+        key = self.key(func.__module__ + "." + func.__qualname__, files, kwargs, args)
+        result = self.get(key)
+        if result is None:
+            result = func(*args, **kwargs)
+            self.put(key, result, func_name=func.__qualname__, files=files, params=kwargs)
+            # reload so the (possibly lazy) result is not computed a second time; None if already evicted
+            stored = self.get(key)
+            if stored is not None:
+                result = stored
+        return result
+
+    def get(self, key):
+        ''' Load a cached result, or None if the key is not cached '''
+
+        entry = os.path.join(self.directory, key)
+        try:
+            with open(os.path.join(entry, "meta.json")) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+
+        meta["last_access"] = time.time()
+        write_json(os.path.join(entry, "meta.json"), meta)
+
+        items = []
+        for i, item in enumerate(meta["items"]):
+            if item["type"] == "scalar":
+                items.append(np.asarray(item["value"])[()])
+                continue
+            data = xr.open_dataset(os.path.join(entry, "{}.nc".format(i)), chunks={})
+            if item["type"] == "Dataset":
+                items.append(data)
+            elif item["type"] == "DataArray":
+                array = data["data"]
+                array.name = item["name"]
+                items.append(array)
+            else:
+                items.append(data["data"].values)
+        return tuple(items) if meta["is_tuple"] else items[0]
+
+    def put(self, key, result, func_name=None, files=(), params=None):
+        ''' Store a result under key, then evict least recently used entries above max_size '''
+
+        with atomic_path(os.path.join(self.directory, key)) as tmp_entry:
+            os.makedirs(tmp_entry)
+            is_tuple = isinstance(result, tuple)
+            items = []
+            for i, item in enumerate(result if is_tuple else (result,)):
+                path = os.path.join(tmp_entry, "{}.nc".format(i))
+                if isinstance(item, xr.Dataset):
+                    _to_netcdf(item, path)
+                    items.append({"type": "Dataset"})
+                elif isinstance(item, xr.DataArray):
+                    _to_netcdf(item.to_dataset(name="data"), path)
+                    items.append({"type": "DataArray", "name": item.name})
+                elif np.ndim(item) == 0:
+                    items.append({"type": "scalar", "value": np.asarray(item).item()})
+                else:
+                    _to_netcdf(xr.DataArray(np.asarray(item)).to_dataset(name="data"), path)
+                    items.append({"type": "ndarray"})
+
+            size = sum(os.path.getsize(os.path.join(tmp_entry, f)) for f in os.listdir(tmp_entry))
+            meta = {"func": func_name, "files": [os.path.abspath(p) for p in files],
+                    "params": {k: repr(v) for k, v in (params or {}).items()},
+                    "is_tuple": is_tuple, "items": items, "size": size, "last_access": time.time()}
+            with open(os.path.join(tmp_entry, "meta.json"), "w") as f:
+                json.dump(meta, f)
+        self.evict()
+
+    def entries(self):
+        ''' Return the metadata of all cache entries, keyed by cache key '''
+
+        entries = {}
+        for key in os.listdir(self.directory):
+            try:
+                with open(os.path.join(self.directory, key, "meta.json")) as f:
+                    entries[key] = json.load(f)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+        return entries
+
+    def evict(self):
+        ''' Remove least recently used entries until the cache is below max_size '''
+
+        entries = sorted(self.entries().items(), key=lambda e: e[1]["last_access"])
+        total = sum(meta["size"] for key, meta in entries)
+        for key, meta in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+            total -= meta["size"]
+
+    def invalidate(self, key=None, func_name=None, files=None):
+        ''' Remove cache entries. Without arguments the whole cache is cleared
+            Parameters:
+            -----------
+            key:       string
+                       remove this entry only
+            func_name: string
+                       remove all entries of this function, e.g. 'compute_cloudy_sky'
+            files:     list of strings
+                       remove all entries depending on any of these files
+
+            Returns:
+            --------
+            removed: integer
+                     number of removed entries
+        '''
+
+        files = {os.path.abspath(p) for p in files} if files is not None else None
+        removed = 0
+        for entry_key, meta in self.entries().items():
+            if key is not None and entry_key != key:
+                continue
+            if func_name is not None and meta["func"] != func_name:
+                continue
+            if files is not None and not files.intersection(meta["files"]):
+                continue
+            shutil.rmtree(os.path.join(self.directory, entry_key), ignore_errors=True)
+            removed += 1
+        return removed
+
+def fingerprint(obj):
+    ''' Stable description of an argument for the cache key
+        xarray objects are described by type, name, dims, shape and dtype of every variable and the
+        values of their coordinates; lazy (dask) data by the name of its graph, which changes with
+        the files, the selection and the operations it was made from; in-memory arrays by a hash of
+        their data. Other values by their repr.
+    '''
+
+    if isinstance(obj, xr.DataArray):
+        obj = obj.to_dataset(name="__dataarray__" if obj.name is None else obj.name)
+        kind = "DataArray"
+    elif isinstance(obj, xr.Dataset):
+        kind = "Dataset"
+    elif isinstance(obj, np.ndarray):
+        return ["ndarray", str(obj.dtype), list(obj.shape), _data_hash(obj)]
+    else:
+        return repr(obj)
+
+    variables = []
+    for name in sorted(obj.variables, key=str):
+        variable = obj.variables[name]
+        description = [str(name), list(variable.dims), list(variable.shape), str(variable.dtype)]
+        if name in obj.coords or not hasattr(variable.data, "__dask_graph__"):
+            description.append(_data_hash(variable.values))
+        else:
+            description.append(variable.data.name)
+        variables.append(description)
+    return [kind, variables]
+
+def _data_hash(values):
+    values = np.ascontiguousarray(values).reshape(-1)
+    if values.dtype.kind == "O":  # e.g. cftime dates
+        return hashlib.sha256(repr(values.tolist()).encode()).hexdigest()
+    return hashlib.sha256(values.view(np.uint8)).hexdigest()
+
+def _graph_files(data):
+    ''' Files of the backend arrays in the dask graph of lazily opened data, e.g. all files of xr.open_mfdataset '''
+
+    files = set()
+    for task in dict(data.__dask_graph__()).values():
+        stack = [getattr(task, "value", task)]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, tuple):
+                stack.extend(item)
+                continue
+            for _ in range(16):  # nested lazy indexing adapters
+                datastore = getattr(item, "datastore", None)
+                if isinstance(getattr(datastore, "_filename", None), str):
+                    files.add(datastore._filename)
+                    break
+                if not hasattr(item, "array"):
+                    break
+                item = item.array
+    return files
+
+def _source_files(args):
+    ''' Collect the files xarray arguments were opened from '''
+
+    files = set()
+    for arg in args:
+        if isinstance(arg, xr.Dataset):
+            objects = [arg] + list(arg.variables.values())
+        elif isinstance(arg, xr.DataArray):
+            objects = [arg] + list(arg.coords.values())
+        else:
+            continue
+        files.update(obj.encoding["source"] for obj in objects if "source" in obj.encoding)
+        for obj in objects[1:] if isinstance(arg, xr.Dataset) else objects:
+            if hasattr(obj.data, "__dask_graph__"):
+                files.update(_graph_files(obj.data))
+    return sorted(os.path.abspath(f) for f in files)
+
+def _to_netcdf(data, path):
+    ''' Write a Dataset as chunked, compressed NetCDF4; time is chunked per year of monthly data '''
+
+    encoding = {}
+    for name, variable in data.variables.items():
+        if variable.ndim == 0 or variable.dtype.kind not in "fiub":
+            continue
+        chunksizes = tuple(min(12, size) if dim == "time" else size for dim, size in zip(variable.dims, variable.shape))
+        encoding[name] = {"zlib": True, "complevel": 1, "chunksizes": chunksizes}
+    data.to_netcdf(path, encoding=encoding)
@@ -0,0 +1,284 @@
+import os
+import json
+import xarray as xr
+from .atomic import write_json
+from .reader import open_ensemble, merged_members
+from .trace import traced
+
+DRS_FACETS = ("variable_id", "table_id", "source_id", "experiment_id", "member_id", "grid_label")
+
+# index file Catalog.load_or_build keeps at the top of a CMIP6 tree
+INDEX_FILE = "forcing_tools_index.json"
+
+def parse_filename(filename):
+    ''' Parse a CMIP6 DRS filename into its facets
+        <variable_id>_<table_id>_<source_id>_<experiment_id>_<member_id>_<grid_label>[_<time_range>].nc
+        Parameters:
+        -----------
+        filename: string
+                  file name or path, e.g. rsdt_Amon_NorESM2-LM_piClim-control_r1i1p1f1_gn_000101-003012.nc
+
+        Returns:
+        --------
+        facets: dict or None
+                DRS facets plus 'start' and 'end' of the time range (None for time independent files).
+                None if the name does not follow the DRS.
+    '''
+
+    name = os.path.basename(filename)
+    if not name.endswith(".nc"):
+        return None
+    parts = name[:-3].split("_")
+    if len(parts) not in (6, 7):
+        return None
+
+    facets = dict(zip(DRS_FACETS, parts[:6]))
+    facets["start"], facets["end"] = None, None
+    if len(parts) == 7:
+        time_range = parts[6].split("-")
+        if len(time_range) != 2:
+            return None
+        facets["start"], facets["end"] = time_range
+
+    return facets
+
+class Catalog:
+    """
+    Index of CMIP6 files parsed from their DRS filenames.
+    Scan a directory tree once with Catalog.build, persist it with save and reload it
+    with Catalog.load; queries never touch the filesystem again.
+    """
+
+    def __init__(self, entries, root=None):
+        """
+        entries: list of dicts with the DRS facets, 'start', 'end', 'path', 'size' and 'mtime'
+        root:    directory the catalog was built from
+        """
+
+        self.root = root
+        self.entries = sorted(entries, key=lambda e: (tuple(e[f] for f in DRS_FACETS), e["start"] or ""))
+        self._groups = {}
+        for entry in self.entries:
+            key = tuple(entry[f] for f in DRS_FACETS)
+            self._groups.setdefault(key, []).append(entry)
+
+    def __len__(self):
+        return len(self.entries)
+
+    @classmethod
+    @traced
+    def build(cls, root, index_file=None):
+        ''' Walk a CMIP6 tree once and index every file with a DRS name
+            Parameters:
+            -----------
+            root:       string
+                        top directory, e.g. '/data/aero/CMIP6/RFMIP/'
+            index_file: string
+                        if given, the index is written there as JSON. Default: None
+
+            Returns:
+            --------
+            catalog:    Catalog
+        '''
+
+        entries = []
+        stack = [root]
+        stat = os.stat(root)
+        visited = {(stat.st_dev, stat.st_ino)}  # symlinked directories are followed, but each one only once
+        while stack:
+            with os.scandir(stack.pop()) as it:
+                for item in it:
+                    if item.is_dir(follow_symlinks=True):
+                        stat = item.stat(follow_symlinks=True)
+                        if (stat.st_dev, stat.st_ino) not in visited:
+                            visited.add((stat.st_dev, stat.st_ino))
+                            stack.append(item.path)
+                        continue
+                    facets = parse_filename(item.name)
+                    if facets is None:
+                        continue
+                    stat = item.stat()
+                    facets.update(path=os.path.abspath(item.path), size=stat.st_size, mtime=stat.st_mtime)
+                    entries.append(facets)
+
+        catalog = cls(entries, root=os.path.abspath(root))
+        if index_file is not None:
+            catalog.save(index_file)
+        return catalog
+
+    @classmethod
+    def load(cls, index_file):
+        ''' Load a catalog written by Catalog.save '''
+
+        with open(index_file) as f:
+            index = json.load(f)
+        return cls(index["entries"], root=index.get("root"))
+
+    @classmethod
+    def load_or_build(cls, root, index_file=None):
+        ''' Load the index of a CMIP6 tree, walking the tree only if there is no index yet
+            Parameters:
+            -----------
+            root:       string
+                        top directory of the tree
+            index_file: string
+                        index to load, or to write after the walk. Default: None (INDEX_FILE in root).
+                        Remove it or call Catalog.build(root, index_file) after adding files to the tree
+
+            Returns:
+            --------
+            catalog: Catalog
+        '''
+
+        index_file = index_file or os.path.join(root, INDEX_FILE)
+        if os.path.exists(index_file):
+            return cls.load(index_file)
+        catalog = cls.build(root)
+        try:
+            catalog.save(index_file)
+        except OSError:  # e.g. a read-only data directory; the tree is walked again next time
+            pass
+        return catalog
+
+    def save(self, index_file):
+        ''' Write the catalog to a JSON index file '''
+
+        write_json(index_file, {"root": self.root, "entries": self.entries})
+
+    def search(self, **facets):
+        ''' Return all entries matching the given facets
+            Parameters:
+            -----------
+            facets: keyword arguments
+                    any of variable_id, table_id, source_id, experiment_id, member_id, grid_label.
+                    Values can be a string or a list/tuple of strings.
+
+            Returns:
+            --------
+            entries: list of dicts
+        '''
+
+        unknown = set(facets) - set(DRS_FACETS)
+        if unknown:
+            raise ValueError("unknown facets: {}".format(", ".join(sorted(unknown))))
+        wanted = {k: (v,) if isinstance(v, str) else tuple(v) for k, v in facets.items()}
+
+        result = []
+        for key, entries in self._groups.items():
+            if all(key[DRS_FACETS.index(k)] in v for k, v in wanted.items()):
+                result.extend(entries)
+        return result
+
+    def files(self, source_id, experiment_id, variables=("rsdt", "rsut", "rlut", "rsutcs", "rlutcs", "clt"),
+              member_id=None, table_id="Amon", grid_label=None):
+        ''' Return the files of one model and experiment grouped by variable
+            Parameters:
+            -----------
+            source_id:     string
+                           model, e.g. 'NorESM2-LM'
+            experiment_id: string
+                           e.g. 'piClim-control'
+            variables:     list of strings
+                           Default: TOA fluxes and cloud fraction used by forcing_tools.forcings
+            member_id:     string
+                           realization, e.g. 'r1i1p1f1'. Default None: the first member found, preferring
+                           single realizations over pre-merged ones such as IPSL r1234i1p1f1
+            table_id:      string
+                           Default: 'Amon'
+            grid_label:    string
+                           e.g. 'gn' or 'gr'. Default None: the one grid the member is on; a ValueError is
+                           raised if its files are on several grids
+
+            Returns:
+            --------
+            files:         dict
+                           variable -> list of paths sorted by time
+        '''
+
+        facets = dict(source_id=source_id, experiment_id=experiment_id, table_id=table_id, variable_id=variables)
+        if grid_label is not None:
+            facets["grid_label"] = grid_label
+        entries = self.search(**facets)
+        if member_id is None:
+            members = sorted({e["member_id"] for e in entries})
+            if not members:
+                raise KeyError("no files for {} {}".format(source_id, experiment_id))
+            merged = merged_members(members)
+            member_id = ([m for m in members if m not in merged] or members)[0]
+
+        entries = [e for e in entries if e["member_id"] == member_id]
+        grids = sorted({e["grid_label"] for e in entries})
+        if len(grids) > 1:
+            raise ValueError("files for {} {} {} are on several grids ({}); pass grid_label".format(
+                source_id, experiment_id, member_id, ", ".join(grids)))
+
+        files = {}
+        for entry in entries:
+            files.setdefault(entry["variable_id"], []).append(entry["path"])
+
+        missing = [v for v in variables if v not in files]
+        if missing:
+            raise KeyError("missing variables for {} {} {}: {}".format(source_id, experiment_id, member_id, ", ".join(missing)))
+        return {v: files[v] for v in variables}
+
+    def members(self, source_id, experiment_id, table_id="Amon", merged=True):
+        ''' Return the sorted realizations available for one model and experiment
+            merged=False leaves out pre-merged members such as IPSL r1234i1p1f1 (see reader.merged_members)
+        '''
+
+        entries = self.search(source_id=source_id, experiment_id=experiment_id, table_id=table_id)
+        members = sorted({e["member_id"] for e in entries})
+        if not merged:
+            members = [m for m in members if m not in merged_members(members)]
+        return members
+
+    @traced
+    def open_dataset(self, source_id, experiment_id, chunks=None, parallel=True, **kwargs):
+        ''' Open the files returned by Catalog.files as one lazy xarray.Dataset
+            Parameters:
+            -----------
+            source_id, experiment_id: string
+                                      see Catalog.files
+            chunks:                   dict
+                                      passed to xr.open_mfdataset. Default: None (one chunk per file)
+            parallel:                 boolean
+                                      open files in parallel with dask. Default: True
+            kwargs:                   passed to Catalog.files
+
+            Returns:
+            --------
+            data: xarray.Dataset
+        '''
+
+        files = self.files(source_id, experiment_id, **kwargs)
+        paths = [path for variable in files for path in files[variable]]
+        return xr.open_mfdataset(paths, chunks=chunks, parallel=parallel, compat="override")
+
+    @traced
+    def open_ensemble(self, source_id, experiment_id, members=None, chunks=None, parallel=True, **kwargs):
+        ''' Open several realizations of one model and experiment along a lazy 'realization' dimension
+            Parameters:
+            -----------
+            source_id, experiment_id: string
+                                      see Catalog.files
+            members:                  list of strings
+                                      realizations to open. Default None: all members in the catalog except
+                                      pre-merged ones such as IPSL r1234i1p1f1, which would count their
+                                      realizations twice
+            chunks, parallel:         see Catalog.open_dataset
+            kwargs:                   passed to Catalog.files
+
+            Returns:
+            --------
+            data: xarray.Dataset
+                  dim=(realization, time, lat, lon); use reader.ensemble_mean for the mean and spread
+        '''
+
+        if members is None:
+            available = self.members(source_id, experiment_id, table_id=kwargs.get("table_id", "Amon"))
+            members = [m for m in available if m not in merged_members(available)]
+            if available and not members:
+                raise KeyError("only pre-merged members for {} {}: {}; open them with open_dataset(member_id=...)".format(
+                    source_id, experiment_id, ", ".join(available)))
+        files_by_member = {member: self.files(source_id, experiment_id, member_id=member, **kwargs) for member in members}
+        return open_ensemble(files_by_member, chunks=chunks, parallel=parallel)
@@ -1,8 +1,17 @@
+import threading
 import numpy as np
 from netCDF4 import Dataset
 import xarray as xr
 import dask as ds
+from .trace import traced
+from .precision import as_field
 
+try:
+    import numba
+except ImportError:  # optional: compiled kernel for the cloudy-sky division, NumPy otherwise
+    numba = None
+
+@traced
 def compute_forcings_allsky(data_aerosols, data_control):
     ''' Calculate the effective radiative forcing at TOA due shortwave and longwave radiation flux
        Parameters:
@@ -21,6 +30,9 @@ def compute_forcings_allsky(data_aerosols, data_control):
                        longwave forcing at toa; same dimension as input data (usually (time, lat, lon))
     '''
 
+    data_aerosols = as_field(data_aerosols, ("rsdt", "rsut", "rlut"))
+    data_control = as_field(data_control, ("rsdt", "rsut", "rlut"))
+
     sw_balance_aer = data_aerosols["rsdt"] - data_aerosols["rsut"]
     sw_balance_control = data_control["rsdt"] - data_control["rsut"]
     sw_forcing_toa = -sw_balance_control + sw_balance_aer
@@ -30,6 +42,7 @@ def compute_forcings_allsky(data_aerosols, data_control):
 
     return sw_forcing_toa, lw_forcing_toa
     
+@traced
 def compute_forcings_clearsky(data_aerosols, data_control):
     ''' Calculate the effective radiative forcing at TOA due shortwave and longwave radiation flux
        Parameters:
@@ -48,6 +61,9 @@ def compute_forcings_clearsky(data_aerosols, data_control):
                        longwave forcing at toa; same dimension as input data (usually (time, lat, lon))
     '''
 
+    data_aerosols = as_field(data_aerosols, ("rsdt", "rsutcs", "rlutcs"))
+    data_control = as_field(data_control, ("rsdt", "rsutcs", "rlutcs"))
+
     sw_balance_aer = data_aerosols["rsdt"] - data_aerosols["rsutcs"]
     sw_balance_control = data_control["rsdt"] - data_control["rsutcs"]
     sw_forcing_toa = -sw_balance_control + sw_balance_aer
@@ -57,50 +73,397 @@ def compute_forcings_clearsky(data_aerosols, data_control):
 
     return sw_forcing_toa, lw_forcing_toa
     
+@traced
 def compute_cloudy_sky(data_aerosols, data_control):
-    ''' Calculate the effective radiative forcing at TOA due shortwave and longwave radiation flux
+    ''' Calculate the effective radiative forcing at TOA for cloudy sky conditions due to shortwave and longwave radiation flux
+       The computation stays lazy, so dask-backed input (e.g. from xr.open_mfdataset) is evaluated chunk by chunk.
        Parameters:
        -----------
        data_aerosols: xarray.Dataset
-                 aerosol data; should include 'rsdt', 'rsut' and 'rlut' fluxes; usually: dim=(time, lat, lon) 
+                 aerosol data; should include 'rsdt', 'rsut', 'rlut', 'rsutcs', 'rlutcs' and 'clt'; usually: dim=(time, lat, lon) 
        data_control: xarray.Dataset
-                     control data; should include 'rsdt', 'rsut' and 'rlut' fluxes and has to be of the 
+                     control data; should include 'rsdt', 'rsut', 'rlut', 'rsutcs', 'rlutcs' and 'clt' and has to be of the 
                      same dimension as data_aer
 
        Returns:
        --------
-       sw_forcing_toa: xarray.DataArray
-                       shortwave forcing at toa; same dimension as input data (usually (time, lat, lon))
-       lw_forcing_toa: xarray.DataArray
-                       longwave forcing at toa; same dimension as input data (usually (time, lat, lon))
+       sw_cloudy_control: xarray.DataArray
+                          shortwave cloudy sky forcing at toa scaled by the control cloud fraction; same dimension as input data
+       sw_cloudy_aer: xarray.DataArray
+                      shortwave cloudy sky forcing at toa scaled by the aerosol cloud fraction; same dimension as input data
+       lw_cloudy_control: xarray.DataArray
+                          longwave cloudy sky forcing at toa scaled by the control cloud fraction; same dimension as input data
+       lw_cloudy_aer: xarray.DataArray
+                      longwave cloudy sky forcing at toa scaled by the aerosol cloud fraction; same dimension as input data
+                      Cells with a cloud fraction below 1% are set to zero.
     '''
 
+    data_aerosols = as_field(data_aerosols, FLUX_VARIABLES)
+    data_control = as_field(data_control, FLUX_VARIABLES)
+
     forcing_allsky = compute_forcings_allsky(data_aerosols, data_control)
     forcing_clearsky = compute_forcings_clearsky(data_aerosols, data_control)
 
-    a = forcing_allsky[0] - (1 - data_aerosols["clt"]
-                             * 0.01) * forcing_clearsky[0]
-    a1 = forcing_allsky[0] - (1 - data_control["clt"]
-                              * 0.01) * forcing_clearsky[0]
-    a2 = forcing_allsky[1] - (1 - data_aerosols["clt"]
-                              * 0.01) * forcing_clearsky[1]
-    a3 = forcing_allsky[1] - (1 - data_control["clt"]
-                              * 0.01) * forcing_clearsky[1]
-
-    deno1 = data_aerosols["clt"].values * 0.01
-    deno2 = data_control["clt"].values * 0.01
-
-    deno1[deno1 < 0.01] = 0  # xarray equivalent: deno1.where(deno1 < 0.01, 0)
-    deno2[deno2 < 0.01] = 0  # xarray equivalent: deno2.where(deno2 < 0.01, 0)
-
-    # haven't found an xarray equivalent of np.divide
-    sw_cloudy_aer = np.divide(
-        a.values, deno1, out=np.zeros_like(a.values), where=(deno1 != 0))
-    sw_cloudy_control = np.divide(
-        a1.values, deno2, out=np.zeros_like(a1.values), where=(deno2 != 0))
-    lw_cloudy_aer = np.divide(
-        a2.values, deno1, out=np.zeros_like(a2.values), where=(deno1 != 0))
-    lw_cloudy_control = np.divide(
-        a3.values, deno2, out=np.zeros_like(a3.values), where=(deno2 != 0))
-
-    return sw_cloudy_control, sw_cloudy_aer, lw_cloudy_control, lw_cloudy_aer
\ No newline at end of file
+    sw_cloudy_control, sw_cloudy_aer, lw_cloudy_control, lw_cloudy_aer = cloudy_sky_division(
+        forcing_allsky[0], forcing_allsky[1], forcing_clearsky[0], forcing_clearsky[1],
+        data_aerosols["clt"], data_control["clt"])
+
+    return sw_cloudy_control, sw_cloudy_aer, lw_cloudy_control, lw_cloudy_aer
+
+def _cloudy_numpy(sw_allsky, lw_allsky, sw_clearsky, lw_clearsky, clt_aer, clt_control, threshold=0.01):
+    ''' NumPy version of the cloudy-sky division: cloud fractions below the threshold are set to zero
+        and cells with a zero fraction get zero instead of inf; NaNs are kept.
+    '''
+
+    results = []
+    for allsky, clearsky in ((sw_allsky, sw_clearsky), (lw_allsky, lw_clearsky)):
+        for clt in (clt_control, clt_aer):
+            fraction = clt * 0.01
+            numerator = allsky - (1 - fraction) * clearsky
+            fraction[fraction < threshold] = 0
+            results.append(np.divide(numerator, fraction, out=np.zeros_like(numerator), where=(fraction != 0)))
+    return tuple(results)
+
+def _cloudy_loop(sw_allsky, lw_allsky, sw_clearsky, lw_clearsky, clt_aer, clt_control, threshold, scale, one,
+                 sw_control, sw_aer, lw_control, lw_aer):
+    ''' Loop of the compiled cloudy-sky division; the constants are arguments so they keep the field dtype '''
+
+    zero = one - one
+    for i in range(sw_allsky.shape[0]):
+        fraction_aer = clt_aer[i] * scale
+        fraction_control = clt_control[i] * scale
+        # same operations as _cloudy_numpy, so the results agree bit for bit
+        deno_aer = zero if fraction_aer < threshold else fraction_aer
+        deno_control = zero if fraction_control < threshold else fraction_control
+        sw_aer[i] = (sw_allsky[i] - (one - fraction_aer) * sw_clearsky[i]) / deno_aer if deno_aer != zero else zero
+        sw_control[i] = (sw_allsky[i] - (one - fraction_control) * sw_clearsky[i]) / deno_control if deno_control != zero else zero
+        lw_aer[i] = (lw_allsky[i] - (one - fraction_aer) * lw_clearsky[i]) / deno_aer if deno_aer != zero else zero
+        lw_control[i] = (lw_allsky[i] - (one - fraction_control) * lw_clearsky[i]) / deno_control if deno_control != zero else zero
+
+_COMPILED = {}
+# the workqueue threading layer must not be entered from several threads at once (e.g. dask worker
+# threads); every call uses all cores anyway
+_COMPILED_LOCK = threading.Lock()
+
+def _compile_cloudy():
+    ''' Multithreaded gufunc of _cloudy_loop for float32 and float64, compiled on first use and cached on disk '''
+
+    if "cloudy" not in _COMPILED:
+        try:
+            layer = numba.threading_layer()
+        except ValueError:  # no parallel kernel launched yet in this process
+            layer = None
+        if layer is None:
+            # with the TBB layer a process that ran the kernel from dask threads never exits
+            numba.config.THREADING_LAYER = "workqueue"
+        elif layer != "workqueue":
+            raise RuntimeError("engine='numba' needs numba's workqueue threading layer, but {} is already "
+                               "running in this process; use engine='numpy'".format(layer))
+        signatures = [(t[:], t[:], t[:], t[:], t[:], t[:], t, t, t, t[:], t[:], t[:], t[:])
+                      for t in (numba.float32, numba.float64)]
+        _COMPILED["cloudy"] = numba.guvectorize(signatures, "(n),(n),(n),(n),(n),(n),(),(),()->(n),(n),(n),(n)",
+                                                target="parallel", nopython=True, cache=True)(_cloudy_loop)
+    return _COMPILED["cloudy"]
+
+def cloudy_sky_division(sw_allsky, lw_allsky, sw_clearsky, lw_clearsky, clt_aer, clt_control, threshold=0.01,
+                        engine=None):
+    ''' Cloudy-sky forcings normalised by the aerosol and control cloud fractions in one pass
+        For each of SW/LW and aerosol/control cloud fraction c (clt * 0.01): (all sky - (1 - c) clear sky) / c,
+        with c below the threshold set to zero and zero instead of inf where c is zero.
+        Parameters:
+        -----------
+        sw_allsky, lw_allsky, sw_clearsky, lw_clearsky: numpy arrays or xarray.DataArrays
+                 forcings as from compute_forcings_allsky and compute_forcings_clearsky
+        clt_aer, clt_control: numpy arrays or xarray.DataArrays
+                 cloud fraction in % of the aerosol and control experiment
+        threshold: float
+                   smallest cloud fraction (0-1) divided by. Default: 0.01
+        engine:    string
+                   'numpy' or 'numba' for the compiled multithreaded gufunc (needs numba; runs on numba's
+                   workqueue threading layer). Default: None ('numpy')
+
+        Returns:
+        --------
+        sw_cloudy_control, sw_cloudy_aer, lw_cloudy_control, lw_cloudy_aer: same type as the input
+              DataArrays are evaluated chunk by chunk (blockwise) if dask backed
+    '''
+
+    engine = engine or "numpy"
+    if engine not in ("numba", "numpy"):
+        raise ValueError("engine must be 'numba' or 'numpy', not {!r}".format(engine))
+    if engine == "numba" and numba is None:
+        raise ImportError("engine='numba' needs the numba package")
+    arrays = (sw_allsky, lw_allsky, sw_clearsky, lw_clearsky, clt_aer, clt_control)
+
+    if any(isinstance(a, xr.DataArray) for a in arrays):
+        dtype = np.result_type(*[a.dtype for a in arrays])
+        return tuple(xr.apply_ufunc(_cloudy_block, *arrays, kwargs={"threshold": threshold, "engine": engine},
+                                    dask="parallelized", output_core_dims=[[]] * 4, output_dtypes=[dtype] * 4))
+    return _cloudy_block(*arrays, threshold=threshold, engine=engine)
+
+def _cloudy_block(*arrays, threshold=0.01, engine="numpy"):
+    dtype = np.result_type(*arrays)
+    if dtype.kind != "f" or dtype.itemsize > 8:
+        dtype = np.dtype("float64")
+    elif dtype.itemsize < 4:
+        dtype = np.dtype("float32")
+    arrays = [np.atleast_1d(np.asarray(a, dtype=dtype)) for a in np.broadcast_arrays(*arrays)]
+    if engine == "numpy":
+        return _cloudy_numpy(*arrays, threshold=threshold)
+    # NaN cloud fractions are expected (they give NaN) and only raise the invalid flag in the comparisons
+    with _COMPILED_LOCK, np.errstate(invalid="ignore"):
+        kernel = _compile_cloudy()
+        return tuple(kernel(*arrays, dtype.type(threshold), dtype.type(0.01), dtype.type(1)))
+
+@traced
+def compute_all_components(data_aerosols, data_control):
+    ''' Calculate every forcing component at TOA (all sky, clear sky, cloudy sky and cloud fraction weighted)
+        in a single pass. Balances and cloud fractions are computed once and shared between the components,
+        so computing the returned Dataset (e.g. with .compute()) reads each input chunk only once.
+       Parameters:
+       -----------
+       data_aerosols: xarray.Dataset
+                 aerosol data; should include 'rsdt', 'rsut', 'rlut', 'rsutcs', 'rlutcs' and 'clt'; usually: dim=(time, lat, lon) 
+       data_control: xarray.Dataset
+                     control data; should include 'rsdt', 'rsut', 'rlut', 'rsutcs', 'rlutcs' and 'clt' and has to be of the 
+                     same dimension as data_aer
+
+       Returns:
+       --------
+       components: xarray.Dataset
+                   same dimension as input data (usually (time, lat, lon)) with the variables
+                   sw_allsky, lw_allsky:           same as compute_forcings_allsky
+                   sw_clearsky, lw_clearsky:       same as compute_forcings_clearsky
+                   sw_cloudy_control, sw_cloudy_aer,
+                   lw_cloudy_control, lw_cloudy_aer: same as compute_cloudy_sky
+                   sw_fclear, lw_fclear:           (1 - cloud fraction) x clear sky forcing, using the aerosol cloud fraction
+                   sw_fcloudy, lw_fcloudy:         all sky forcing - (1 - cloud fraction) x clear sky forcing
+    '''
+
+    data_aerosols = as_field(data_aerosols, FLUX_VARIABLES)
+    data_control = as_field(data_control, FLUX_VARIABLES)
+
+    sw_balance_aer = data_aerosols["rsdt"] - data_aerosols["rsut"]
+    sw_balance_control = data_control["rsdt"] - data_control["rsut"]
+    sw_allsky = -sw_balance_control + sw_balance_aer
+    lw_allsky = -(sw_balance_control - data_control["rlut"]) + (sw_balance_aer - data_aerosols["rlut"])
+
+    cs_sw_balance_aer = data_aerosols["rsdt"] - data_aerosols["rsutcs"]
+    cs_sw_balance_control = data_control["rsdt"] - data_control["rsutcs"]
+    sw_clearsky = -cs_sw_balance_control + cs_sw_balance_aer
+    lw_clearsky = -(cs_sw_balance_control - data_control["rlutcs"]) + (cs_sw_balance_aer - data_aerosols["rlutcs"])
+
+    fraction_aer = data_aerosols["clt"] * 0.01
+
+    sw_fclear = (1 - fraction_aer) * sw_clearsky
+    lw_fclear = (1 - fraction_aer) * lw_clearsky
+    sw_fcloudy = sw_allsky - sw_fclear
+    lw_fcloudy = lw_allsky - lw_fclear
+
+    cloudy = cloudy_sky_division(sw_allsky, lw_allsky, sw_clearsky, lw_clearsky,
+                                 data_aerosols["clt"], data_control["clt"])
+
+    components = xr.Dataset({
+        "sw_allsky": sw_allsky,
+        "lw_allsky": lw_allsky,
+        "sw_clearsky": sw_clearsky,
+        "lw_clearsky": lw_clearsky,
+        "sw_cloudy_control": cloudy[0],
+        "sw_cloudy_aer": cloudy[1],
+        "lw_cloudy_control": cloudy[2],
+        "lw_cloudy_aer": cloudy[3],
+        "sw_fclear": sw_fclear,
+        "lw_fclear": lw_fclear,
+        "sw_fcloudy": sw_fcloudy,
+        "lw_fcloudy": lw_fcloudy,
+    })
+
+    return components
+
+FLUX_VARIABLES = ("rsdt", "rsut", "rlut", "rsutcs", "rlutcs", "clt")
+
+@traced
+def stack_models(models, variables=FLUX_VARIABLES, keep="last"):
+    ''' Stack several models on a common grid along a new 'model' dimension
+       Time axes are aligned by position: every model is cut to the shortest record, keeping its
+       last (or first) time steps, and the time coordinate is replaced by the step index because
+       models use different years and calendars.
+       Parameters:
+       -----------
+       models:    dict
+                  model name -> (data_aerosols, data_control) xarray.Datasets; all on the same lat/lon grid
+       variables: list of strings
+                  variables to keep. Default: rsdt, rsut, rlut, rsutcs, rlutcs and clt
+       keep:      string
+                  'last' or 'first' time steps to keep when records differ in length. Default: 'last'
+
+       Returns:
+       --------
+       data_aerosols: xarray.Dataset
+                      dim=(model, time, lat, lon)
+       data_control:  xarray.Dataset
+                      dim=(model, time, lat, lon)
+    '''
+
+    if keep not in ("last", "first"):
+        raise ValueError("keep has to be 'last' or 'first'")
+    names = list(models)
+    if not names:
+        raise ValueError("no models given")
+
+    reference = models[names[0]][0]
+    n_time = min(data.sizes["time"] for name in names for data in models[name])
+    sl = slice(-n_time, None) if keep == "last" else slice(0, n_time)
+
+    stacked = []
+    for i in range(2):
+        datasets = []
+        for name in names:
+            data = models[name][i]
+            if (data.sizes["lat"] != reference.sizes["lat"] or data.sizes["lon"] != reference.sizes["lon"]
+                    or not np.allclose(data["lat"], reference["lat"]) or not np.allclose(data["lon"], reference["lon"])):
+                raise ValueError("model '{}' is not on the grid of '{}'; regrid to a common grid first".format(name, names[0]))
+            data = data[list(variables)].isel(time=sl).drop_vars("time")
+            datasets.append(data.assign_coords(lat=reference["lat"].values, lon=reference["lon"].values))
+        stacked.append(xr.concat(datasets, dim="model", coords="minimal", compat="override").assign_coords(model=names))
+
+    return stacked[0], stacked[1]
+
+@traced
+def compute_multi_model(models, keep="last"):
+    ''' Calculate every forcing component of several models in one vectorized graph
+       The models are stacked along a 'model' dimension (see stack_models) and passed once through
+       compute_all_components, so the scheduler sees the whole job at once.
+       Parameters:
+       -----------
+       models: dict
+               model name -> (data_aerosols, data_control) xarray.Datasets on a common lat/lon grid
+       keep:   string
+               'last' or 'first' time steps to keep when records differ in length. Default: 'last'
+
+       Returns:
+       --------
+       components: xarray.Dataset
+                   same variables as compute_all_components with dim=(model, time, lat, lon).
+                   Multi-model means are e.g. global_mean(components.sw_fcloudy)[0].mean("model")
+    '''
+
+    data_aerosols, data_control = stack_models(models, keep=keep)
+    return compute_all_components(data_aerosols, data_control)
+
+# fluxes of the approximate partial radiative perturbation (APRP) decomposition
+APRP_VARIABLES = ("rsdt", "rsut", "rsutcs", "rsds", "rsus", "rsdscs", "rsuscs", "rlut", "rlutcs", "clt")
+
+APRP_COMPONENTS = ("sw_ari", "sw_aci", "sw_albedo", "sw_aprp_residual", "lw_ari", "lw_aci")
+
+def _single_layer_albedo(mu, gamma, alpha):
+    ''' Planetary albedo of the single-layer atmosphere of Taylor et al. (2007), eq. 7 '''
+
+    return mu * gamma + mu * (1 - gamma)**2 * alpha / (1 - alpha * gamma)
+
+def _single_layer_parameters(rsdt, rsut, rsds, rsus):
+    ''' Atmospheric transmittance mu, scattering gamma and surface albedo alpha of one sky condition, eqs. 9-10 '''
+
+    planetary = rsut / rsdt
+    transmitted = rsds / rsdt
+    alpha = np.where(rsds > 0, rsus / np.where(rsds > 0, rsds, 1), 0)
+    mu = planetary + transmitted * (1 - alpha)
+    gamma = (mu - transmitted) / (mu - alpha * transmitted)
+    return mu, gamma, alpha
+
+def _aprp_state(rsdt, rsut, rsutcs, rsds, rsus, rsdscs, rsuscs, clt, threshold=0.01):
+    ''' Parameters (c, mu_clr, gamma_clr, alpha_clr, mu_cld, gamma_cld, alpha_oc) of one experiment
+        Overcast fluxes follow from all sky = (1 - c) clear sky + c overcast; below the cloud
+        fraction threshold the overcast sky is taken as clear.
+    '''
+
+    c = clt * 0.01
+    cloudy = c >= threshold
+    c_safe = np.where(cloudy, c, 1)
+    overcast = [np.where(cloudy, (total - (1 - c) * clear) / c_safe, clear)
+                for total, clear in ((rsut, rsutcs), (rsds, rsdscs), (rsus, rsuscs))]
+    mu_clr, gamma_clr, alpha_clr = _single_layer_parameters(rsdt, rsutcs, rsdscs, rsuscs)
+    mu_oc, gamma_oc, alpha_oc = _single_layer_parameters(rsdt, *overcast)
+    # the cloud layer on top of the clear atmosphere, eqs. 14-15
+    mu_cld = mu_oc / mu_clr
+    gamma_cld = 1 - (1 - gamma_oc) / (1 - gamma_clr)
+    return (np.where(cloudy, c, 0), mu_clr, gamma_clr, alpha_clr, mu_cld, gamma_cld, alpha_oc)
+
+def _aprp_albedo(c, mu_clr, gamma_clr, alpha_clr, mu_cld, gamma_cld, alpha_oc):
+    ''' Planetary albedo (1 - c) A_clr + c A_oc from the APRP parameters '''
+
+    clear = _single_layer_albedo(mu_clr, gamma_clr, alpha_clr)
+    overcast = _single_layer_albedo(mu_clr * mu_cld, 1 - (1 - gamma_clr) * (1 - gamma_cld), alpha_oc)
+    return (1 - c) * clear + c * overcast
+
+# parameters of _aprp_albedo perturbed together for each term
+_APRP_GROUPS = {"sw_ari": (1, 2), "sw_aci": (0, 4, 5), "sw_albedo": (3, 6)}
+
+def _aprp_kernel(rsdt_a, rsut_a, rsutcs_a, rsds_a, rsus_a, rsdscs_a, rsuscs_a, rlut_a, rlutcs_a, clt_a,
+                 rsdt_c, rsut_c, rsutcs_c, rsds_c, rsus_c, rsdscs_c, rsuscs_c, rlut_c, rlutcs_c, clt_c):
+    ''' APRP terms of one block of cells; every output is computed from the inputs in this single call '''
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        control = _aprp_state(rsdt_c, rsut_c, rsutcs_c, rsds_c, rsus_c, rsdscs_c, rsuscs_c, clt_c)
+        aerosol = _aprp_state(rsdt_a, rsut_a, rsutcs_a, rsds_a, rsus_a, rsdscs_a, rsuscs_a, clt_a)
+        albedo_c = _aprp_albedo(*control)
+        albedo_a = _aprp_albedo(*aerosol)
+        insolation = 0.5 * (rsdt_c + rsdt_a)
+        # cells without sunlight have no shortwave terms
+        dark = (rsdt_c <= 0) | (rsdt_a <= 0)
+
+        terms = {}
+        for name, group in _APRP_GROUPS.items():
+            # centred difference: the term's parameters swapped into the control and into the aerosol state
+            forward = _aprp_albedo(*[a if i in group else c for i, (c, a) in enumerate(zip(control, aerosol))]) - albedo_c
+            backward = albedo_a - _aprp_albedo(*[c if i in group else a for i, (c, a) in enumerate(zip(control, aerosol))])
+            terms[name] = np.where(dark, 0, -insolation * 0.5 * (forward + backward))
+
+        sw_allsky = (rsdt_a - rsut_a) - (rsdt_c - rsut_c)
+        residual = sw_allsky - terms["sw_ari"] - terms["sw_aci"] - terms["sw_albedo"]
+        lw_ari = rlutcs_c - rlutcs_a
+        lw_aci = (rlutcs_a - rlut_a) - (rlutcs_c - rlut_c)
+    dtype = np.result_type(rsut_a, rsut_c)
+    return tuple(np.asarray(x, dtype=dtype) for x in
+                 (terms["sw_ari"], terms["sw_aci"], terms["sw_albedo"], residual, lw_ari, lw_aci))
+
+@traced
+def compute_aprp(data_aerosols, data_control):
+    ''' Decompose the aerosol forcing at TOA into aerosol-radiation interaction (ari), aerosol-cloud
+       interaction (aci) and surface albedo terms with the approximate partial radiative perturbation (APRP)
+       method of Taylor et al. (2007), as used for aerosol ERF by Zelinka et al. (2014).
+       The shortwave terms come from the single-layer model fitted to the clear-sky and overcast fluxes of
+       every cell and month; the longwave ari is the clear-sky change and the longwave aci the change of the
+       longwave cloud radiative effect. All terms of a chunk are evaluated in one vectorized call, so dask-backed
+       input stays lazy and every input chunk is read once; extra dimensions (e.g. realization or model from
+       reader.open_ensemble or stack_models) are handled like time.
+       Parameters:
+       -----------
+       data_aerosols: xarray.Dataset
+                      aerosol data; should include 'rsdt', 'rsut', 'rsutcs', 'rsds', 'rsus', 'rsdscs', 'rsuscs',
+                      'rlut', 'rlutcs' and 'clt' (APRP_VARIABLES); usually: dim=(time, lat, lon)
+       data_control:  xarray.Dataset
+                      control data with the same variables and dimensions as data_aerosols
+
+       Returns:
+       --------
+       components: xarray.Dataset
+                   same dimension as input data with the variables (W m-2)
+                   sw_ari, sw_aci, sw_albedo: shortwave aerosol-radiation, aerosol-cloud and surface albedo terms
+                   sw_aprp_residual:          sw_allsky minus the three shortwave terms (non-linearity of APRP)
+                   lw_ari, lw_aci:            longwave aerosol-radiation and aerosol-cloud terms
+                   Cells without insolation have zero shortwave terms.
+    '''
+
+    data_aerosols = as_field(data_aerosols, APRP_VARIABLES)
+    data_control = as_field(data_control, APRP_VARIABLES)
+    missing = [v for v in APRP_VARIABLES if v not in data_aerosols or v not in data_control]
+    if missing:
+        raise ValueError("APRP needs the variables {}".format(", ".join(missing)))
+
+    arrays = [data_aerosols[v] for v in APRP_VARIABLES] + [data_control[v] for v in APRP_VARIABLES]
+    dtype = np.result_type(data_aerosols["rsut"].dtype, data_control["rsut"].dtype)
+    outputs = xr.apply_ufunc(_aprp_kernel, *arrays, dask="parallelized",
+                             output_core_dims=[[]] * len(APRP_COMPONENTS),
+                             output_dtypes=[dtype] * len(APRP_COMPONENTS))
+    return xr.Dataset(dict(zip(APRP_COMPONENTS, outputs)))
@@ -0,0 +1,173 @@
+import hashlib
+import numpy as np
+import xarray as xr
+
+EARTH_RADIUS = 6.37e6
+
+# grid fingerprint -> cell areas (lat, lon) in m^2
+_REGISTRY = {}
+
+def grid_fingerprint(lat, lon, lat_bnds=None, lon_bnds=None):
+    ''' Hash the coordinates (and bounds, if given) of a lat/lon grid
+        Parameters:
+        -----------
+        lat, lon:           1D array-like
+                            cell centres in degrees
+        lat_bnds, lon_bnds: 2D array-like (n, 2)
+                            cell bounds in degrees. Default: None
+
+        Returns:
+        --------
+        fingerprint: string
+    '''
+
+    h = hashlib.sha1()
+    for values in (lat, lon, lat_bnds, lon_bnds):
+        if values is None:
+            h.update(b"none")
+        else:
+            values = np.ascontiguousarray(values, dtype="float64")
+            h.update(str(values.shape).encode())
+            h.update(values.tobytes())
+    return h.hexdigest()
+
+def _bounds_from_centres(centres, lower=None, upper=None):
+    ''' Cell edges halfway between the centres, extrapolated at both ends and optionally clipped '''
+
+    centres = np.asarray(centres, dtype="float64")
+    if centres.size == 1:
+        raise ValueError("cannot derive cell bounds from a single coordinate value")
+    edges = np.empty(centres.size + 1)
+    edges[1:-1] = 0.5 * (centres[1:] + centres[:-1])
+    edges[0] = centres[0] - 0.5 * (centres[1] - centres[0])
+    edges[-1] = centres[-1] + 0.5 * (centres[-1] - centres[-2])
+    if lower is not None:
+        edges = np.clip(edges, lower, upper)
+    return np.stack([edges[:-1], edges[1:]], axis=1)
+
+def lon_intervals(lon_bnds):
+    ''' Western edge and width of every longitude cell in degrees
+        Bounds may cross the dateline or the prime meridian (e.g. [359.5, 0.5]) or run from east to west,
+        so the width is taken modulo 360 instead of as the difference of the bounds.
+        Parameters:
+        -----------
+        lon_bnds: 2D array-like (lon, 2)
+                  cell bounds in degrees
+
+        Returns:
+        --------
+        west:  1D numpy array
+               western edge in [0, 360)
+        width: 1D numpy array
+               cell width in degrees; 360 for a single cell around the globe
+    '''
+
+    lon_bnds = np.asarray(lon_bnds, dtype="float64")
+    step = lon_bnds[:, 1] - lon_bnds[:, 0]
+    eastward = np.mod(step, 360.0)
+    ascending = eastward <= 180.0
+    width = np.where(ascending, eastward, 360.0 - eastward)
+    width = np.where(np.isclose(np.abs(step), 360.0), 360.0, width)
+    west = np.where(ascending, lon_bnds[:, 0], lon_bnds[:, 1])
+    return np.mod(west, 360.0), width
+
+def _find_bounds(data, coord):
+    ''' Return the bounds variable of a coordinate in a Dataset, or None '''
+
+    if not isinstance(data, xr.Dataset):
+        return None
+    name = data[coord].attrs.get("bounds")
+    for candidate in (name, coord + "_bnds", coord + "_bounds"):
+        if candidate is not None and candidate in data.variables:
+            bounds = data[candidate].values
+            return bounds[0] if bounds.ndim == 3 else bounds  # time dependent bounds, e.g. after open_mfdataset
+    return None
+
+def cell_bounds(data):
+    ''' Latitude and longitude bounds of the grid of data in degrees
+        Parameters:
+        -----------
+        data: xarray.Dataset or xarray.DataArray
+              must have 'lat' and 'lon' coordinates; bounds variables are used when present,
+              otherwise the bounds lie halfway between the centres. Midpoints are exact for regular
+              grids only: the edges of a Gaussian grid are not halfway between its latitudes, so
+              Gaussian (gn) data need their lat_bnds
+
+        Returns:
+        --------
+        lat_bnds: 2D numpy array (lat, 2)
+        lon_bnds: 2D numpy array (lon, 2)
+    '''
+
+    lat_bnds = _find_bounds(data, "lat")
+    lon_bnds = _find_bounds(data, "lon")
+    if lat_bnds is None:
+        lat_bnds = _bounds_from_centres(data["lat"].values, -90.0, 90.0)
+    if lon_bnds is None:
+        lon_bnds = _bounds_from_centres(data["lon"].values)
+    return lat_bnds, lon_bnds
+
+def global_grid(dlat, dlon=None):
+    ''' Regular global lat/lon grid with cell bounds, e.g. as a common target for regridding.regrid
+        Parameters:
+        -----------
+        dlat: float64
+              latitude spacing in degrees
+        dlon: float64
+              longitude spacing in degrees. Default: same as dlat
+
+        Returns:
+        --------
+        grid: xarray.Dataset
+              'lat' and 'lon' coordinates with 'lat_bnds' and 'lon_bnds'
+    '''
+
+    dlon = dlat if dlon is None else dlon
+    lat_edges = np.linspace(-90.0, 90.0, int(round(180.0 / dlat)) + 1)
+    lon_edges = np.linspace(0.0, 360.0, int(round(360.0 / dlon)) + 1)
+    lat = 0.5 * (lat_edges[1:] + lat_edges[:-1])
+    lon = 0.5 * (lon_edges[1:] + lon_edges[:-1])
+    grid = xr.Dataset(coords={"lat": ("lat", lat, {"units": "degrees_north", "bounds": "lat_bnds"}),
+                              "lon": ("lon", lon, {"units": "degrees_east", "bounds": "lon_bnds"})})
+    grid["lat_bnds"] = (("lat", "bnds"), np.stack([lat_edges[:-1], lat_edges[1:]], axis=1))
+    grid["lon_bnds"] = (("lon", "bnds"), np.stack([lon_edges[:-1], lon_edges[1:]], axis=1))
+    return grid
+
+def cell_area(data, radius=EARTH_RADIUS):
+    ''' Exact spherical cell areas of the lat/lon grid of data, computed once per grid and memoized
+        Parameters:
+        -----------
+        data:   xarray.Dataset or xarray.DataArray
+                must have 'lat' and 'lon' coordinates. 'lat_bnds'/'lon_bnds' (or the variables named by the
+                'bounds' attribute) are used when present, otherwise the bounds lie halfway between the centres
+                (see cell_bounds; not exact for Gaussian grids without lat_bnds).
+        radius: float64
+                radius of the sphere in m. Default: 6.37e6
+
+        Returns:
+        --------
+        area:   2D xarray.DataArray
+                area of each cell in m^2; dim=(lat, lon). R^2 * (sin(lat2) - sin(lat1)) * (lon2 - lon1),
+                with lon2 - lon1 taken modulo 360 (see lon_intervals)
+    '''
+
+    lat = data["lat"].values
+    lon = data["lon"].values
+    lat_bnds = _find_bounds(data, "lat")
+    lon_bnds = _find_bounds(data, "lon")
+
+    key = (grid_fingerprint(lat, lon, lat_bnds, lon_bnds), radius)
+    if key not in _REGISTRY:
+        lat_bnds, lon_bnds = cell_bounds(data)
+        dsin = np.abs(np.diff(np.sin(np.deg2rad(lat_bnds)), axis=1))[:, 0]
+        dlon = np.deg2rad(lon_intervals(lon_bnds)[1])
+        area = radius**2 * np.outer(dsin, dlon)
+        area.setflags(write=False)
+        _REGISTRY[key] = area
+
+    return xr.DataArray(_REGISTRY[key], dims=("lat", "lon"), coords={"lat": data["lat"], "lon": data["lon"]}, name="cell_area")
+
+def clear_registry():
+    ''' Forget all memoized cell areas '''
+
+    _REGISTRY.clear()
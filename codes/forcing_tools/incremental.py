@@ -0,0 +1,132 @@
+import os
+import numpy as np
+import xarray as xr
+from scipy import stats as sp_stats
+from .atomic import atomic_path
+from .grid import cell_area, grid_fingerprint
+from .stats import Moments, iter_time_chunks, _area_weighted_series
+from .trace import traced
+
+class IncrementalStats:
+    """
+    Running statistics of one growing variable, persisted in a directory (state.nc)
+    The state holds the per-cell moments (count, mean, M2) of all processed time steps, the area-weighted
+    global-mean series and the grid. The last time of the series is the watermark: update() folds in only
+    the time steps after it, so a refresh costs O(new data). The series is the same as stats.time_series
+    and the t-test the same as stats.t_test_streaming over the full record (up to rounding).
+    """
+
+    def __init__(self, directory):
+        """
+        directory: folder holding the state; created on the first update
+        """
+
+        self.directory = os.path.abspath(directory)
+        self.path = os.path.join(self.directory, "state.nc")
+        self.moments = Moments()
+        self.series = None
+        self.pixel_area = None
+        self.fingerprint = None
+        if os.path.exists(self.path):
+            self._load()
+
+    @property
+    def watermark(self):
+        ''' Time of the last processed step, None before the first update '''
+
+        return None if self.series is None else self.series["time"].values[-1]
+
+    def _load(self):
+        with xr.open_dataset(self.path) as state:
+            state = state.load()
+        self.moments = Moments(int(state["count"]), state["mean"].values, state["m2"].values)
+        self.series = state["global_mean"]
+        self.pixel_area = state["pixel_area"]
+        self.fingerprint = state.attrs["grid_fingerprint"]
+
+    def save(self):
+        ''' Write the state atomically '''
+
+        os.makedirs(self.directory, exist_ok=True)
+        state = xr.Dataset({"count": ((), self.moments.count),
+                            "mean": (self.pixel_area.dims, self.moments.mean),
+                            "m2": (self.pixel_area.dims, self.moments.m2),
+                            "pixel_area": self.pixel_area,
+                            "global_mean": self.series},
+                           attrs={"grid_fingerprint": self.fingerprint, "watermark": str(self.watermark)})
+        with atomic_path(self.path) as tmp_path:
+            state.to_netcdf(tmp_path)
+
+    @traced
+    def update(self, variable, data=None, chunk_size=120):
+        ''' Fold the time steps after the watermark into the state and save it
+            Parameters:
+            -----------
+            variable:   xarray.DataArray
+                        dim=(time, lat, lon); the whole (lazy) record or only its new part
+            data:       xarray.Dataset
+                        with the grid bounds, as for stats.time_series. Default: None (the grid of variable)
+            chunk_size: integer
+                        time steps read at once from in-memory input. Default: 120
+
+            Returns:
+            --------
+            n_new: integer
+                   number of time steps folded in
+        '''
+
+        if self.watermark is not None:
+            variable = variable.isel(time=np.nonzero(variable["time"].values > self.watermark)[0])
+        if variable.sizes["time"] == 0:
+            return 0
+
+        area = cell_area(data if data is not None else variable)
+        fingerprint = grid_fingerprint(area["lat"].values, area["lon"].values)
+        if self.fingerprint is None:
+            self.fingerprint = fingerprint
+            # like stats.time_series, the cells are those not missing at the first time step of the record
+            self.pixel_area = area.where(variable[0].notnull()).compute()
+        elif fingerprint != self.fingerprint:
+            raise ValueError("the grid of the new data differs from the grid in {}".format(self.path))
+
+        series = _area_weighted_series(variable, self.pixel_area).compute()
+        for chunk in iter_time_chunks(variable, chunk_size):
+            self.moments.update(chunk)
+        self.series = series if self.series is None else xr.concat([self.series, series], dim="time")
+        self.series.name = "global_mean"
+        self.save()
+        return variable.sizes["time"]
+
+    def global_mean(self):
+        ''' Global-mean series and its mean over all processed steps, like stats.global_mean '''
+
+        return self.series, self.series.mean().values
+
+    def time_series(self):
+        ''' Global-mean series of all processed steps, same as stats.time_series of the full record '''
+
+        return self.series
+
+    def t_test(self, pop_mean, n=None):
+        ''' One sample t-test of the full record from the running moments, as stats.t_test_streaming
+            Parameters:
+            -----------
+            pop_mean: integer or 1D array
+                      the null hypothesis H0
+            n:        integer
+                      sample size. Default None: number of processed time steps
+
+            Returns:
+            --------
+            t-statistics, p_value: 2D numpy arrays
+        '''
+
+        n = self.moments.count if n is None else n
+        t_statistics = (self.moments.mean - pop_mean) / (np.sqrt(self.moments.variance(ddof=1)/n))
+        p_value = sp_stats.t.sf(np.abs(t_statistics), n-1) * 2
+        return t_statistics, p_value
+
+    def variance(self, ddof=1):
+        ''' Per-cell variance of all processed steps '''
+
+        return self.moments.variance(ddof=ddof)
@@ -0,0 +1,272 @@
+"""
+Incremental forcing pipeline behind the ``forcing-tools run`` command
+
+    forcing-tools run --root /data/RFMIP --out results --models NorESM2-LM MPI-ESM1-2-LM --jobs 2
+
+For every model the stages catalog -> read -> components -> global_means -> significance -> figures
+are run as one branch; branches of different models are independent and run in parallel processes.
+Every stage has a signature built from its parameters and the signatures of its inputs (the input
+files' path, size and mtime for the read stage). A stage whose signature and outputs are unchanged
+since the last run is skipped, so adding a model only runs that model's branch. Outputs are written
+to a temporary file and renamed, and the state of a branch is saved after every stage, so an
+interrupted run resumes at the first stage that did not finish.
+"""
+
+import os
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import xarray as xr
+
+from .catalog import Catalog
+from .atomic import atomic_path, write_json
+from .cache import ResultCache
+from .forcings import compute_all_components
+from .stats import time_series, t_test_nd, annual_mean
+from .writer import write_forcings
+
+STAGES = ("catalog", "read", "components", "global_means", "significance", "figures")
+
+# bump a version to force the stage (and everything downstream) to rerun after changing its code
+STAGE_VERSIONS = {"read": 1, "components": 1, "global_means": 1, "significance": 2, "figures": 1}
+
+DEFAULTS = {"aerosol_experiment": "piClim-spAer-aer", "control_experiment": "piClim-control",
+            "member_id": None, "chunk_time": None, "keepbits": None, "alpha": 0.05,
+            "figure_variables": ("sw_allsky", "lw_allsky", "sw_clearsky", "lw_clearsky")}
+
+def signature(stage, params, inputs):
+    ''' Hash of a stage version, its parameters and the signatures (or file identities) of its inputs '''
+
+    content = json.dumps({"stage": stage, "version": STAGE_VERSIONS.get(stage), "inputs": inputs,
+                          "params": sorted((k, repr(v)) for k, v in params.items())})
+    return hashlib.sha256(content.encode()).hexdigest()
+
+def _atomic_netcdf(data, path):
+    with atomic_path(path) as tmp_path:
+        data.to_netcdf(tmp_path)
+
+class Branch:
+    """
+    The stages of one model below the catalog, with their state in <out>/<model>/state.json
+    """
+
+    def __init__(self, source_id, index_file, out, params, force=False, dry_run=False):
+        self.source_id = source_id
+        self.index_file = index_file
+        self.directory = os.path.join(out, source_id)
+        self.params = dict(DEFAULTS, **params)
+        self.force = force
+        self.dry_run = dry_run
+        self.state_file = os.path.join(self.directory, "state.json")
+        self.state = {}
+        if os.path.exists(self.state_file):
+            with open(self.state_file) as f:
+                self.state = json.load(f)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def outputs(self, stage):
+        ''' Files a stage writes '''
+
+        if stage == "figures":
+            return [self.path(os.path.join("figures", v + ".pdf")) for v in self.params["figure_variables"]]
+        return [self.path({"read": "inputs.json", "components": "components.nc", "global_means": "global_means.nc",
+                           "significance": "significance.nc"}[stage])]
+
+    def up_to_date(self, stage, sig):
+        return (not self.force and self.state.get(stage) == sig
+                and all(os.path.exists(p) for p in self.outputs(stage)))
+
+    def step(self, stage, params, inputs, func):
+        ''' Run func unless the stage is up to date; returns the stage signature '''
+
+        sig = signature(stage, params, inputs)
+        if self.up_to_date(stage, sig):
+            self.log.append((self.source_id, stage, "up to date", 0.0))
+        elif self.dry_run:
+            self.log.append((self.source_id, stage, "to run", 0.0))
+        else:
+            start = time.perf_counter()
+            func()
+            self.state[stage] = sig
+            write_json(self.state_file, self.state)
+            self.log.append((self.source_id, stage, "done", time.perf_counter() - start))
+        return sig
+
+    def run(self):
+        ''' Run all stages of this model; returns a list of (model, stage, status, seconds) '''
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.log = []
+        p = self.params
+        catalog = Catalog.load(self.index_file)
+        files = {experiment: catalog.files(self.source_id, p[experiment], member_id=p["member_id"])
+                 for experiment in ("aerosol_experiment", "control_experiment")}
+        paths = [path for by_variable in files.values() for variable in by_variable for path in by_variable[variable]]
+
+        read = self.step("read", {k: p[k] for k in ("aerosol_experiment", "control_experiment", "member_id")},
+                         ResultCache.file_identity(paths), lambda: self._read(files))
+        components = self.step("components", {k: p[k] for k in ("chunk_time", "keepbits")}, [read], lambda: self._components(files))
+        self.step("global_means", {}, [components], self._global_means)
+        significance = self.step("significance", {}, [components], self._significance)
+        self.step("figures", {"alpha": p["alpha"], "figure_variables": p["figure_variables"]},
+                  [components, significance], self._figures)
+        return self.log
+
+    def _read(self, files):
+        write_json(self.path("inputs.json"), files)
+
+    def _open(self, files, experiment):
+        paths = [path for variable in files[experiment] for path in files[experiment][variable]]
+        chunks = {"time": self.params["chunk_time"]} if self.params["chunk_time"] else None
+        return xr.open_mfdataset(paths, chunks=chunks, compat="override")
+
+    def _components(self, files):
+        data_aerosols = self._open(files, "aerosol_experiment")
+        data_control = self._open(files, "control_experiment")
+        components = compute_all_components(data_aerosols, data_control)
+        for name in ("lat_bnds", "lon_bnds"):
+            if name in data_control.variables:
+                components[name] = data_control[name].isel(time=0, drop=True) if "time" in data_control[name].dims else data_control[name]
+        components.attrs.update(source_id=self.source_id, aerosol_experiment=self.params["aerosol_experiment"],
+                                control_experiment=self.params["control_experiment"])
+        write_forcings(components.compute(), self.path("components.nc"), keepbits=self.params["keepbits"])
+
+    def _global_means(self):
+        with xr.open_dataset(self.path("components.nc")) as components:
+            means = xr.Dataset({name: time_series(components, components[name], plot=False)
+                                for name in components.data_vars if components[name].ndim == 3})
+            means.attrs = components.attrs
+            _atomic_netcdf(means.compute(), self.path("global_means.nc"))
+
+    def _significance(self):
+        ''' One sample t-test of the annual means against zero at every cell '''
+
+        with xr.open_dataset(self.path("components.nc")) as components:
+            annual = annual_mean(components)
+            n = annual.sizes["year"]
+            result = xr.Dataset(coords={"lat": components["lat"], "lon": components["lon"]})
+            for name in components.data_vars:
+                if components[name].ndim != 3:
+                    continue
+                t_statistics, p_value = t_test_nd(annual[name].values, n, 0)
+                result[name + "_t"] = (("lat", "lon"), t_statistics)
+                result[name + "_p"] = (("lat", "lon"), p_value)
+            result.attrs = dict(components.attrs, years=n)
+            _atomic_netcdf(result, self.path("significance.nc"))
+
+    def _figures(self):
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+        from .plot import plot_data, plot_significance
+
+        os.makedirs(self.path("figures"), exist_ok=True)
+        with xr.open_dataset(self.path("components.nc")) as components, \
+                xr.open_dataset(self.path("significance.nc")) as significance:
+            for name, output in zip(self.params["figure_variables"], self.outputs("figures")):
+                cs = plot_data(components, components[name], dtype="xarray",
+                               title="{} {}".format(self.source_id, name.replace("_", " ")))
+                plot_significance(significance[name + "_p"].values, components, ax=cs.axes, alpha=self.params["alpha"])
+                with atomic_path(output, keep_extension=True) as tmp_output:
+                    plt.savefig(tmp_output, bbox_inches='tight', transparent=True)
+                plt.close("all")
+
+def _run_branch(args):
+    source_id, index_file, out, params, force, dry_run = args
+    return Branch(source_id, index_file, out, params, force=force, dry_run=dry_run).run()
+
+def run(root, out, models=None, index_file=None, jobs=1, force=False, scan=True, dry_run=False, **params):
+    ''' Run the pipeline for several models
+        Parameters:
+        -----------
+        root:       string
+                    directory with the CMIP6 files
+        out:        string
+                    output directory; one sub-directory per model
+        models:     list of strings
+                    source_ids. Default None: every model with both experiments in the catalog
+        index_file: string
+                    catalog index. Default: <out>/index.json
+        jobs:       integer
+                    number of models processed in parallel. Default: 1
+        force:      boolean
+                    rerun every stage. Default: False
+        scan:       boolean
+                    rescan root for new or changed files (the catalog stage). Default: True
+        dry_run:    boolean
+                    only report which stages would run. Default: False
+        params:     see DEFAULTS
+
+        Returns:
+        --------
+        log: list of (model, stage, status, seconds)
+    '''
+
+    os.makedirs(out, exist_ok=True)
+    index_file = index_file or os.path.join(out, "index.json")
+    params = dict(DEFAULTS, **params)
+
+    log = []
+    start = time.perf_counter()
+    if scan or not os.path.exists(index_file):
+        catalog = Catalog.build(root, index_file)
+        log.append(("*", "catalog", "done", time.perf_counter() - start))
+    else:
+        catalog = Catalog.load(index_file)
+        log.append(("*", "catalog", "up to date", 0.0))
+
+    if models is None:
+        models = sorted(set(e["source_id"] for e in catalog.search(experiment_id=params["aerosol_experiment"]))
+                        & set(e["source_id"] for e in catalog.search(experiment_id=params["control_experiment"])))
+
+    tasks = [(source_id, index_file, out, params, force, dry_run) for source_id in models]
+    if jobs <= 1 or len(tasks) <= 1:
+        results = map(_run_branch, tasks)
+    else:
+        pool = ProcessPoolExecutor(max_workers=jobs)
+        results = pool.map(_run_branch, tasks)
+    try:
+        for result in results:
+            log.extend(result)
+    finally:
+        if jobs > 1 and len(tasks) > 1:
+            pool.shutdown()
+    return log
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="forcing-tools", description="radiative forcing from CMIP6 RFMIP data")
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("run", help="run the incremental pipeline, skipping up-to-date stages",
+                                  description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    command.add_argument("--root", required=True, help="directory with the CMIP6 files")
+    command.add_argument("--out", required=True, help="output directory")
+    command.add_argument("--models", nargs="+", default=None, help="source_ids. Default: all models found")
+    command.add_argument("--index", default=None, help="catalog index file. Default: <out>/index.json")
+    command.add_argument("--jobs", type=int, default=1, help="models processed in parallel")
+    command.add_argument("--aerosol-experiment", default=DEFAULTS["aerosol_experiment"])
+    command.add_argument("--control-experiment", default=DEFAULTS["control_experiment"])
+    command.add_argument("--member", default=None, help="realization. Default: the first one found")
+    command.add_argument("--chunk-time", type=int, default=None, help="dask chunks along time")
+    command.add_argument("--keepbits", type=int, default=None,
+                         help="mantissa bits kept in the stored components (see writer.quantize). Default: lossless")
+    command.add_argument("--alpha", type=float, default=DEFAULTS["alpha"], help="significance level of the hatching")
+    command.add_argument("--figure-variables", nargs="+", default=list(DEFAULTS["figure_variables"]))
+    command.add_argument("--force", action="store_true", help="rerun every stage")
+    command.add_argument("--no-scan", action="store_true", help="reuse the catalog index without rescanning root")
+    command.add_argument("--dry-run", action="store_true", help="only show which stages would run")
+    args = parser.parse_args(argv)
+
+    log = run(args.root, args.out, models=args.models, index_file=args.index, jobs=args.jobs, force=args.force,
+              scan=not args.no_scan, dry_run=args.dry_run, aerosol_experiment=args.aerosol_experiment,
+              control_experiment=args.control_experiment, member_id=args.member, chunk_time=args.chunk_time,
+              keepbits=args.keepbits, alpha=args.alpha, figure_variables=tuple(args.figure_variables))
+    for model, stage, status, seconds in log:
+        print("{:<20s} {:<14s} {:<11s} {:>8.2f} s".format(model, stage, status, seconds))
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,14 @@
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from netCDF4 import Dataset
 import xarray as xr
 import dask as ds
+from .atomic import atomic_path
+from .trace import traced
+import matplotlib
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
 from matplotlib.colors import from_levels_and_colors
@@ -9,14 +16,17 @@ from pylab import *
 import cartopy.crs as ccrs
 from cartopy.util import add_cyclic_point
 
-def plot_data(dataset, data_var, dtype="ndarray", ticks=None, colors=None, levels=None, title=None, figname=None):
+@traced
+def plot_data(dataset, data_var, dtype="ndarray", ticks=None, colors=None, levels=None, title=None, figname=None,
+              coastlines=True):
     '''Plot time averaged data on a Mollweide map using xarray DataArray or numpy array
     Parameters:
     ----------
     dataset:    xarray Dataset
                 must contain dimensions of time, lat and lon
     data_var:   xarray DataArray or a numpy ndArray
-                has to have three dimensions including time
+                has to have three dimensions including time. Can be dask-backed;
+                the time mean is computed once and only the 2D mean is padded and plotted
     dtype:      string
                 can be either an ndarray or an xarray. Default: ndarray
     ticks:      list
@@ -32,6 +42,8 @@ def plot_data(dataset, data_var, dtype="ndarray", ticks=None, colors=None, level
                 Default is None
     figname:    string
                 use to save figure with transparent background and tight borders. Deafult is None.
+    coastlines: boolean
+                draw the Natural Earth coastlines; False when they cannot be downloaded (offline). Default: True
     
     Returns:
     --------
@@ -39,28 +51,28 @@ def plot_data(dataset, data_var, dtype="ndarray", ticks=None, colors=None, level
     '''
                 
 
+    # reduce over time once; the 2D mean is reused for the norm, the cyclic point and the contours
     if dtype == "ndarray":
-        vmax = np.max(np.mean(data_var, axis=0))
-        vmin = np.min(np.mean(data_var, axis=0))
-        var = data_var
+        var = np.mean(data_var, axis=0)
+        if hasattr(var, "compute"):  # dask array
+            var = var.compute()
     else:
-        vmax = np.max(np.mean(data_var, axis=0))
-        # (data_var.mean("year").values)
-        vmin = np.min(np.mean(data_var, axis=0))
-        var = data_var.values
+        var = data_var.mean(dim=data_var.dims[0], skipna=False).values
 
+    vmax = np.nanmax(var)
+    vmin = np.nanmin(var)
     v_ext = np.max([np.abs(vmin), np.abs(vmax)])
     norm = mcolors.TwoSlopeNorm(vmin=-v_ext, vmax=v_ext, vcenter=0)
-    cmap = cm.get_cmap('RdBu_r', 20)
 
     fig = plt.figure(figsize=(9, 7))
     ax = fig.add_subplot(1, 1, 1, projection=ccrs.Mollweide())
     ax.set_global()
-    ax.coastlines()
+    if coastlines:
+        ax.coastlines()
     val, ll = add_cyclic_point(var, coord=dataset.lon.values)
 
     if colors is not None:
-        cs = ax.contourf(ll, dataset.lat.values, np.mean(val, axis=0), norm=norm,
+        cs = ax.contourf(ll, dataset.lat.values, val, norm=norm,
                          transform=ccrs.PlateCarree(), colors=colors, levels=levels, extend='both')
         plt.colorbar(cs, shrink=0.8, fraction=0.046, pad=0.04,
                      label=r"$\mathrm{Wm}^{-2}$", orientation='horizontal', ticks=ticks)
@@ -68,8 +80,8 @@ def plot_data(dataset, data_var, dtype="ndarray", ticks=None, colors=None, level
         cs.cmap.set_over("#67001f")
 
     else:
-        cs = ax.contourf(ll, dataset.lat.values, np.mean(
-            val, axis=0), norm=norm, transform=ccrs.PlateCarree(), cmap='RdBu_r')
+        cs = ax.contourf(ll, dataset.lat.values, val, norm=norm,
+                         transform=ccrs.PlateCarree(), cmap='RdBu_r')
         plt.colorbar(cs, shrink=0.8, fraction=0.046, pad=0.04, extendrect=True,
                      label=r"$\mathrm{Wm}^{-2}$", orientation='horizontal')
 
@@ -81,7 +93,9 @@ def plot_data(dataset, data_var, dtype="ndarray", ticks=None, colors=None, level
 
     return cs
 
-def plot_annual_data(dataset, data_var, dtype="ndarray", ax=None, ticks=None, colors=None, levels=None,title=None,figname=None):
+@traced
+def plot_annual_data(dataset, data_var, dtype="ndarray", ax=None, ticks=None, colors=None, levels=None,title=None,figname=None,
+                     coastlines=True):
     '''Plot data on a Mollweide map using xarray DataArray or numpy array
     Parameters:
     ----------
@@ -104,6 +118,8 @@ def plot_annual_data(dataset, data_var, dtype="ndarray", ax=None, ticks=None, co
                 Default is None
     figname:    string
                 use to save figure with transparent background and tight borders. Deafult is None.
+    coastlines: boolean
+                draw the Natural Earth coastlines; False when they cannot be downloaded (offline). Default: True
     
     Returns:
     --------
@@ -121,10 +137,10 @@ def plot_annual_data(dataset, data_var, dtype="ndarray", ax=None, ticks=None, co
 
     v_ext = np.max([np.abs(vmin), np.abs(vmax)])
     norm = mcolors.TwoSlopeNorm(vmin=-v_ext, vmax=v_ext, vcenter=0)
-    cmap = cm.get_cmap('RdBu_r', 20)
 
     ax.set_global()
-    ax.coastlines()
+    if coastlines:
+        ax.coastlines()
     val, ll = add_cyclic_point(var, coord=data_var.lon.values)
 
     if colors is not None:
@@ -142,4 +158,114 @@ def plot_annual_data(dataset, data_var, dtype="ndarray", ax=None, ticks=None, co
     if figname is not None:
         plt.savefig(figname + ".pdf", bbox_inches='tight', transparent=True)
 
-    return cs
\ No newline at end of file
+    return cs
+
+@traced
+def plot_significance(p_value, dataset=None, ax=None, alpha=0.05, hatch="...", rasterized=False):
+    '''Hatch the cells where a test is significant as a single contourf layer
+    Draw it on top of plot_data (ax=cs.axes) or plot_annual_data (same ax). Unlike one marker per grid cell,
+    render time and file size do not grow with the number of cells.
+    Parameters:
+    ----------
+    p_value:    xarray DataArray or a numpy ndArray
+                p-values with dimensions (lat, lon), e.g. from stats.t_test
+    dataset:    xarray Dataset
+                must contain lat and lon. Default: None (coordinates of p_value)
+    ax:         cartopy GeoAxes
+                axes to draw on. Default: None (current axes)
+    alpha:      float
+                significance level; cells with p_value <= alpha are hatched. Default: 0.05
+    hatch:      string
+                matplotlib hatch pattern. Default: "..."
+    rasterized: boolean
+                rasterize the hatch layer in vector output. Default: False
+    
+    Returns:
+    --------
+    cs:         hatched contour set
+    '''
+
+    coords = dataset if dataset is not None else p_value
+    if ax is None:
+        ax = plt.gca()
+
+    val, ll = add_cyclic_point(np.asarray(p_value), coord=coords.lon.values)
+    cs = ax.contourf(ll, coords.lat.values, val, levels=[0, alpha, 1], hatches=[hatch, None],
+                     colors='none', transform=ccrs.PlateCarree())
+    if rasterized:
+        cs.set_rasterized(True)
+
+    return cs
+
+def _reduce_job(job):
+    '''Reduce a batch job to what its worker needs: the 2D time mean and the lat/lon coordinates'''
+
+    field = job["field"]
+    coords = job.get("dataset", field)
+    if isinstance(coords, np.ndarray):
+        raise ValueError("a numpy field needs a 'dataset' with lat and lon")
+    if field.ndim == 3:
+        if isinstance(field, np.ndarray):
+            field = np.mean(field, axis=0)
+        else:
+            field = field.mean(dim=field.dims[0], skipna=False)
+    if hasattr(field, "compute"):  # dask-backed DataArray: computed here, only the 2D mean is pickled
+        field = field.compute()
+    field = np.asarray(field)
+
+    reduced = dict(job, field=field)
+    reduced["dataset"] = xr.Dataset(coords={"lat": coords.lat.values, "lon": coords.lon.values})
+    return reduced
+
+def _render_job(job):
+    '''Render one batch job reduced by _reduce_job with the non-interactive Agg backend and write the PDF atomically'''
+
+    matplotlib.use("Agg")
+
+    start = time.perf_counter()
+    # plot_data averages over the first dimension; the mean over a single step is the field itself
+    field = job["field"][np.newaxis]
+    plot_data(job["dataset"], field, dtype="ndarray", ticks=job.get("ticks"), colors=job.get("colors"),
+              levels=job.get("levels"), title=job.get("title"), coastlines=job.get("coastlines", True))
+
+    output = job["output"]
+    if not output.endswith(".pdf"):
+        output = output + ".pdf"
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with atomic_path(output, keep_extension=True) as tmp_output:
+        plt.savefig(tmp_output, bbox_inches='tight', transparent=True)
+    plt.close("all")
+    return output, time.perf_counter() - start
+
+@traced
+def render_batch(jobs, max_workers=None):
+    '''Render many maps with plot_data in a process pool and save them as PDFs
+    Parameters:
+    ----------
+    jobs:        list of dicts
+                 one dict per figure with the keys
+                 field:   xarray DataArray or numpy array, (time, lat, lon) or (lat, lon); the time mean is
+                          plotted. It is computed here, so only the 2D mean is sent to the workers
+                 output:  file name of the PDF (".pdf" is appended if missing)
+                 levels, colors, ticks, title, coastlines: optional, as in plot_data
+                 dataset: xarray Dataset with lat and lon, required for numpy fields; Default: the field itself
+    max_workers: integer
+                 number of processes. Default: None (number of cores)
+    
+    Returns:
+    --------
+    results:     list of (output, seconds) in the order of jobs
+                 figures are written atomically
+    '''
+
+    missing = [i for i, job in enumerate(jobs) if "field" not in job or "output" not in job]
+    if missing:
+        raise ValueError("jobs {} need a 'field' and an 'output'".format(missing))
+    jobs = [_reduce_job(job) for job in jobs]
+
+    # spawn: fresh interpreters without the parent's interactive matplotlib state
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as pool:
+        return list(pool.map(_render_job, jobs))
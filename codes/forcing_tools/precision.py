@@ -0,0 +1,77 @@
+import contextlib
+import numpy as np
+import xarray as xr
+
+# reductions (global means, variances, ensemble moments) always accumulate in this type
+ACCUMULATOR = np.float64
+
+# field dtype of the package; None keeps the dtype of the input data
+_POLICY = {"fields": None}
+
+def set_precision(fields=None):
+    ''' Set the precision policy of forcing_tools
+        Parameters:
+        -----------
+        fields: string or numpy dtype
+                dtype of field arithmetic (forcings, anomalies, ensemble means), e.g. 'float32' to keep
+                CMIP6 fluxes in single precision end to end; global means and variances still accumulate
+                in float64. Default: None (keep the dtype of the input, the behaviour without a policy)
+
+        Returns:
+        --------
+        previous: the previous field dtype (or None)
+    '''
+
+    if fields is not None:
+        fields = np.dtype(fields)
+        if fields.kind != "f":
+            raise ValueError("field precision must be a floating point type, not {}".format(fields))
+    previous = _POLICY["fields"]
+    _POLICY["fields"] = fields
+    return previous
+
+@contextlib.contextmanager
+def precision(fields):
+    ''' Use a field precision inside a with block, e.g. with precision("float32"): ... '''
+
+    previous = set_precision(fields)
+    try:
+        yield
+    finally:
+        _POLICY["fields"] = previous
+
+def field_dtype():
+    ''' Field dtype of the current policy, None if the input dtype is kept '''
+
+    return _POLICY["fields"]
+
+def _cast(data, dtype, variables=None):
+    if isinstance(data, xr.Dataset):
+        names = [name for name in (variables if variables is not None else data.data_vars)
+                 if name in data and data[name].dtype.kind == "f" and data[name].dtype != dtype]
+        return data.assign({name: data[name].astype(dtype) for name in names}) if names else data
+    if getattr(data, "dtype", None) is not None and data.dtype.kind == "f" and data.dtype != dtype:
+        return data.astype(dtype)
+    return data
+
+def as_field(data, variables=None):
+    ''' Cast floating point data to the field dtype of the policy; a no-op without a policy
+        Parameters:
+        -----------
+        data:      xarray.Dataset, xarray.DataArray or numpy (masked) array; dask-backed data stay lazy
+        variables: list of strings
+                   variables of a Dataset to cast. Default: None (all floating point data variables)
+
+        Returns:
+        --------
+        data: same type as data; arrays already in the field dtype are not copied
+    '''
+
+    if _POLICY["fields"] is None:
+        return data
+    return _cast(data, _POLICY["fields"], variables)
+
+def as_accumulator(data):
+    ''' Cast floating point data to the float64 accumulator type, e.g. for running moments '''
+
+    return _cast(data, ACCUMULATOR)
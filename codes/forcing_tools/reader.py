@@ -0,0 +1,252 @@
+import re
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import xarray as xr
+from netCDF4 import Dataset, default_fillvals
+from .trace import traced
+from .precision import as_accumulator, as_field, field_dtype
+
+MEMBER_PATTERN = re.compile(r"^r(\d+)(i\d+p\d+f\d+)$")
+
+def merged_members(members):
+    ''' Return the members that are pre-merged ensembles rather than single realizations
+        Some groups publish several realizations merged into one file under a member_id joining their
+        indices, e.g. IPSL-CM6A-LR r1234i1p1f1 (r1 to r4) or MPI-ESM1-2-LR r123i1p1f1. A member is taken
+        as merged when its realization index has at least two digits in strictly increasing order and
+        no other member with the same i/p/f reaches a two digit index (an ensemble really holding r12
+        also holds r10 and r11).
+        Parameters:
+        -----------
+        members: list of strings
+                 member_ids of one model and experiment, e.g. from Catalog.members
+
+        Returns:
+        --------
+        merged:  list of strings
+                 the merged member_ids, sorted
+    '''
+
+    parsed = {m: MEMBER_PATTERN.match(m) for m in members}
+    merged = []
+    for member, match in parsed.items():
+        if match is None or len(match.group(1)) < 2:
+            continue
+        digits = match.group(1)
+        if any(a >= b for a, b in zip(digits, digits[1:])):
+            continue
+        others = [int(o.group(1)) for m, o in parsed.items()
+                  if o is not None and m != member and o.group(2) == match.group(2)]
+        if all(index < 10 for index in others):
+            merged.append(member)
+    return sorted(merged)
+
+def _reject_merged(members):
+    ''' Raise if a pre-merged member would be stacked with other members '''
+
+    merged = merged_members(members) if len(members) > 1 else []
+    if merged:
+        raise ValueError("members {} hold several realizations merged into one file and would be counted "
+                         "more than once".format(", ".join(merged)))
+
+@traced
+def open_ensemble(files_by_member, chunks=None, parallel=True):
+    ''' Open the realizations of one model and experiment lazily along a new 'realization' dimension
+        Parameters:
+        -----------
+        files_by_member: dict
+                         member_id -> list of files (or dict variable -> list of files as returned by Catalog.files).
+                         A pre-merged member (see merged_members) cannot be ensembled with other members.
+        chunks:          dict
+                         chunks per member passed to xr.open_mfdataset. Default: None (one chunk per file)
+        parallel:        boolean
+                         open files in parallel with dask. Default: True
+
+        Returns:
+        --------
+        data: xarray.Dataset
+              usually dim=(realization, time, lat, lon); every member is its own chunk along realization
+    '''
+
+    members = list(files_by_member)
+    _reject_merged(members)
+    datasets = []
+    for member in members:
+        files = files_by_member[member]
+        if isinstance(files, dict):
+            files = [path for variable in files for path in files[variable]]
+        datasets.append(xr.open_mfdataset(files, chunks=chunks, parallel=parallel, compat="override"))
+
+    data = xr.concat(datasets, dim="realization", coords="minimal", compat="override")
+    return data.assign_coords(realization=members)
+
+@traced
+def ensemble_mean(data, dim="realization"):
+    ''' Compute the ensemble mean and inter-member spread with an online (Welford) accumulator
+        Members are folded in one at a time, so for dask-backed data only one chunk per member and the
+        running mean/variance are held in memory when the result is computed.
+        Parameters:
+        -----------
+        data: xarray.Dataset or xarray.DataArray
+              ensemble, e.g. from open_ensemble; usually dim=(realization, time, lat, lon)
+        dim:  string
+              ensemble dimension. Default: 'realization'
+
+        Returns:
+        --------
+        mean:   same type as data without dim
+                ensemble mean of the floating point variables with dim; other variables (e.g. time_bnds)
+                are those of the first member
+        spread: same type as data without dim
+                inter-member standard deviation (ddof=1); zero for a single member
+    '''
+
+    n_members = data.sizes[dim]
+    if n_members == 0:
+        raise ValueError("ensemble has no members along '{}'".format(dim))
+    if isinstance(data, xr.DataArray):
+        return _welford(data, dim, n_members)
+
+    # bounds (time_bnds is datetime) and other non-float variables are taken from the first member
+    folded = [name for name, v in data.data_vars.items() if dim in v.dims and v.dtype.kind == "f"]
+    first = data.drop_vars(folded).isel({dim: 0}, drop=True, missing_dims="ignore")
+    moments = {name: _welford(data[name], dim, n_members) for name in folded}
+    mean = first.assign({name: m for name, (m, _) in moments.items()})
+    spread = first.assign({name: s for name, (_, s) in moments.items()})
+    return mean, spread
+
+def _welford(data, dim, n_members):
+    ''' Ensemble mean and spread of one floating point DataArray, one member at a time '''
+
+    mean = data.isel({dim: 0}, drop=True)
+    if field_dtype() is not None:
+        mean = as_accumulator(mean)  # running moments in float64, results in the field precision
+    m2 = xr.zeros_like(mean)
+    for count in range(2, n_members + 1):
+        member = data.isel({dim: count - 1}, drop=True)
+        delta = member - mean
+        mean = mean + delta / count
+        m2 = m2 + delta * (member - mean)
+
+    spread = np.sqrt(m2 / max(n_members - 1, 1))
+    return as_field(mean), as_field(spread)
+
+def _fill_nan(variable, dtype=None):
+    ''' Read a netCDF4 variable as a plain float array with _FillValue/missing_value set to NaN
+        No mask is built: the fill values are compared on the raw (packed) data and only cells
+        holding one are overwritten, so a variable without fills is returned as read.
+    '''
+
+    variable.set_auto_maskandscale(False)
+    raw = variable[:]
+    attrs = variable.ncattrs()
+    fills = []
+    if "_FillValue" in attrs:
+        fills.append(variable.getncattr("_FillValue"))
+    elif raw.dtype.itemsize > 1 and raw.dtype.str[1:] in default_fillvals:
+        fills.append(default_fillvals[raw.dtype.str[1:]])  # netCDF4 masks the default fill as well
+    if "missing_value" in attrs:
+        fills.extend(np.atleast_1d(variable.getncattr("missing_value")))
+
+    missing = None
+    for fill in fills:
+        hit = raw == fill
+        if hit.any():
+            missing = hit if missing is None else missing | hit
+
+    scale = variable.getncattr("scale_factor") if "scale_factor" in attrs else None
+    offset = variable.getncattr("add_offset") if "add_offset" in attrs else None
+    if dtype is None:
+        dtype = np.result_type(raw.dtype, *(np.asarray(a).dtype for a in (scale, offset) if a is not None), np.float32)
+    # raw is a fresh array owned here, so it is unpacked in place when no cast is needed
+    values = raw.astype(dtype, copy=False)
+    if scale is not None:
+        values *= dtype.type(scale)
+    if offset is not None:
+        values += dtype.type(offset)
+    if missing is not None:
+        values[missing] = np.nan
+    return np.ascontiguousarray(values)
+
+def _read_file(path, variable, coords, dtype=None, fill_nan=False):
+    ''' Read one variable and its coordinates from a NetCDF file and time it '''
+
+    start = time.perf_counter()
+    with Dataset(path) as nc:
+        if fill_nan:
+            values = _fill_nan(nc.variables[variable], None if dtype is None else np.dtype(dtype))
+            coord_values = {c: _fill_nan(nc.variables[c]) if nc.variables[c].dtype.kind == "f" else nc.variables[c][:]
+                            for c in coords if c in nc.variables}
+        else:
+            values = nc.variables[variable][:]
+            if dtype is not None and values.dtype != dtype:
+                values = values.astype(dtype)  # e.g. packed data unpacked to float64 by netCDF4
+            coord_values = {c: nc.variables[c][:] for c in coords if c in nc.variables}
+    return values, coord_values, time.perf_counter() - start
+
+@traced
+def read_files(files, max_workers=1, coords=("time", "lat", "lon"), dtype=None, fill_nan=False):
+    ''' Read several NetCDF variables, one after another unless a process pool is asked for
+        Coordinates of all files are compared once every read has finished. Reading serially is the
+        default: netCDF-C/HDF5 reads are not thread-safe, and spawning worker processes and pickling
+        the arrays back cost more than they save for the usual 10 CMIP files on a local disk
+        (benchmarks/run.py times both as read_netcdf and read_netcdf_pool). For lazy reads use
+        Catalog.open_dataset instead.
+        Parameters:
+        -----------
+        files:         dict
+                       name -> (path, variable), e.g. {"rsdt_aer": ("rsdt_Amon_....nc", "rsdt")}
+        max_workers:   integer
+                       size of a process pool reading files at the same time; 1 reads them one after another.
+                       Only worth it when reads are slow compared to the transfer back (e.g. network
+                       file systems). Default: 1
+        coords:        tuple of strings
+                       coordinates read from every file and checked for consistency. Default: ("time", "lat", "lon")
+        dtype:         string or numpy dtype
+                       dtype of the returned variables. Default: None (the precision policy, see
+                       precision.set_precision, or the dtype netCDF4 returns if no policy is set)
+        fill_nan:      boolean
+                       return plain contiguous float arrays with _FillValue/missing_value set to NaN instead of
+                       numpy masked arrays; arithmetic and means then skip the masked-array code paths and
+                       no mask is held in memory. Default: False
+
+        Returns:
+        --------
+        data:    dict
+                 name -> array as returned by netCDF4 (or a float array with NaN if fill_nan),
+                 plus the coordinates of the first file
+        timings: list of dicts
+                 per file 'name', 'path', 'seconds' and 'nbytes', in the order of files
+    '''
+
+    names = list(files)
+    if not names:
+        return {}, []
+    dtype = dtype if dtype is not None else field_dtype()  # resolved here, workers do not share the policy
+    if max_workers is None or max_workers <= 1:
+        results = [_read_file(files[name][0], files[name][1], coords, dtype, fill_nan) for name in names]
+    else:
+        # spawn: a forked worker would inherit the netCDF-C/HDF5 state of the parent
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(names)),
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [pool.submit(_read_file, files[name][0], files[name][1], coords, dtype, fill_nan) for name in names]
+            results = [future.result() for future in futures]
+
+    data = {}
+    timings = []
+    reference = None
+    for name, (values, coord_values, seconds) in zip(names, results):
+        if reference is None:
+            reference = (name, coord_values)
+            data.update(coord_values)
+        else:
+            mismatch = [c for c in coords
+                        if (c in coord_values) != (c in reference[1])
+                        or (c in coord_values and not np.array_equal(coord_values[c], reference[1][c]))]
+            if mismatch:
+                raise ValueError("coordinates {} of '{}' differ from '{}'".format(", ".join(mismatch), name, reference[0]))
+        data[name] = values
+        timings.append({"name": name, "path": files[name][0], "seconds": seconds, "nbytes": values.nbytes})
+
+    return data, timings
@@ -0,0 +1,137 @@
+import os
+import numpy as np
+import xarray as xr
+from scipy import sparse
+from .atomic import atomic_path
+from .grid import cell_bounds, grid_fingerprint, lon_intervals
+
+# (source fingerprint, target fingerprint) -> weights
+_WEIGHTS = {}
+
+def _overlap(source_bnds, target_bnds, period=None):
+    ''' Length of the overlap of every target interval (rows) with every source interval (columns)
+        Periodic (longitude) intervals start in [0, period) and may wrap, e.g. [359.5, 0.5]
+    '''
+
+    if period is None:
+        src = np.sort(source_bnds, axis=1)
+        dst = np.sort(target_bnds, axis=1)
+    else:
+        src, dst = (np.stack([west, west + width], axis=1) for west, width in map(lon_intervals, (source_bnds, target_bnds)))
+    shifts = (0.0,) if period is None else (-period, 0.0, period)
+    overlap = np.zeros((dst.shape[0], src.shape[0]))
+    for shift in shifts:
+        lower = np.maximum(dst[:, None, 0], src[None, :, 0] + shift)
+        upper = np.minimum(dst[:, None, 1], src[None, :, 1] + shift)
+        overlap += np.clip(upper - lower, 0, None)
+    return overlap
+
+def conservative_weights(source, target, cache_dir=None):
+    ''' First-order conservative regridding weights between two lat/lon grids
+        The overlap area of two cells on a sphere is separable in latitude (difference of sin(lat)) and
+        longitude, so the weights are the Kronecker product of two 1D overlap matrices, normalised by the
+        covered area of each target cell.
+        Parameters:
+        -----------
+        source:    xarray.Dataset or xarray.DataArray
+                   source grid; 'lat'/'lon' and optionally 'lat_bnds'/'lon_bnds'
+        target:    xarray.Dataset or xarray.DataArray
+                   target grid, e.g. from grid.global_grid
+        cache_dir: string
+                   directory to store the weights as .npz keyed by both grid fingerprints. Default: None (memory only)
+
+        Returns:
+        --------
+        weights:   scipy.sparse.csr_matrix
+                   shape (n_target_lat * n_target_lon, n_source_lat * n_source_lon)
+    '''
+
+    src_lat_bnds, src_lon_bnds = cell_bounds(source)
+    dst_lat_bnds, dst_lon_bnds = cell_bounds(target)
+    key = (grid_fingerprint(source["lat"].values, source["lon"].values, src_lat_bnds, src_lon_bnds),
+           grid_fingerprint(target["lat"].values, target["lon"].values, dst_lat_bnds, dst_lon_bnds))
+    if key in _WEIGHTS:
+        return _WEIGHTS[key]
+
+    path = os.path.join(cache_dir, "conservative_{}_{}.npz".format(*key)) if cache_dir is not None else None
+    if path is not None and os.path.exists(path):
+        weights = sparse.load_npz(path).tocsr()
+    else:
+        lat_overlap = _overlap(np.sin(np.deg2rad(src_lat_bnds)), np.sin(np.deg2rad(dst_lat_bnds)))
+        lon_overlap = _overlap(src_lon_bnds, dst_lon_bnds, period=360.0)
+        weights = sparse.kron(sparse.csr_matrix(lat_overlap), sparse.csr_matrix(lon_overlap), format="csr")
+        covered = np.asarray(weights.sum(axis=1)).ravel()
+        scale = np.divide(1.0, covered, out=np.zeros_like(covered), where=covered > 0)
+        weights = (sparse.diags(scale) @ weights).tocsr()
+        weights.eliminate_zeros()
+        if path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            with atomic_path(path, keep_extension=True) as tmp_path:
+                sparse.save_npz(tmp_path, weights)
+
+    _WEIGHTS[key] = weights
+    return weights
+
+def _apply_weights(values, weights, shape):
+    ''' Regrid the last two axes of values with a sparse weight matrix; NaNs are left out and renormalised '''
+
+    leading = values.shape[:-2]
+    flat = values.reshape(-1, values.shape[-2] * values.shape[-1]).T
+    missing = np.isnan(flat)
+    if missing.any():
+        result = weights @ np.where(missing, 0, flat)
+        covered = weights @ (~missing).astype(flat.dtype)
+        result = np.divide(result, covered, out=np.full_like(result, np.nan), where=covered > 0)
+    else:
+        result = weights @ flat
+        empty = np.asarray(weights.sum(axis=1)).ravel() == 0
+        result[empty] = np.nan
+    return result.T.reshape(leading + shape).astype(values.dtype, copy=False)
+
+def regrid(data, target, cache_dir=None):
+    ''' Conservatively regrid data onto the lat/lon grid of target
+        Applied chunk by chunk as one sparse matrix product per chunk; lat and lon are merged into a single
+        chunk, other dimensions (e.g. time) keep their chunks.
+        Parameters:
+        -----------
+        data:      xarray.DataArray or xarray.Dataset
+                   field(s) with 'lat' and 'lon' dimensions, e.g. dim=(time, lat, lon)
+        target:    xarray.Dataset or xarray.DataArray
+                   target grid, e.g. grid.global_grid(2.0) or a dataset of another model
+        cache_dir: string
+                   directory for cached weights. Default: None
+
+        Returns:
+        --------
+        regridded: same type as data on the target grid; variables without lat/lon are kept,
+                   bounds variables of the source grid are dropped
+    '''
+
+    weights = conservative_weights(data, target, cache_dir=cache_dir)
+    shape = (target.sizes["lat"], target.sizes["lon"])
+
+    def _regrid_array(array):
+        if array.chunks is not None:
+            array = array.chunk({"lat": -1, "lon": -1})
+        out = xr.apply_ufunc(_apply_weights, array, kwargs={"weights": weights, "shape": shape},
+                             input_core_dims=[["lat", "lon"]], output_core_dims=[["lat_new", "lon_new"]],
+                             exclude_dims={"lat", "lon"}, dask="parallelized", output_dtypes=[array.dtype],
+                             dask_gufunc_kwargs={"output_sizes": {"lat_new": shape[0], "lon_new": shape[1]}},
+                             keep_attrs=True)
+        out = out.rename({"lat_new": "lat", "lon_new": "lon"})
+        return out.assign_coords(lat=target["lat"], lon=target["lon"])
+
+    if isinstance(data, xr.DataArray):
+        return _regrid_array(data)
+
+    bounds = {data[c].attrs.get("bounds") for c in ("lat", "lon")} | {"lat_bnds", "lon_bnds"}
+    variables = {}
+    for name, variable in data.data_vars.items():
+        if name in bounds:
+            continue
+        if "lat" in variable.dims and "lon" in variable.dims:
+            variables[name] = _regrid_array(variable)
+        elif "lat" not in variable.dims and "lon" not in variable.dims:
+            variables[name] = variable
+    regridded = xr.Dataset(variables, attrs=data.attrs)
+    return regridded.assign_coords(lat=target["lat"], lon=target["lon"])
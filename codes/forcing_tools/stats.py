@@ -3,7 +3,18 @@ from netCDF4 import Dataset
 import xarray as xr
 import dask as ds
 from scipy import stats
+from .grid import cell_area
+from .trace import traced
+from .precision import ACCUMULATOR, as_field, field_dtype
 
+def _has_nan(data):
+    ''' True for a plain floating point numpy array holding NaN, the missing values of read_files(fill_nan=True) '''
+
+    if type(data) is not np.ndarray or data.dtype.kind != "f" or data.size == 0:
+        return False
+    return bool(np.isnan(np.min(data)))  # min propagates NaN: one pass, no boolean array
+
+@traced
 def global_mean(data, data_main=None):
     ''' Calculate the global mean value of given data with (lat,lon) coordinates
         Parameters:
@@ -11,28 +22,55 @@ def global_mean(data, data_main=None):
 
         data: 3D or 2D xarray.DataArray/ numpy.ndarray
               can be forcing, SST, temperature, preciptitation, etc. over a sphere. 
-              For 2D ndarray, axis has to be changed to 0
+              The last two axes of an ndarray have to be (lat, lon)
         data_main:  3D or 2D xarray.DataArray
                required to convert latitudes
 
         Returns:
         --------
         area_mean: 1D xarray.DataArray/ numpy.ndarray
-                   area mean. Use only 2 decimal points
+                   area mean; a numpy.ndarray if data_main is given. Use only 2 decimal points
         global_mean: float64
                      spatial and/or temporal mean.  Use only 2 decimal points
+
+        Cells are weighted by their area from grid.cell_area, which is computed once per grid.
+        The weighted sums accumulate in float64 also under a float32 precision policy.
     '''
+    data = as_field(data)
     if data_main is not None:
-        weight = np.cos(np.deg2rad(data_main.lat))
-        area_mean = np.average(data, axis=1, weights=weight)
-        global_mean = area_mean.mean()
+        weight = cell_area(data_main).values
+        if isinstance(data, xr.DataArray):
+            # e.g. a forcing from compute_forcings_allsky; weighted as its values, lat and lon last
+            if "lat" in data.dims and "lon" in data.dims:
+                data = data.transpose(..., "lat", "lon")
+            data = data.values
+        shape = np.shape(data)[:-2] + (-1,)
+        if _has_nan(data):
+            # NaN cells (fills read with read_files(fill_nan=True)) are left out like masked cells
+            values = np.reshape(data, shape)
+            valid = ~np.isnan(values)
+            area_mean = (np.einsum("...i,i->...", np.where(valid, values, 0), weight.ravel(), dtype=ACCUMULATOR)
+                         / np.einsum("...i,i->...", valid, weight.ravel(), dtype=ACCUMULATOR))
+            global_mean = np.nanmean(area_mean)
+        elif np.ma.isMaskedArray(data):
+            # np.ma.average leaves masked cells out of the weights as well (np.average would not)
+            area_mean = np.ma.average(np.reshape(data, shape), axis=-1, weights=weight.ravel())
+            global_mean = area_mean.mean()
+        elif field_dtype() is None:
+            area_mean = np.average(np.reshape(data, shape), axis=-1, weights=weight.ravel())
+            global_mean = area_mean.mean()
+        else:
+            # accumulate in float64 without a float64 copy of the field
+            area_mean = np.einsum("...i,i->...", np.reshape(data, shape), weight.ravel() / weight.sum(), dtype=ACCUMULATOR)
+            global_mean = area_mean.mean()
     else:
-        weight = np.cos(np.deg2rad(data.lat))
+        weight = cell_area(data)
         area_mean = data.weighted(weight).mean(dim=("lon", "lat"))
         global_mean = area_mean.mean().values
 
     return (area_mean, global_mean)
 
+@traced
 def time_series(data, variable, grid_dist=1.0, plot=True):
     ''' Compute the time-series for any given variable of interest with (lat,lon) coordinates
     https://github.com/pangeo-data/pangeo-tutorial/blob/agu2019/notebooks/xarray.ipynb#More-Complicated-Example:-Weighted-Mean
@@ -45,35 +83,42 @@ def time_series(data, variable, grid_dist=1.0, plot=True):
                can be forcing, SST, temperature, preciptitation, etc. over a sphere
 
     grid_dist: float64
-               distance between the grid points. Default = 1.0
+               not used anymore; cell areas come from grid.cell_area (lat_bnds/lon_bnds of data
+               or the spacing of the coordinates). Kept for compatibility. Default = 1.0
 
     Returns:
     --------
     weighted_mean: 1D xarray.DataArray
                    returns the weighted time series data of the variable of interest 
                    by calculating the total spherical area and points on the map where the variable is not zero.
-                   where ϕ is latitude, dϕ is the spacing of the points in latitude, 
-                   dλ is the spacing of the points in longitude, and R is Earth's radius. 
+                   dA = R² (sin ϕ2 - sin ϕ1) (λ2 - λ1), where ϕ1, ϕ2 and λ1, λ2 are the latitude and longitude 
+                   bounds of a cell and R is Earth's radius. 
 
     plot:      boolean
                plots time series data if True. Default = True
     '''
 
-    R = 6.37e6
-    dϕ = np.deg2rad(grid_dist)
-    dλ = np.deg2rad(grid_dist)
-    dA = R**2 * dϕ * dλ * np.cos(np.deg2rad(data.lat))
+    dA = cell_area(data)
+    variable = as_field(variable)
 
     pixel_area = dA.where(variable[0].notnull())
-    total_area = pixel_area.sum(dim=('lon', 'lat'))
-    weighted_mean = (
-        variable * pixel_area).sum(dim=('lon', 'lat')) / total_area
+    weighted_mean = _area_weighted_series(variable, pixel_area)
 
     if plot is True:
         weighted_mean.plot()
 
     return weighted_mean
 
+def _area_weighted_series(variable, pixel_area):
+    ''' Area weighted mean of every time step over the cells where pixel_area is not missing '''
+
+    total_area = pixel_area.sum(dim=('lon', 'lat'))
+    if field_dtype() is None:
+        return (variable * pixel_area).sum(dim=('lon', 'lat')) / total_area
+    # products in the field precision, sums in float64
+    return (variable * pixel_area.astype(field_dtype())).sum(dim=('lon', 'lat'), dtype=ACCUMULATOR) / total_area
+
+@traced
 def t_test(data, n, pop_mean):
     '''Compute the one sample t-test an xarray DataArray
     Parameters:
@@ -92,12 +137,18 @@ def t_test(data, n, pop_mean):
                   value at each grid cell for a two tailed distribution
     '''
     
-    sample_mean = data.mean(dim='time') #at each grid cell and not field
-    sample_var = data.var(dim='time', ddof=1)
+    if field_dtype() is None:
+        sample_mean = data.mean(dim='time') #at each grid cell and not field
+        sample_var = data.var(dim='time', ddof=1)
+    else:
+        data = as_field(data)
+        sample_mean = data.mean(dim='time', dtype=ACCUMULATOR)
+        sample_var = data.var(dim='time', ddof=1, dtype=ACCUMULATOR)
     t_statistics = (sample_mean - pop_mean) / (np.sqrt(sample_var/n))
     p_value = stats.t.sf(np.abs(t_statistics), n-1)*2  # two-sided pvalue = Prob(abs(t)>tt)
     return t_statistics, p_value
 
+@traced
 def t_test_nd(data, n, pop_mean):
     '''Compute the one sample t-test for an nd.array
     Parameters:
@@ -116,8 +167,330 @@ def t_test_nd(data, n, pop_mean):
                   value at each grid cell for a two tailed distribution
     '''
     
-    sample_mean = np.mean(data, axis=0)
-    sample_var = np.var(data, axis=0, ddof=1)
+    if _has_nan(data):
+        # NaN time steps (fills read with read_files(fill_nan=True)) are skipped like masked ones
+        sample_mean = np.nanmean(data, axis=0, dtype=ACCUMULATOR)
+        sample_var = np.nanvar(data, axis=0, ddof=1, dtype=ACCUMULATOR)
+    elif field_dtype() is None or np.ma.isMaskedArray(data):
+        sample_mean = np.mean(data, axis=0)
+        sample_var = np.var(data, axis=0, ddof=1)
+    else:
+        # float64 moments from time chunks instead of a float64 copy of the whole record
+        moments = Moments()
+        for chunk in iter_time_chunks(as_field(np.asarray(data))):
+            moments.update(chunk)
+        sample_mean = moments.mean
+        sample_var = moments.variance(ddof=1)
     t_statistics = (sample_mean - pop_mean) / (np.sqrt(sample_var/n))
     p_value = stats.t.sf(np.abs(t_statistics), n-1) * 2 
-    return t_statistics, p_value
\ No newline at end of file
+    return t_statistics, p_value
+
+
+class Moments:
+    """
+    Per-cell count, mean and sum of squared deviations (M2), accumulated over time chunks
+    with the pairwise update of Chan et al. Accumulators from different workers can be merged,
+    giving the same result as a single pass over the full record. Masked and NaN values are left
+    out; count is then an array of per-cell counts (a number while no value is missing).
+    """
+
+    def __init__(self, count=0, mean=None, m2=None):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    @classmethod
+    def from_chunk(cls, chunk, axis=0):
+        ''' Moments of one chunk; the chunk is centred on its own mean before squaring '''
+
+        # masked cells (e.g. fill values of netCDF4 reads) become NaN and are not counted
+        chunk = np.ma.filled(np.ma.asanyarray(chunk).astype("float64"), np.nan)
+        valid = ~np.isnan(chunk)
+        if valid.all():
+            mean = chunk.mean(axis=axis)
+            m2 = ((chunk - np.expand_dims(mean, axis)) ** 2).sum(axis=axis)
+            return cls(chunk.shape[axis], mean, m2)
+        count = valid.sum(axis=axis)
+        # cells without values get mean and M2 zero, so merging them is a no-op
+        mean = np.divide(np.nansum(chunk, axis=axis), count, out=np.zeros(count.shape), where=count > 0)
+        m2 = np.nansum((chunk - np.expand_dims(mean, axis)) ** 2, axis=axis)
+        return cls(count, mean, m2)
+
+    def update(self, chunk, axis=0):
+        ''' Fold a chunk of time steps (time along axis) into the accumulator '''
+
+        return self.merge(Moments.from_chunk(chunk, axis=axis))
+
+    def merge(self, other):
+        ''' Merge the moments of another accumulator into this one '''
+
+        if np.all(other.count == 0):
+            return self
+        if np.all(self.count == 0):
+            self.count = np.copy(other.count) if np.ndim(other.count) else other.count
+            self.mean, self.m2 = other.mean.copy(), other.m2.copy()
+            return self
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        if np.ndim(count):
+            weight = np.divide(other.count, count, out=np.zeros(np.shape(count)), where=count > 0)
+        else:
+            weight = other.count / count
+        self.mean = self.mean + delta * weight
+        self.m2 = self.m2 + other.m2 + delta**2 * (self.count * weight)
+        self.count = count
+        return self
+
+    def variance(self, ddof=1):
+        ''' Per-cell variance; NaN where a cell has no more than ddof values '''
+
+        if np.ndim(self.count):
+            return np.divide(self.m2, self.count - ddof, out=np.full(np.shape(self.m2), np.nan),
+                             where=self.count > ddof)
+        return self.m2 / (self.count - ddof)
+
+def iter_time_chunks(data, chunk_size=120):
+    ''' Yield blocks of consecutive time steps (first axis) as numpy arrays
+        Dask-backed DataArrays are split along their own chunks, so only one block is in memory at a time.
+    '''
+
+    if isinstance(data, xr.DataArray):
+        axis = data.get_axis_num("time") if "time" in data.dims else 0
+        if axis != 0:
+            data = data.transpose(data.dims[axis], ...)
+        if data.chunks is not None:
+            sizes = data.chunks[0]
+        else:
+            sizes = [chunk_size] * (data.shape[0] // chunk_size) + ([data.shape[0] % chunk_size] if data.shape[0] % chunk_size else [])
+        start = 0
+        for size in sizes:
+            yield data[start:start + size].values
+            start += size
+    elif isinstance(data, np.ndarray):
+        for start in range(0, data.shape[0], chunk_size):
+            yield data[start:start + chunk_size]
+    else:
+        for chunk in data:
+            yield chunk
+
+@traced
+def t_test_streaming(data, pop_mean, n=None, chunk_size=120, moments=None):
+    '''Compute the one sample t-test without holding the full record in memory
+    Parameters:
+    -----------
+    data:       xarray DataArray, numpy array or iterable of numpy arrays
+                sample with time as first axis (or a 'time' dimension), read in time chunks. 
+                Dask-backed DataArrays are read chunk by chunk; masked and NaN values are left out.
+                Can be None if moments is given
+    pop_mean:   integer or 1D array
+                the null hypothesis H0
+    n:          integer
+                sample size (example: if averaged yearly then climatalogy has 30 years).
+                Default None: number of valid time steps of each cell
+    chunk_size: integer
+                time steps per chunk for in-memory input. Default: 120
+    moments:    Moments
+                accumulated (e.g. merged from several workers) moments to start from. Default: None
+                
+    Returns:
+    --------
+    t-statistics: numpy array ( 1D or 2D depending on input)
+    p_value:      numpy array ( 1D or 2D depending on input)
+                  value at each grid cell for a two tailed distribution; same as t_test_nd
+    '''
+
+    moments = moments if moments is not None else Moments()
+    if data is not None:
+        for chunk in iter_time_chunks(data, chunk_size):
+            moments.update(chunk)
+
+    n = moments.count if n is None else n
+    t_statistics = (moments.mean - pop_mean) / (np.sqrt(moments.variance(ddof=1)/n))
+    p_value = stats.t.sf(np.abs(t_statistics), n-1) * 2 
+    return t_statistics, p_value
+
+SEASONS = ("DJF", "MAM", "JJA", "SON")
+
+def _calendar(time):
+    ''' Year, month and days in the month of every time step for any (cftime or numpy) calendar
+        A time axis without dates (e.g. step numbers) is taken as consecutive months from January
+        with equal weights.
+    '''
+
+    if time.dtype.kind == "M" or (time.dtype.kind == "O" and hasattr(time.values[0], "calendar")):
+        return time.dt.year.values, time.dt.month.values, time.dt.days_in_month.values.astype("float64")
+    steps = np.arange(time.size)
+    return steps // 12, steps % 12 + 1, np.ones(time.size)
+
+def _is_monthly(years, months):
+    ''' True if no two time steps fall in the same month '''
+
+    return np.unique(years * 12 + months).size == years.size
+
+def _is_regular_monthly(years, months):
+    ''' True if the time steps are consecutive months '''
+
+    return years.size > 1 and bool(np.all(np.diff(years * 12 + months) == 1))
+
+def _year_blocks(data, lead, weights):
+    ''' Reshape consecutive monthly steps to (year, month) with day weights
+        lead months are padded before the record and the last year is padded to 12 months;
+        padded steps have zero weight, so partial years are averaged over their own months.
+    '''
+
+    trail = -(lead + data.sizes["time"]) % 12
+    data = data.drop_vars("time")
+    if lead or trail:
+        data = data.pad(time=(lead, trail), constant_values=0)
+        weights = np.pad(weights, (lead, trail))
+    x = data.coarsen(time=12).construct(time=("year", "month"))
+    return x, xr.DataArray(weights.reshape(-1, 12), dims=("year", "month"))
+
+def _weighted_mean(x, w, dims, skipna):
+    ''' Weighted mean of x over dims; the weights are normalized once unless missing values are skipped '''
+
+    if skipna:
+        w = w.where(x.notnull(), 0)
+        return (x * w).sum(dims) / w.sum(dims)
+    return (x * (w / w.sum(dims))).sum(dims, skipna=False)
+
+def _grouped_mean(data, keys, weights, skipna):
+    ''' Weighted mean of the time steps with the same key; the fallback for irregular time axes '''
+
+    key = xr.DataArray(keys, dims="time", name="group")
+    w = xr.DataArray(weights, dims="time", coords={"time": data["time"]})
+    if skipna:
+        w = w.where(data.notnull())
+    return (data * w).groupby(key).sum(skipna=skipna) / w.groupby(key).sum()
+
+def _apply_to_fields(data, func):
+    ''' Apply func to every floating point time dependent variable of a Dataset, or to a DataArray '''
+
+    if isinstance(data, xr.DataArray):
+        return func(data)
+    fields = {name: func(v) for name, v in data.data_vars.items() if "time" in v.dims and v.dtype.kind == "f"}
+    others = {name: v for name, v in data.data_vars.items() if "time" not in v.dims}
+    return xr.Dataset(dict(fields, **others), attrs=data.attrs)
+
+@traced
+def annual_mean(data, skipna=False):
+    ''' Day-weighted annual means of monthly data
+    Consecutive monthly steps are reduced as one (year, month) reshape, which is a single vectorized pass
+    over dask-backed data; irregular axes (gaps, daily data) fall back to a grouped mean by year.
+    Month lengths follow the calendar of the time axis (noleap, 360_day, gregorian, ...); a time axis without
+    dates is taken as consecutive months from January with equal weights.
+    Parameters:
+    -----------
+    data:   xarray.DataArray or xarray.Dataset
+            with a datetime or cftime 'time' dimension, usually dim=(time, lat, lon)
+    skipna: boolean
+            ignore missing values within a year; otherwise a missing month gives a missing mean. Default: False
+
+    Returns:
+    --------
+    annual: same type as data
+            dim 'year' instead of 'time'; partial first and last years are averaged over their months.
+            Same as data.groupby('time.year').mean('time') up to the weighting by month length
+    '''
+
+    def _annual(values):
+        years, months, days = _calendar(values["time"])
+        if _is_regular_monthly(years, months):
+            x, w = _year_blocks(values, int(months[0]) - 1, days)
+            result = _weighted_mean(x, w, "month", skipna)
+            return result.assign_coords(year=years[0] + np.arange(result.sizes["year"]))
+        weights = days if _is_monthly(years, months) else np.ones(years.size)
+        return _grouped_mean(values, years, weights, skipna).rename(group="year")
+
+    return _apply_to_fields(data, _annual)
+
+@traced
+def seasonal_mean(data, skipna=False):
+    ''' Day-weighted DJF, MAM, JJA and SON means of every year of monthly data
+    Parameters:
+    -----------
+    data:   xarray.DataArray or xarray.Dataset
+            with a datetime or cftime 'time' dimension, usually dim=(time, lat, lon)
+    skipna: boolean
+            ignore missing values within a season. Default: False
+
+    Returns:
+    --------
+    seasonal: same type as data
+              dim 'time' with one step per complete season (the time of its first month) and the
+              coordinates 'season' (DJF, MAM, JJA, SON) and 'year' (December counts to the next year)
+    '''
+
+    def _seasonal(values):
+        time = values["time"]
+        years, months, days = _calendar(time)
+        season = (months % 12) // 3
+        year = years + (months == 12)
+        if _is_regular_monthly(years, months):
+            starts = np.nonzero(np.isin(months, (12, 3, 6, 9)))[0]
+            first = int(starts[0]) if starts.size else time.size
+            n_seasons = (time.size - first) // 3
+            if n_seasons > 0:
+                steps = slice(first, first + 3 * n_seasons)
+                x = values.isel(time=steps).drop_vars("time").coarsen(time=3).construct(time=("season_step", "month"))
+                w = xr.DataArray(days[steps].reshape(-1, 3), dims=("season_step", "month"))
+                result = _weighted_mean(x, w, "month", skipna).rename(season_step="time")
+                starts = np.arange(first, first + 3 * n_seasons, 3)
+                return result.assign_coords(time=time.values[starts], season=("time", [SEASONS[k] for k in season[starts]]),
+                                            year=("time", year[starts]))
+
+        # fallback: group by (seasonal year, season) and keep the seasons with all three months
+        keys = year * 4 + season
+        weights = days if _is_monthly(years, months) else np.ones(time.size)
+        result = _grouped_mean(values, keys, weights, skipna)
+        counts = np.array([np.unique(months[keys == k]).size for k in result["group"].values])
+        result = result.isel(group=counts == 3)
+        starts = np.array([np.nonzero(keys == k)[0][0] for k in result["group"].values], dtype=int)
+        result = result.rename(group="time").assign_coords(time=time.values[starts])
+        return result.assign_coords(season=("time", [SEASONS[k] for k in season[starts]]), year=("time", year[starts]))
+
+    return _apply_to_fields(data, _seasonal)
+
+@traced
+def climatology(data, freq="month", skipna=False):
+    ''' Day-weighted monthly or seasonal climatology
+    Parameters:
+    -----------
+    data:   xarray.DataArray or xarray.Dataset
+            with a datetime or cftime 'time' dimension, usually dim=(time, lat, lon)
+    freq:   string
+            'month' for a mean annual cycle, 'season' for DJF, MAM, JJA and SON. Default: 'month'
+    skipna: boolean
+            ignore missing values. Default: False
+
+    Returns:
+    --------
+    climatology: same type as data
+                 dim 'month' (1 to 12) or 'season' instead of 'time'. Seasons use the months of all years,
+                 like data.groupby('time.season'), weighted by month length
+    '''
+
+    if freq not in ("month", "season"):
+        raise ValueError("freq must be 'month' or 'season', not {!r}".format(freq))
+
+    def _climatology(values):
+        years, months, days = _calendar(values["time"])
+        if _is_regular_monthly(years, months):
+            x, w = _year_blocks(values, int(months[0]) - 1, days)
+            if freq == "season":
+                # December first, then three months per season
+                order = [11, 0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+                x = x.isel(month=order).coarsen(month=3).construct(month=("season", "step"))
+                w = w.isel(month=order).coarsen(month=3).construct(month=("season", "step"))
+                return _weighted_mean(x, w, ("year", "step"), skipna).assign_coords(season=list(SEASONS))
+            return _weighted_mean(x, w, "year", skipna).assign_coords(month=np.arange(1, 13))
+
+        weights = days if _is_monthly(years, months) else np.ones(years.size)
+        if freq == "season":
+            result = _grouped_mean(values, (months % 12) // 3, weights, skipna)
+            labels = [SEASONS[k] for k in result["group"].values]
+            return result.rename(group="season").assign_coords(season=labels)
+        return _grouped_mean(values, months, weights, skipna).rename(group="month")
+
+    return _apply_to_fields(data, _climatology)
@@ -0,0 +1,363 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import xarray as xr
+from .atomic import atomic_path
+from .reader import _reject_merged, merged_members
+from .trace import traced
+
+try:
+    import fsspec
+    from fsspec.spec import AbstractFileSystem
+except ImportError:  # only the store access needs fsspec
+    fsspec = None
+    AbstractFileSystem = object
+
+# Pangeo catalog of the CMIP6 Zarr stores on Google Cloud Storage
+PANGEO_CATALOG = "https://storage.googleapis.com/cmip6/cmip6-zarr-consolidated-stores.csv"
+
+STORE_FACETS = ("activity_id", "institution_id", "source_id", "experiment_id", "member_id", "table_id",
+                "variable_id", "grid_label")
+
+def _require_fsspec():
+    if fsspec is None:
+        raise ImportError("forcing_tools.stores needs fsspec (and gcsfs for gs:// stores)")
+
+class ChunkCache(AbstractFileSystem):
+    """
+    Read-through fsspec filesystem keeping every object read from a target filesystem (Zarr chunks and
+    metadata) in a local directory. The cache persists between sessions, so a chunk is fetched from the
+    target only once; when the cache grows beyond max_size the least recently read files are removed.
+    The directory is scanned once when the cache is created; afterwards its size and the order of last
+    reads are kept up to date in memory, so eviction does not walk the directory again. Objects are
+    assumed immutable, as the chunks of published CMIP6 stores are. The cache is read only and can be
+    shared by the threads of a dask scheduler.
+    """
+
+    protocol = "chunkcache"
+    cachable = False
+
+    def __init__(self, target, cache_dir, max_size=20 * 2**30, **kwargs):
+        """
+        target:    fsspec filesystem holding the stores, e.g. fsspec.filesystem('gs', token='anon')
+        cache_dir: local directory of the cached objects
+        max_size:  size limit of the cache in bytes. Default: 20 GiB
+        """
+
+        _require_fsspec()
+        super().__init__(**kwargs)
+        self.target = target
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # cache path -> size, least recently read first; _lock guards _index and _size
+        self._lock = threading.Lock()
+        self._index = OrderedDict((path, size) for path, size, _ in sorted(self._entries(), key=lambda e: e[2]))
+        self._size = sum(self._index.values())
+
+    def _cache_path(self, path):
+        protocol = self.target.protocol if isinstance(self.target.protocol, str) else self.target.protocol[0]
+        key = hashlib.sha256("{}://{}".format(protocol, path).encode()).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key[2:])
+
+    def _entries(self):
+        ''' (path, size, last read) of every cached object on disk '''
+
+        entries = []
+        for directory in os.scandir(self.cache_dir):
+            if not directory.is_dir():
+                continue
+            for item in os.scandir(directory.path):
+                if ".tmp" in item.name:
+                    continue
+                stat = item.stat()
+                entries.append((item.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    @property
+    def size(self):
+        ''' Bytes currently in the cache '''
+
+        return self._size
+
+    def evict(self, max_size=None):
+        ''' Remove the least recently read objects until the cache holds at most max_size bytes (default: self.max_size) '''
+
+        max_size = self.max_size if max_size is None else max_size
+        with self._lock:
+            while self._size > max_size and self._index:
+                path, size = self._index.popitem(last=False)
+                self._size -= size
+                try:
+                    os.remove(path)  # under the lock, so a thread reading path cannot index it again
+                except FileNotFoundError:  # removed by another session sharing the directory
+                    pass
+
+    def _touch(self, cache_path, size):
+        ''' Mark a cached object as read last; call with the lock held '''
+
+        if cache_path in self._index:
+            self._index.move_to_end(cache_path)
+        elif os.path.exists(cache_path):  # written by another thread or session, and not evicted since
+            self._index[cache_path] = size
+            self._size += size
+
+    def cat_file(self, path, start=None, end=None, **kwargs):
+        cache_path = self._cache_path(path)
+        try:
+            with open(cache_path, "rb") as f:
+                data = f.read()
+            os.utime(cache_path)  # the order of last reads survives the session
+            with self._lock:
+                self.hits += 1
+                self._touch(cache_path, len(data))
+        except FileNotFoundError:
+            # a missing object (e.g. zarr.json of a v2 store) raises here and is not cached
+            data = self.target.cat_file(path)
+            with atomic_path(cache_path) as tmp_path:  # unique per call, threads missing the same key do not clash
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+            with self._lock:
+                self.misses += 1
+                self._touch(cache_path, len(data))
+                full = self._size > self.max_size
+            if full:
+                self.evict()
+        return data[start:end]
+
+    def info(self, path, **kwargs):
+        return self.target.info(path, **kwargs)
+
+    def ls(self, path, detail=True, **kwargs):
+        return self.target.ls(path, detail=detail, **kwargs)
+
+    def _open(self, path, mode="rb", **kwargs):
+        if mode != "rb":
+            raise PermissionError("the chunk cache is read only, cannot open {} with mode '{}'".format(path, mode))
+        return self.target._open(path, mode=mode, **kwargs)
+
+    def pipe_file(self, path, value, **kwargs):
+        raise PermissionError("the chunk cache is read only, cannot write {}".format(path))
+
+    def rm_file(self, path):
+        raise PermissionError("the chunk cache is read only, cannot remove {}".format(path))
+
+class StoreCatalog:
+    """
+    Catalog of CMIP6 Zarr stores in the format of the Pangeo cmip6-zarr-consolidated-stores CSV
+    (one row per dataset with the DRS facets and the store URL in 'zstore'). Stores are opened
+    lazily through their consolidated metadata; with a cache_dir every chunk read is kept in a
+    local ChunkCache, so repeated analyses do not fetch it again.
+    """
+
+    def __init__(self, table, cache_dir=None, max_size=20 * 2**30, storage_options=None):
+        """
+        table:           pandas.DataFrame with the columns of STORE_FACETS and 'zstore'
+        cache_dir:       directory of the chunk cache. Default: None (no cache)
+        max_size:        size limit of the chunk cache in bytes. Default: 20 GiB
+        storage_options: dict passed to the fsspec filesystem of the stores, e.g. {'token': 'anon'}
+        """
+
+        missing = {"zstore", *STORE_FACETS} - set(table.columns)
+        if missing:
+            raise ValueError("catalog misses the columns: {}".format(", ".join(sorted(missing))))
+        self.table = table.reset_index(drop=True)
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.storage_options = storage_options or {}
+        self._filesystems = {}
+
+    def __len__(self):
+        return len(self.table)
+
+    @classmethod
+    def load(cls, url=PANGEO_CATALOG, cache_dir=None, max_size=20 * 2**30, storage_options=None):
+        ''' Read a catalog CSV
+            Parameters:
+            -----------
+            url:             string
+                             local path or fsspec URL of the CSV. Default: PANGEO_CATALOG
+            cache_dir:       string
+                             directory of the chunk cache. Default: None (no cache)
+            max_size:        integer
+                             size limit of the chunk cache in bytes. Default: 20 GiB
+            storage_options: dict
+                             options of the fsspec filesystem of the CSV and the stores. Default: None
+
+            Returns:
+            --------
+            catalog: StoreCatalog
+        '''
+
+        import pandas as pd
+
+        _require_fsspec()
+        with fsspec.open(url, "rt", **(storage_options or {})) as f:
+            table = pd.read_csv(f, dtype=str)
+        return cls(table, cache_dir=cache_dir, max_size=max_size, storage_options=storage_options)
+
+    def _subset(self, table):
+        catalog = StoreCatalog(table, cache_dir=self.cache_dir, max_size=self.max_size,
+                               storage_options=self.storage_options)
+        catalog._filesystems = self._filesystems
+        return catalog
+
+    def query(self, expr):
+        ''' Rows matching a pandas query, e.g. "activity_id == 'RFMIP' & table_id == 'Amon'", as a StoreCatalog '''
+
+        return self._subset(self.table.query(expr))
+
+    def search(self, **facets):
+        ''' Return all rows matching the given facets
+            Parameters:
+            -----------
+            facets: keyword arguments
+                    any of activity_id, institution_id, source_id, experiment_id, member_id, table_id,
+                    variable_id, grid_label. Values can be a string or a list/tuple of strings.
+
+            Returns:
+            --------
+            entries: list of dicts
+        '''
+
+        unknown = set(facets) - set(STORE_FACETS)
+        if unknown:
+            raise ValueError("unknown facets: {}".format(", ".join(sorted(unknown))))
+        selected = self.table
+        for facet, value in facets.items():
+            selected = selected[selected[facet].isin((value,) if isinstance(value, str) else tuple(value))]
+        return selected.to_dict("records")
+
+    def members(self, source_id, experiment_id, table_id="Amon"):
+        ''' Sorted member_ids available for a model and experiment '''
+
+        return sorted({e["member_id"] for e in self.search(source_id=source_id, experiment_id=experiment_id,
+                                                            table_id=table_id)})
+
+    def stores(self, source_id, experiment_id, variables=("rsdt", "rsut", "rlut", "rsutcs", "rlutcs", "clt"),
+               member_id=None, table_id="Amon", grid_label=None):
+        ''' Store URLs of one model, experiment and member per variable
+            Parameters:
+            -----------
+            source_id, experiment_id: strings
+            variables:     list of strings
+                           Default: the fluxes and cloud fraction used by forcings
+            member_id:     string
+                           Default: None (first member available for all variables)
+            table_id:      string
+                           Default: 'Amon'
+            grid_label:    string
+                           Default: None (any)
+
+            Returns:
+            --------
+            stores: dict
+                    variable -> zstore URL; the latest version if the catalog lists several
+        '''
+
+        facets = dict(source_id=source_id, experiment_id=experiment_id, table_id=table_id, variable_id=list(variables))
+        if grid_label is not None:
+            facets["grid_label"] = grid_label
+        entries = self.search(**facets)
+        if member_id is None:
+            per_variable = [{e["member_id"] for e in entries if e["variable_id"] == v} for v in variables]
+            common = sorted(set.intersection(*per_variable)) if per_variable else []
+            if not common:
+                raise FileNotFoundError("no member of {} {} has all of {}".format(source_id, experiment_id,
+                                                                                  ", ".join(variables)))
+            member_id = common[0]
+
+        stores = {}
+        for variable in variables:
+            matches = [e for e in entries if e["variable_id"] == variable and e["member_id"] == member_id]
+            if not matches:
+                raise FileNotFoundError("no store for {} {} {} {}".format(variable, source_id, experiment_id, member_id))
+            stores[variable] = max(matches, key=lambda e: str(e.get("version", "")))["zstore"]
+        return stores
+
+    def mapper(self, zstore):
+        ''' Key-value mapping of a store for zarr, read through the chunk cache if the catalog has one '''
+
+        _require_fsspec()
+        protocol = fsspec.core.split_protocol(zstore)[0] or "file"
+        if protocol not in self._filesystems:
+            target = fsspec.filesystem(protocol, **self.storage_options)
+            if self.cache_dir is not None:
+                target = ChunkCache(target, self.cache_dir, max_size=self.max_size)
+            self._filesystems[protocol] = target
+        fs = self._filesystems[protocol]
+        path = (fs.target if isinstance(fs, ChunkCache) else fs)._strip_protocol(zstore)
+        return fs.get_mapper(path)
+
+    def cache(self, protocol="gs"):
+        ''' ChunkCache of the stores of a protocol, None before the first store was opened or without cache_dir '''
+
+        fs = self._filesystems.get(protocol)
+        return fs if isinstance(fs, ChunkCache) else None
+
+    def open_store(self, zstore, chunks=None):
+        ''' Open one store lazily through its consolidated metadata
+            Parameters:
+            -----------
+            zstore: string
+                    store URL, e.g. 'gs://cmip6/CMIP6/RFMIP/.../v20190815/'
+            chunks: dict
+                    dask chunks. Default: None (the chunks of the store)
+
+            Returns:
+            --------
+            data: xarray.Dataset
+        '''
+
+        return xr.open_zarr(self.mapper(zstore), consolidated=True, chunks=chunks if chunks is not None else {})
+
+    @traced
+    def open_dataset(self, source_id, experiment_id, variables=("rsdt", "rsut", "rlut", "rsutcs", "rlutcs", "clt"),
+                     member_id=None, table_id="Amon", grid_label=None, chunks=None):
+        ''' Open all variables of one model, experiment and member lazily as one dataset
+            Parameters: as for StoreCatalog.stores, plus
+            -----------
+            chunks: dict
+                    dask chunks. Default: None (the chunks of the stores)
+
+            Returns:
+            --------
+            data: xarray.Dataset
+        '''
+
+        stores = self.stores(source_id, experiment_id, variables=variables, member_id=member_id,
+                             table_id=table_id, grid_label=grid_label)
+        datasets = [self.open_store(stores[variable], chunks=chunks) for variable in variables]
+        return xr.merge(datasets, compat="override", join="override", combine_attrs="drop_conflicts")
+
+    @traced
+    def open_ensemble(self, source_id, experiment_id, variables=("rsdt", "rsut", "rlut", "rsutcs", "rlutcs", "clt"),
+                      members=None, table_id="Amon", grid_label=None, chunks=None):
+        ''' Open several realizations along a new 'realization' dimension, as reader.open_ensemble
+            Parameters: as for StoreCatalog.open_dataset, plus
+            -----------
+            members: list of strings
+                     Default: None (all members of the model and experiment except pre-merged ones such as
+                     IPSL r1234i1p1f1, see reader.merged_members)
+
+            Returns:
+            --------
+            data: xarray.Dataset
+                  usually dim=(realization, time, lat, lon)
+        '''
+
+        if members is None:
+            available = self.members(source_id, experiment_id, table_id=table_id)
+            members = [m for m in available if m not in merged_members(available)]
+            if available and not members:
+                raise KeyError("only pre-merged members for {} {}: {}; open them with open_dataset(member_id=...)".format(
+                    source_id, experiment_id, ", ".join(available)))
+        members = list(members)
+        _reject_merged(members)
+        datasets = [self.open_dataset(source_id, experiment_id, variables=variables, member_id=member,
+                                      table_id=table_id, grid_label=grid_label, chunks=chunks) for member in members]
+        data = xr.concat(datasets, dim="realization", coords="minimal", compat="override")
+        return data.assign_coords(realization=members)
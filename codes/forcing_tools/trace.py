@@ -0,0 +1,262 @@
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+import threading
+import contextlib
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+try:
+    from dask import is_dask_collection
+    from dask.callbacks import Callback
+except ImportError:  # without dask every result is computed when it is returned
+    is_dask_collection = None
+    Callback = object
+
+# tracing is off unless enabled with tracing()/enable() or the FORCING_TOOLS_TRACE environment variable
+_state = {"enabled": False, "path": None, "records": []}
+_lock = threading.Lock()
+_local = threading.local()
+# token of a dask graph layer -> traced function that added the layer to the graph
+_owners = {}
+
+def _bytes_read():
+    ''' Bytes read by this process so far (Linux /proc/self/io rchar), None elsewhere '''
+
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def _peak_rss():
+    ''' Peak resident set size of this process in bytes, None if unknown '''
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def _layer_names(obj, names):
+    ''' Add the dask graph layer names of obj (or of the collections in a tuple/list/dict) to names '''
+
+    if isinstance(obj, (tuple, list)):
+        for item in obj:
+            _layer_names(item, names)
+    elif isinstance(obj, dict):
+        for item in obj.values():
+            _layer_names(item, names)
+    elif is_dask_collection is not None and is_dask_collection(obj):
+        graph = obj.__dask_graph__()
+        if hasattr(graph, "layers"):
+            names.update(graph.layers)
+        else:
+            names.update(key[0] if isinstance(key, tuple) else key for key in graph)
+
+def _token(name):
+    ''' Trailing token of a layer or task key name; fused tasks keep the one of the layer they end in '''
+
+    return str(name).rsplit("-", 1)[-1]
+
+def _claim(name, result, args, kwargs):
+    ''' Attribute the graph layers result adds to its inputs to name; inner traced calls claim theirs first '''
+
+    added = set()
+    _layer_names(result, added)
+    if not added:
+        return
+    inputs = set()
+    _layer_names(args, inputs)
+    _layer_names(kwargs, inputs)
+    with _lock:
+        for layer in added - inputs:
+            _owners.setdefault(_token(layer), name)
+
+class _ComputeTimer(Callback):
+    ''' Dask callback summing the time of the tasks of every traced function while a graph is computed '''
+
+    def _start_state(self, dsk, state):
+        state["trace_started"] = {}
+        state["trace_tasks"] = {}
+        state["trace_start"] = time.perf_counter()
+
+    def _pretask(self, key, dsk, state):
+        state["trace_started"][key] = time.perf_counter()
+
+    def _posttask(self, key, result, dsk, state, worker_id):
+        started = state["trace_started"].pop(key, None)
+        owner = _owners.get(_token(key[0] if isinstance(key, tuple) else key))
+        if started is None or owner is None:
+            return
+        entry = state["trace_tasks"].setdefault(owner, [0, 0.0])
+        entry[0] += 1
+        entry[1] += time.perf_counter() - started
+
+    def _finish(self, dsk, state, failed):
+        if "trace_tasks" not in state:
+            return
+        for owner, (tasks, seconds) in state["trace_tasks"].items():
+            _record({"name": owner, "phase": "compute", "start": time.time() - seconds, "seconds": seconds,
+                     "tasks": tasks, "depth": None, "bytes_read": None, "peak_rss": _peak_rss(),
+                     "thread": threading.current_thread().name, "error": "failed" if failed else None})
+
+_timer = _ComputeTimer() if is_dask_collection is not None else None
+
+def traced(func):
+    ''' Record wall time, bytes read and peak RSS of every call of func while tracing is enabled
+        When tracing is disabled the only overhead is one dictionary lookup per call.
+        The time spent in traced calls nested inside a call is kept apart as its self_seconds. Lazy (dask)
+        results take little time to build; the graph layers they add are attributed to func, and the time
+        their tasks take when computed inside the tracing block is recorded as a separate 'compute' record.
+    '''
+
+    name = "{}.{}".format(func.__module__.rsplit(".", 1)[-1], func.__qualname__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _state["enabled"]:
+            return func(*args, **kwargs)
+
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        recursive = any(frame[0] == name for frame in stack)
+        frame = [name, 0.0, 0]  # seconds and bytes read by the traced calls inside this one
+        stack.append(frame)
+        read_before = _bytes_read()
+        start = time.perf_counter()
+        error = None
+        try:
+            result = func(*args, **kwargs)
+            _claim(name, result, args, kwargs)
+            return result
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            read_after = _bytes_read()
+            bytes_read = read_after - read_before if read_before is not None and read_after is not None else None
+            stack.pop()
+            if stack:
+                stack[-1][1] += seconds
+                stack[-1][2] += bytes_read or 0
+            _record({"name": name, "phase": "build", "start": time.time() - seconds, "seconds": seconds,
+                     "self_seconds": seconds - frame[1], "depth": len(stack), "recursive": recursive,
+                     "bytes_read": bytes_read, "self_bytes_read": None if bytes_read is None else bytes_read - frame[2],
+                     "peak_rss": _peak_rss(), "thread": threading.current_thread().name, "error": error})
+
+    return wrapper
+
+def _record(record):
+    with _lock:
+        _state["records"].append(record)
+        if _state["path"] is not None:
+            with open(_state["path"], "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+def _set(enabled, path):
+    if _timer is not None and enabled != _state["enabled"]:
+        if enabled:
+            _timer.register()
+        else:
+            _timer.unregister()
+    _state["enabled"] = enabled
+    _state["path"] = path
+
+def enable(path=None):
+    ''' Start tracing; records are kept in memory and, if path is given, appended to it as JSON lines '''
+
+    _set(True, path)
+
+def disable():
+    ''' Stop tracing; recorded calls are kept until reset() '''
+
+    _set(False, _state["path"])
+
+def reset():
+    ''' Forget all recorded calls and graph layer owners '''
+
+    with _lock:
+        _state["records"] = []
+        _owners.clear()
+
+def records():
+    ''' Return a copy of the recorded calls '''
+
+    with _lock:
+        return list(_state["records"])
+
+@contextlib.contextmanager
+def tracing(path=None):
+    ''' Trace all forcing_tools calls inside the block
+
+        with trace.tracing("trace.jsonl") as calls:
+            compute_all_components(data_aer, data_control).compute()
+        print(trace.summary(calls))
+
+        Yields the list the records of this block are collected in.
+    '''
+
+    previous = (_state["enabled"], _state["path"])
+    start = len(records())
+    block = []
+    enable(path)
+    try:
+        yield block
+    finally:
+        _set(*previous)
+        block.extend(records()[start:])
+
+def summary(calls=None):
+    ''' Table of calls, self/inclusive/compute time, bytes read and peak RSS per function
+        'self s' leaves out the time of nested traced calls, so the column adds up to the traced time;
+        'incl s' includes it (recursive calls are counted once). 'compute s' is the time of the dask tasks
+        the function added to a graph, summed over the worker threads.
+        Parameters:
+        -----------
+        calls: list of dicts
+               records from tracing() or records(). Default: None (all recorded calls)
+
+        Returns:
+        --------
+        table: string
+    '''
+
+    calls = records() if calls is None else calls
+    stats = {}
+    for call in calls:
+        entry = stats.setdefault(call["name"], {"calls": 0, "self": 0.0, "inclusive": 0.0, "compute": 0.0,
+                                                "bytes_read": 0, "peak_rss": 0})
+        if call.get("phase") == "compute":
+            entry["compute"] += call["seconds"]
+        else:
+            entry["calls"] += 1
+            entry["self"] += call.get("self_seconds", call["seconds"])
+            if not call.get("recursive"):
+                entry["inclusive"] += call["seconds"]
+            entry["bytes_read"] += call.get("self_bytes_read", call["bytes_read"]) or 0
+        entry["peak_rss"] = max(entry["peak_rss"], call["peak_rss"] or 0)
+
+    lines = ["{:<40s} {:>6s} {:>10s} {:>10s} {:>10s} {:>11s} {:>11s}".format(
+        "function", "calls", "self s", "incl s", "compute s", "read MB", "peak RSS MB")]
+    for name, entry in sorted(stats.items(), key=lambda e: -(e[1]["self"] + e[1]["compute"])):
+        lines.append("{:<40s} {:>6d} {:>10.3f} {:>10.3f} {:>10.3f} {:>11.1f} {:>11.1f}".format(
+            name, entry["calls"], entry["self"], entry["inclusive"], entry["compute"],
+            entry["bytes_read"] / 2**20, entry["peak_rss"] / 2**20))
+    return "\n".join(lines)
+
+if os.environ.get("FORCING_TOOLS_TRACE"):
+    # FORCING_TOOLS_TRACE=1 traces in memory, any other value is the JSON lines file; a summary is printed at exit
+    _path = os.environ["FORCING_TOOLS_TRACE"]
+    enable(None if _path == "1" else _path)
+    atexit.register(lambda: print(summary(), file=sys.stderr))
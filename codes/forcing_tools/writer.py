@@ -0,0 +1,203 @@
+import os
+import time
+import platform
+import numpy as np
+import xarray as xr
+from .atomic import atomic_path
+
+# long_name of every variable returned by forcings.compute_all_components and forcings.compute_aprp; all are in W m-2
+COMPONENT_NAMES = {
+    "sw_allsky": "shortwave all-sky effective radiative forcing at TOA",
+    "lw_allsky": "longwave all-sky effective radiative forcing at TOA",
+    "sw_clearsky": "shortwave clear-sky effective radiative forcing at TOA",
+    "lw_clearsky": "longwave clear-sky effective radiative forcing at TOA",
+    "sw_cloudy_control": "shortwave cloudy-sky forcing at TOA normalised by the control cloud fraction",
+    "sw_cloudy_aer": "shortwave cloudy-sky forcing at TOA normalised by the aerosol cloud fraction",
+    "lw_cloudy_control": "longwave cloudy-sky forcing at TOA normalised by the control cloud fraction",
+    "lw_cloudy_aer": "longwave cloudy-sky forcing at TOA normalised by the aerosol cloud fraction",
+    "sw_fclear": "shortwave clear-sky forcing at TOA weighted by the clear-sky fraction",
+    "lw_fclear": "longwave clear-sky forcing at TOA weighted by the clear-sky fraction",
+    "sw_fcloudy": "shortwave cloudy-sky forcing at TOA (all sky minus weighted clear sky)",
+    "lw_fcloudy": "longwave cloudy-sky forcing at TOA (all sky minus weighted clear sky)",
+    "sw_ari": "shortwave forcing at TOA from aerosol-radiation interactions (APRP)",
+    "sw_aci": "shortwave forcing at TOA from aerosol-cloud interactions (APRP)",
+    "sw_albedo": "shortwave forcing at TOA from surface albedo changes (APRP)",
+    "sw_aprp_residual": "shortwave all-sky forcing at TOA not attributed by APRP",
+    "lw_ari": "longwave forcing at TOA from aerosol-radiation interactions (clear-sky change)",
+    "lw_aci": "longwave forcing at TOA from aerosol-cloud interactions (cloud radiative effect change)",
+}
+
+# 'map': whole maps per chunk, cheap to read one time step; 'timeseries': whole records per chunk of
+# lat x lon cells, cheap to read the time series of a region
+LAYOUTS = ("map", "timeseries")
+
+def chunk_sizes(dims, shape, layout="map", target=2**20):
+    ''' Chunk shape of a variable for an access pattern
+        Parameters:
+        -----------
+        dims:   tuple of strings
+                dimension names, e.g. ('time', 'lat', 'lon')
+        shape:  tuple of integers
+        layout: string
+                'map' or 'timeseries'. Default: 'map'
+        target: integer
+                approximate number of values per chunk. Default: 2**20 (4 MB of float32)
+
+        Returns:
+        --------
+        chunks: tuple of integers
+    '''
+
+    if layout not in LAYOUTS:
+        raise ValueError("layout must be one of {}, not {!r}".format(LAYOUTS, layout))
+    sizes = dict(zip(dims, shape))
+    horizontal = [d for d in dims if d != "time"]
+    cells = int(np.prod([sizes[d] for d in horizontal])) if horizontal else 1
+
+    chunks = dict(sizes)
+    if "time" in sizes:
+        if layout == "map":
+            chunks["time"] = max(1, min(sizes["time"], target // max(cells, 1)))
+        else:
+            # full records, square-ish horizontal tiles holding about target values
+            side = max(1, int(np.sqrt(max(target // sizes["time"], 1))))
+            for d in horizontal:
+                chunks[d] = min(sizes[d], side)
+    return tuple(chunks[d] for d in dims)
+
+def quantize(values, keepbits):
+    ''' Round floats to keepbits significant mantissa bits (round to nearest, ties to even)
+        The trailing mantissa bits become zero, so the data compress much better; the relative
+        error is at most 2**-(keepbits+1). NaN and infinities are kept.
+        Parameters:
+        -----------
+        values:   numpy array of float32 or float64
+        keepbits: integer
+                  mantissa bits to keep; 0 to 23 for float32, 0 to 52 for float64
+
+        Returns:
+        --------
+        rounded: numpy array of the same dtype
+    '''
+
+    values = np.asarray(values)
+    if values.dtype == np.float32:
+        uint, mantissa = np.uint32, 23
+    elif values.dtype == np.float64:
+        uint, mantissa = np.uint64, 52
+    else:
+        raise TypeError("can only quantize float32 or float64, not {}".format(values.dtype))
+    if not 0 <= keepbits <= mantissa:
+        raise ValueError("keepbits must be between 0 and {}".format(mantissa))
+    if keepbits == mantissa:
+        return values.copy()
+
+    shift = uint(mantissa - keepbits)
+    bits = values.view(uint)
+    half = uint(1) << (shift - uint(1))
+    mask = ~((uint(1) << shift) - uint(1))
+    rounded = ((bits + (half - uint(1)) + ((bits >> shift) & uint(1))) & mask).view(values.dtype)
+    return np.where(np.isfinite(values), rounded, values)
+
+def _provenance(data, keepbits, layout):
+    ''' Global attributes recording how the file was made '''
+
+    from . import __version__
+
+    sources = sorted({v.encoding["source"] for v in data.variables.values() if "source" in v.encoding})
+    attrs = {"Conventions": "CF-1.8",
+             "history": "{} written by forcing_tools {} (python {})".format(
+                 time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), __version__, platform.python_version()),
+             "forcing_tools_version": __version__,
+             "chunk_layout": layout}
+    if "history" in data.attrs:
+        attrs["history"] = data.attrs["history"] + "\n" + attrs["history"]
+    if sources:
+        attrs["input_files"] = " ".join(sources)
+    if keepbits is not None:
+        attrs["quantization"] = "bitround, {} significant mantissa bits kept".format(keepbits)
+    return attrs
+
+def write_forcings(data, path, layout="map", keepbits=None, complevel=4, fmt=None, attrs=None):
+    ''' Write forcing components (e.g. from forcings.compute_all_components) compressed to NetCDF4 or Zarr
+        Parameters:
+        -----------
+        data:      xarray.Dataset or xarray.DataArray
+                   forcing fields, usually dim=(time, lat, lon); dask-backed fields are rechunked to the
+                   chunks of layout and written chunk by chunk (computed here if keepbits is set)
+        path:      string
+                   output file; a '.zarr' path is written as a Zarr store
+        layout:    string
+                   'map' for reading time steps or time means, 'timeseries' for reading the record
+                   of single cells or regions. Default: 'map'
+        keepbits:  integer
+                   keep this many mantissa bits of float variables before compression (see quantize);
+                   7 keeps about 2-3 significant digits. Default: None (lossless)
+        complevel: integer
+                   zlib level for NetCDF4. Default: 4
+        fmt:       string
+                   'netcdf' or 'zarr'. Default: None (from the extension of path)
+        attrs:     dict
+                   extra global attributes. Default: None
+
+        Returns:
+        --------
+        path: string
+              the file is written to a temporary name and renamed, so it is never left half written
+    '''
+
+    if isinstance(data, xr.DataArray):
+        data = data.to_dataset(name=data.name or "forcing")
+    fmt = fmt or ("zarr" if path.rstrip("/").endswith(".zarr") else "netcdf")
+    if fmt not in ("netcdf", "zarr"):
+        raise ValueError("fmt must be 'netcdf' or 'zarr', not {!r}".format(fmt))
+
+    data = data.copy()
+    data.attrs.update(_provenance(data, keepbits, layout))
+    data.attrs.update(attrs or {})
+
+    encoding = {}
+    for name, variable in data.data_vars.items():
+        if name in COMPONENT_NAMES:
+            variable.attrs.setdefault("long_name", COMPONENT_NAMES[name])
+            variable.attrs.setdefault("units", "W m-2")
+        if variable.dtype.kind != "f" or variable.ndim == 0:
+            continue
+        if keepbits is not None:
+            data[name] = variable.copy(data=quantize(variable.values, keepbits))
+        chunks = chunk_sizes(variable.dims, variable.shape, layout)
+        if data[name].chunks is not None:
+            # Zarr refuses dask chunks that overlap several chunks on disk
+            data[name] = data[name].chunk(dict(zip(variable.dims, chunks)))
+        if fmt == "zarr":
+            encoding[name] = {"chunks": chunks}
+        else:
+            encoding[name] = {"zlib": True, "complevel": complevel, "shuffle": True, "chunksizes": chunks}
+
+    path = path.rstrip("/")
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with atomic_path(path) as tmp_path:
+        if fmt == "zarr":
+            data.to_zarr(tmp_path, mode="w", encoding=encoding, consolidated=True)
+        else:
+            data.to_netcdf(tmp_path, encoding=encoding, format="NETCDF4")
+    return path
+
+def read_forcings(path, chunks=None):
+    ''' Open a file written by write_forcings lazily
+        Parameters:
+        -----------
+        path:   string
+                NetCDF4 file or Zarr store
+        chunks: dict
+                dask chunks. Default: None (the chunks on disk)
+
+        Returns:
+        --------
+        data: xarray.Dataset
+    '''
+
+    if path.rstrip("/").endswith(".zarr"):
+        return xr.open_zarr(path, chunks=chunks if chunks is not None else {}, consolidated=True)
+    return xr.open_dataset(path, chunks=chunks if chunks is not None else {})
@@ -22,6 +22,8 @@ setup(
     #package_data={"forcing_tools": ["LICENSE", "data/*.txt", "data/*.nc", "data/*.csv",]},
     include_package_data=False,
     install_requires=["matplotlib", "numpy","netCDF4", "xarray", "dask", "scipy", "cartopy"],
+    extras_require={"zarr": ["zarr", "fsspec", "gcsfs", "pandas"], "numba": ["numba"]},
+    entry_points={"console_scripts": ["forcing-tools = forcing_tools.pipeline:main"]},
     classifiers=[
         "Development Status :: 5 - Production/Stable",
         "Intended Audience :: Developers",
@@ -0,0 +1,30 @@
+import os
+import sys
+import numpy as np
+import pytest
+import xarray as xr
+
+# run from codes/ or the repository root without installing forcing_tools
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+@pytest.fixture
+def fluxes():
+    ''' Small aerosol and control datasets with the TOA fluxes and cloud fraction, dim=(time, lat, lon) '''
+
+    rng = np.random.default_rng(0)
+    shape = (24, 6, 8)
+    lat = np.linspace(-75, 75, shape[1])
+    lon = np.arange(shape[2]) * 45.0
+    time = np.arange(shape[0])
+
+    def make(offset):
+        data = {v: (("time", "lat", "lon"), rng.uniform(lo, hi, shape) + offset)
+                for v, (lo, hi) in {"rsdt": (300, 400), "rsut": (80, 120), "rlut": (200, 260),
+                                    "rsutcs": (50, 80), "rlutcs": (230, 290)}.items()}
+        clt = rng.uniform(0, 100, shape)
+        clt[0, 0, :3] = 0.5
+        data["clt"] = (("time", "lat", "lon"), clt)
+        return xr.Dataset(data, coords={"time": time, "lat": lat, "lon": lon})
+
+    return make(1.0), make(0.0)
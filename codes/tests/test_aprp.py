@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+import xarray as xr
+from forcing_tools import compute_aprp
+from forcing_tools.forcings import APRP_COMPONENTS
+
+SHAPE = (12, 4, 6)
+
+def _fluxes(c, mu_clr, gamma_clr, alpha, mu_cld, gamma_cld, rsdt=400.0, rlutcs=260.0, rlut=240.0):
+    ''' Fluxes of the single-layer model of Taylor et al. (2007) with the given parameters '''
+
+    def sky(mu, gamma):
+        albedo = mu * gamma + mu * (1 - gamma)**2 * alpha / (1 - alpha * gamma)
+        down = mu * (1 - gamma) / (1 - alpha * gamma)
+        return rsdt * albedo, rsdt * down, rsdt * down * alpha
+
+    clear = sky(mu_clr, gamma_clr)
+    overcast = sky(mu_clr * mu_cld, 1 - (1 - gamma_clr) * (1 - gamma_cld))
+    allsky = [(1 - c) * cs + c * oc for cs, oc in zip(clear, overcast)]
+    values = dict(rsdt=rsdt, rsut=allsky[0], rsds=allsky[1], rsus=allsky[2], rsutcs=clear[0], rsdscs=clear[1],
+                  rsuscs=clear[2], rlut=rlut, rlutcs=rlutcs, clt=100 * c)
+    rng = np.random.default_rng(0)
+    scale = rng.uniform(0.8, 1.2, SHAPE)  # the insolation varies, the parameters do not
+    return xr.Dataset({name: (("time", "lat", "lon"), np.broadcast_to(value, SHAPE) * (scale if name.startswith("rs") else 1))
+                       for name, value in values.items()})
+
+CONTROL = dict(c=0.6, mu_clr=0.9, gamma_clr=0.1, alpha=0.2, mu_cld=0.95, gamma_cld=0.4)
+
+@pytest.mark.parametrize("change, term", [({"gamma_clr": 0.12, "mu_clr": 0.88}, "sw_ari"),
+                                          ({"c": 0.65, "gamma_cld": 0.45}, "sw_aci"),
+                                          ({"alpha": 0.25}, "sw_albedo")])
+def test_each_term_isolates_its_perturbation(change, term):
+    control = _fluxes(**CONTROL)
+    aerosols = _fluxes(**dict(CONTROL, **change))
+    components = compute_aprp(aerosols, control)
+    sw_allsky = (aerosols.rsdt - aerosols.rsut) - (control.rsdt - control.rsut)
+    assert float(abs(sw_allsky).min()) > 0.1
+    np.testing.assert_allclose(components[term].values, sw_allsky.values, rtol=1e-10)
+    for other in ("sw_ari", "sw_aci", "sw_albedo", "sw_aprp_residual"):
+        if other != term:
+            np.testing.assert_allclose(components[other].values, 0, atol=1e-9)
+
+def test_terms_add_up_and_longwave():
+    control = _fluxes(**CONTROL)
+    aerosols = _fluxes(c=0.62, mu_clr=0.89, gamma_clr=0.11, alpha=0.21, mu_cld=0.94, gamma_cld=0.42,
+                       rlutcs=258.0, rlut=239.0)
+    components = compute_aprp(aerosols, control)
+    assert list(components.data_vars) == list(APRP_COMPONENTS)
+    sw_allsky = (aerosols.rsdt - aerosols.rsut) - (control.rsdt - control.rsut)
+    total = components.sw_ari + components.sw_aci + components.sw_albedo + components.sw_aprp_residual
+    np.testing.assert_allclose(total.values, sw_allsky.values, rtol=1e-12)
+    assert float(abs(components.sw_aprp_residual).max()) < 0.01 * float(abs(sw_allsky).max())
+    np.testing.assert_allclose(components.lw_ari.values, 2.0)
+    np.testing.assert_allclose((components.lw_ari + components.lw_aci).values, 1.0)
+
+def test_dark_cells_and_dask():
+    control = _fluxes(**CONTROL)
+    aerosols = _fluxes(**dict(CONTROL, c=0.7))
+    for data in (control, aerosols):
+        for name in ("rsdt", "rsut", "rsds", "rsus", "rsutcs", "rsdscs", "rsuscs"):
+            data[name][:, 0] = 0.0
+    eager = compute_aprp(aerosols, control)
+    assert (eager.sw_aci.values[:, 0] == 0).all() and np.isfinite(eager.sw_aci.values).all()
+    lazy = compute_aprp(aerosols.chunk({"time": 4}), control.chunk({"time": 4}))
+    assert lazy.sw_aci.chunks is not None
+    xr.testing.assert_allclose(lazy.compute(), eager)
+
+def test_missing_variables_are_reported():
+    control = _fluxes(**CONTROL)
+    with pytest.raises(ValueError, match="rsus"):
+        compute_aprp(control.drop_vars("rsus"), control)
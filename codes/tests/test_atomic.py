@@ -0,0 +1,60 @@
+import json
+import os
+import pytest
+import xarray as xr
+import synthetic
+from forcing_tools import atomic_path, write_json
+from forcing_tools import pipeline
+
+def test_write_json_replaces_the_file(tmp_path):
+    path = str(tmp_path / "index.json")
+    write_json(path, {"a": 1})
+    write_json(path, {"a": 2})
+    with open(path) as f:
+        assert json.load(f) == {"a": 2}
+    assert os.listdir(str(tmp_path)) == ["index.json"]
+
+def test_failed_write_keeps_the_old_file(tmp_path):
+    path = str(tmp_path / "state.json")
+    write_json(path, {"stage": "done"})
+    with pytest.raises(RuntimeError):
+        with atomic_path(path) as tmp_path_:
+            with open(tmp_path_, "w") as f:
+                f.write("{broken")
+            raise RuntimeError("killed")
+    with open(path) as f:
+        assert json.load(f) == {"stage": "done"}
+    assert os.listdir(str(tmp_path)) == ["state.json"]
+
+def test_directories_and_extensions(tmp_path):
+    path = str(tmp_path / "store.zarr")
+    for value in (1, 2):
+        with atomic_path(path) as tmp_store:
+            xr.Dataset({"x": ("i", [value])}).to_zarr(tmp_store, mode="w", consolidated=False)
+    assert xr.open_zarr(path, consolidated=False)["x"].values.tolist() == [2]
+    with atomic_path(str(tmp_path / "figure.pdf"), keep_extension=True) as tmp_figure:
+        assert tmp_figure.endswith(".pdf") and os.path.dirname(tmp_figure) == str(tmp_path)
+        open(tmp_figure, "w").close()
+    assert sorted(os.listdir(str(tmp_path))) == ["figure.pdf", "store.zarr"]
+
+def test_serial_pipeline_run_and_rerun(tmp_path):
+    root = str(tmp_path / "RFMIP")
+    synthetic.write_tree(root, resolution=30, years=2)
+    out = str(tmp_path / "out")
+    log = pipeline.run(root, out, figure_variables=())
+    assert [(stage, status) for _, stage, status, _ in log][1:] == [
+        (stage, "done") for stage in pipeline.STAGES[1:]]
+    log = pipeline.run(root, out, scan=False, figure_variables=())
+    assert {status for _, _, status, _ in log} == {"up to date"}
+    assert not [name for name in os.listdir(os.path.join(out, "SYNTH-ESM")) if ".tmp" in name]
+
+def test_temporary_names_are_unique_per_call(tmp_path):
+    path = str(tmp_path / "chunk")
+    with atomic_path(path) as first, atomic_path(path) as second:
+        assert first != second and ".tmp" in os.path.basename(first)
+        for name, content in ((first, "a"), (second, "b")):
+            with open(name, "w") as f:
+                f.write(content)
+    with open(path) as f:
+        assert f.read() == "a"
+    assert os.listdir(str(tmp_path)) == ["chunk"]
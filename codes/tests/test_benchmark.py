@@ -0,0 +1,22 @@
+import json
+import os
+import cartopy.mpl.geoaxes
+import run
+
+def test_benchmark_run_appends_results(tmp_path, monkeypatch):
+    coastlines = cartopy.mpl.geoaxes.GeoAxes.coastlines
+    monkeypatch.chdir(str(tmp_path))
+    results = str(tmp_path / "bench.jsonl")
+    for _ in range(2):
+        run.main(["--resolution", "30", "--years", "1", "--no-coastlines", "--results", results])
+
+    with open(results) as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == 2
+    assert {"read_netcdf", "read_netcdf_pool", "forcing_aprp", "plot_data"} <= set(records[0]["stages"])
+    assert cartopy.mpl.geoaxes.GeoAxes.coastlines is coastlines  # nothing patched globally
+    assert os.listdir(str(tmp_path)) == ["bench.jsonl"]
+
+def test_default_results_outside_the_source_tree():
+    source_tree = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(run.__file__))))
+    assert not os.path.abspath(run.RESULTS).startswith(source_tree + os.sep)
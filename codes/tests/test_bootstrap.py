@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+import xarray as xr
+from forcing_tools import bootstrap_test
+from forcing_tools.bootstrap import default_block_length
+
+@pytest.fixture
+def sample():
+    ''' AR(1) anomalies on 20 cells: half with zero mean, half shifted well away from it '''
+
+    rng = np.random.default_rng(5)
+    noise = rng.normal(size=(240, 20))
+    values = np.empty_like(noise)
+    values[0] = noise[0]
+    for t in range(1, 240):
+        values[t] = 0.6 * values[t - 1] + noise[t]
+    values[:, 10:] += 2.0
+    return xr.DataArray(values.reshape(240, 4, 5), dims=("time", "lat", "lon"),
+                        coords={"lat": np.arange(4.0), "lon": np.arange(5.0)})
+
+@pytest.mark.parametrize("method", ["block", "permutation"])
+def test_shifted_cells_are_significant(sample, method):
+    p_value, lower, upper = bootstrap_test(sample, method=method, n_resamples=999, max_workers=1)
+    assert p_value.dims == ("lat", "lon")
+    p = p_value.values.reshape(-1)
+    assert (p[10:] < 0.01).all() and np.median(p[:10]) > 0.05
+    mean = sample.mean("time").values
+    assert (lower.values < mean).all() and (mean < upper.values).all()
+
+def test_results_do_not_depend_on_batching(sample):
+    serial = bootstrap_test(sample, n_resamples=499, max_workers=1)
+    batched = bootstrap_test(sample, n_resamples=499, max_workers=2, batch_size=3)
+    for a, b in zip(serial, batched):
+        np.testing.assert_allclose(a.values, b.values, rtol=1e-12)
+
+def test_missing_cells_and_numpy_input(sample):
+    values = sample.values.copy()
+    values[3, 0, 0] = np.nan
+    p_value, lower, upper = bootstrap_test(values, n_resamples=199, max_workers=1)
+    assert isinstance(p_value, np.ndarray) and p_value.shape == (4, 5)
+    assert np.isnan(p_value[0, 0]) and np.isnan(lower[0, 0]) and np.isfinite(p_value.reshape(-1)[1:]).all()
+
+def test_arguments_are_checked(sample):
+    assert default_block_length(240) == 6
+    with pytest.raises(ValueError, match="method"):
+        bootstrap_test(sample, method="jackknife")
+    with pytest.raises(ValueError, match="block_length"):
+        bootstrap_test(sample, block_length=241)
@@ -0,0 +1,73 @@
+import os
+import numpy as np
+import pytest
+import xarray as xr
+from forcing_tools import ResultCache, compute_forcings_allsky
+from forcing_tools.cache import _source_files
+
+@pytest.fixture
+def opened(tmp_path, fluxes):
+    ''' The fluxes fixture written as two files per experiment and opened with open_mfdataset '''
+
+    datasets = {}
+    for name, data in zip(("aer", "ctl"), fluxes):
+        paths = []
+        for i, part in enumerate((slice(0, 12), slice(12, 24))):
+            path = str(tmp_path / "{}{}.nc".format(name, i))
+            data.isel(time=part).to_netcdf(path)
+            paths.append(path)
+        datasets[name] = xr.open_mfdataset(paths)
+    yield datasets["aer"], datasets["ctl"]
+    for data in datasets.values():
+        data.close()
+
+def test_source_files_of_multi_file_dataset(opened):
+    aer, _ = opened
+    assert [os.path.basename(f) for f in _source_files([aer])] == ["aer0.nc", "aer1.nc"]
+    assert len(_source_files([aer["rsut"] * 2])) == 2
+
+def test_argument_order_is_part_of_the_key(tmp_path, opened):
+    aer, ctl = opened
+    cache = ResultCache(str(tmp_path / "cache"))
+    forward = cache.cached(compute_forcings_allsky, aer, ctl)
+    backward = cache.cached(compute_forcings_allsky, ctl, aer)
+    np.testing.assert_allclose(forward[0], -backward[0])
+
+def test_selection_is_part_of_the_key(tmp_path, opened):
+    aer, ctl = opened
+    cache = ResultCache(str(tmp_path / "cache"))
+    cache.cached(compute_forcings_allsky, aer, ctl)
+    part = cache.cached(compute_forcings_allsky, aer.isel(time=slice(0, 12)), ctl.isel(time=slice(0, 12)))
+    assert part[0].sizes["time"] == 12
+
+def test_repeated_call_hits_the_cache(tmp_path, opened):
+    aer, ctl = opened
+    cache = ResultCache(str(tmp_path / "cache"))
+    first = cache.cached(compute_forcings_allsky, aer, ctl)
+    calls = []
+    def counted(a, c):
+        calls.append(1)
+        return compute_forcings_allsky(a, c)
+    counted.__qualname__ = compute_forcings_allsky.__qualname__
+    counted.__module__ = compute_forcings_allsky.__module__
+    second = cache.cached(counted, aer, ctl)
+    assert not calls
+    np.testing.assert_array_equal(first[0], second[0])
+
+def test_in_memory_arguments_are_hashed(tmp_path, fluxes):
+    aer, ctl = fluxes
+    cache = ResultCache(str(tmp_path / "cache"))
+    files = [__file__]
+    first = cache.cached(compute_forcings_allsky, aer, ctl, files=files)
+    changed = aer.assign(rsut=aer["rsut"] + 1)
+    second = cache.cached(compute_forcings_allsky, changed, ctl, files=files)
+    np.testing.assert_allclose(second[0], first[0] - 1)
+
+def test_touching_a_file_changes_the_key(tmp_path, opened):
+    aer, ctl = opened
+    cache = ResultCache(str(tmp_path / "cache"))
+    files = _source_files([aer, ctl])
+    key = cache.key("f", files, args=(aer, ctl))
+    stat = os.stat(files[1])
+    os.utime(files[1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.key("f", files, args=(aer, ctl)) != key
@@ -0,0 +1,133 @@
+import importlib.util
+import os
+import numpy as np
+import pytest
+
+import synthetic
+from forcing_tools import Catalog, parse_filename
+
+SCRIPTS = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "scripts")
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / "RFMIP"
+    synthetic.write_tree(str(root), source_ids=("NorESM2-LM",), variables=("rsdt", "rsut", "rlut", "rsutcs", "rlutcs"),
+                         resolution=30, years=1)
+    return root
+
+def test_parse_filename():
+    facets = parse_filename("/data/rsdt_Amon_NorESM2-LM_piClim-control_r1i1p1f1_gn_000101-003012.nc")
+    assert facets["source_id"] == "NorESM2-LM" and facets["grid_label"] == "gn"
+    assert (facets["start"], facets["end"]) == ("000101", "003012")
+    assert parse_filename("areacella_fx_NorESM2-LM_piClim-control_r1i1p1f1_gn.nc")["start"] is None
+    assert parse_filename("notes.txt") is None and parse_filename("a_b.nc") is None
+
+def test_build_save_load_and_query(tree, tmp_path):
+    index = str(tmp_path / "index.json")
+    built = Catalog.build(str(tree), index)
+    loaded = Catalog.load(index)
+    assert len(loaded) == len(built) == 10
+    files = loaded.files("NorESM2-LM", "piClim-control", variables=("rsdt", "rlut"))
+    assert list(files) == ["rsdt", "rlut"] and all(len(paths) == 1 for paths in files.values())
+    assert loaded.members("NorESM2-LM", "piClim-control") == ["r1i1p1f1"]
+    with pytest.raises(KeyError):
+        loaded.files("NorESM2-LM", "piClim-control", variables=("clt",))
+
+def test_build_follows_symlink_loops_once(tree):
+    os.symlink(str(tree), str(tree / "piClim-control" / "loop"))
+    os.symlink(str(tree / "piClim-control"), str(tree / "control"))
+    assert len(Catalog.build(str(tree))) == 10
+
+def test_files_rejects_mixed_grids(tree):
+    directory = tree / "piClim-control" / "rsdt"
+    name = os.listdir(str(directory))[0]
+    os.link(str(directory / name), str(directory / name.replace("_gn_", "_gr_")))
+    catalog = Catalog.build(str(tree))
+    with pytest.raises(ValueError, match="several grids"):
+        catalog.files("NorESM2-LM", "piClim-control", variables=("rsdt",))
+    assert "_gr_" in catalog.files("NorESM2-LM", "piClim-control", variables=("rsdt",), grid_label="gr")["rsdt"][0]
+
+def test_script_reads_through_the_catalog(tree):
+    spec = importlib.util.spec_from_file_location("forcing_NorESM2", os.path.join(SCRIPTS, "forcing_NorESM2.py"))
+    script = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(script)
+
+    data = script.RadiativeFluxData()
+    data.read(path=str(tree))
+    assert data.rsut_aer.shape == (12, 6, 12)
+    assert len(data.timings) == 10
+    assert not np.array_equal(data.rsut_aer, data.rsut_c)
+
+def test_scripts_reuse_the_saved_index(tree, monkeypatch):
+    from forcing_tools.catalog import INDEX_FILE
+    spec = importlib.util.spec_from_file_location("forcing_NorESM2", os.path.join(SCRIPTS, "forcing_NorESM2.py"))
+    script = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(script)
+
+    script.RadiativeFluxData().read(path=str(tree))
+    assert os.path.exists(str(tree / INDEX_FILE))
+    monkeypatch.setattr(Catalog, "build", classmethod(lambda cls, *a, **k: pytest.fail("tree walked again")))
+    data = script.RadiativeFluxData()
+    data.read(path=str(tree))
+    assert data.rsut_aer.shape == (12, 6, 12)
+
+def test_merged_members():
+    from forcing_tools import merged_members
+    assert merged_members(["r1234i1p1f1"]) == ["r1234i1p1f1"]
+    assert merged_members(["r1i1p1f1", "r2i1p1f1", "r3i1p1f1", "r123i1p1f1"]) == ["r123i1p1f1"]
+    assert merged_members(["r{}i1p1f1".format(r) for r in range(1, 13)]) == []
+    assert merged_members(["r21i1p1f1", "r1i1p1f1", "r10i1p1f1"]) == []
+
+def test_ensemble_leaves_out_the_merged_member(tmp_path):
+    root = str(tmp_path / "RFMIP")
+    synthetic.write_tree(root, source_ids=("IPSL-CM6A-LR",), experiments=("piClim-control",), variables=("rsdt",),
+                         members=2, resolution=30, years=1)
+    directory = os.path.join(root, "piClim-control", "rsdt")
+    r1 = [name for name in os.listdir(directory) if "_r1i1p1f1_" in name][0]
+    os.link(os.path.join(directory, r1), os.path.join(directory, r1.replace("_r1i1p1f1_", "_r12i1p1f1_")))
+    catalog = Catalog.build(root)
+
+    assert catalog.members("IPSL-CM6A-LR", "piClim-control", merged=False) == ["r1i1p1f1", "r2i1p1f1"]
+    assert "_r1i1p1f1_" in catalog.files("IPSL-CM6A-LR", "piClim-control", variables=("rsdt",))["rsdt"][0]
+    ensemble = catalog.open_ensemble("IPSL-CM6A-LR", "piClim-control", variables=("rsdt",))
+    assert list(ensemble["realization"].values) == ["r1i1p1f1", "r2i1p1f1"]
+    with pytest.raises(ValueError, match="r12i1p1f1"):
+        catalog.open_ensemble("IPSL-CM6A-LR", "piClim-control", members=["r1i1p1f1", "r12i1p1f1"], variables=("rsdt",))
+    ensemble.close()
+
+    for name in os.listdir(directory):
+        if "_r12i1p1f1_" not in name:
+            os.remove(os.path.join(directory, name))
+    catalog = Catalog.build(root)
+    with pytest.raises(KeyError, match="pre-merged"):
+        catalog.open_ensemble("IPSL-CM6A-LR", "piClim-control", variables=("rsdt",))
+    assert "_r12i1p1f1_" in catalog.files("IPSL-CM6A-LR", "piClim-control", variables=("rsdt",))["rsdt"][0]
+
+def test_ensemble_mean_of_opened_members(tmp_path):
+    from forcing_tools.reader import ensemble_mean
+    root = str(tmp_path / "RFMIP")
+    synthetic.write_tree(root, source_ids=("NorESM2-LM",), experiments=("piClim-control",), variables=("rsdt", "rsut"),
+                         members=3, resolution=30, years=1)
+    ensemble = Catalog.build(root).open_ensemble("NorESM2-LM", "piClim-control", variables=("rsdt", "rsut"))
+    assert "realization" in ensemble["time_bnds"].dims
+    mean, spread = ensemble_mean(ensemble)
+    np.testing.assert_allclose(mean["rsut"], ensemble["rsut"].mean("realization"), rtol=1e-6)
+    np.testing.assert_allclose(spread["rsut"], ensemble["rsut"].std("realization", ddof=1), rtol=1e-4, atol=1e-4)
+    assert mean["time_bnds"].dims == ("time", "bnds") and (mean["time_bnds"] == ensemble["time_bnds"][0]).all()
+    ensemble.close()
+
+def test_xarray_script_averages_the_realizations(tmp_path):
+    root = str(tmp_path / "RFMIP")
+    synthetic.write_tree(root, source_ids=("MPI-ESM1-2-LR",), variables=("rsdt", "rsut", "rlut"), members=3,
+                         resolution=30, years=1)
+    spec = importlib.util.spec_from_file_location("forcing_MPI_xarray", os.path.join(SCRIPTS, "forcing_MPI_xarray.py"))
+    script = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(script)
+
+    data = script.RadiativeFluxData()
+    data.read(path=root, dtype="float32")
+    ensemble = Catalog.build(root).open_ensemble("MPI-ESM1-2-LR", "piClim-control", variables=("rsut",))
+    assert data.rsut_c.shape == (12, 6, 12) and data.rsut_c.dtype == np.float32
+    np.testing.assert_allclose(data.rsut_c, ensemble["rsut"].mean("realization"), rtol=1e-6)
+    assert set(data.spread_aer.data_vars) == {"rsdt", "rsut", "rlut"}
+    ensemble.close()
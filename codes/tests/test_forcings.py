@@ -0,0 +1,107 @@
+import warnings
+import numpy as np
+import pytest
+import xarray as xr
+from forcing_tools import forcings
+
+def _reference_cloudy(aer, ctl):
+    ''' The cloudy-sky division as written before the fused kernel '''
+
+    sw_all, lw_all = forcings.compute_forcings_allsky(aer, ctl)
+    sw_clr, lw_clr = forcings.compute_forcings_clearsky(aer, ctl)
+    threshold = lambda f: xr.where(f < 0.01, 0, f)
+    divide = lambda n, d: xr.where(d != 0, n / d.where(d != 0), 0)
+    f_aer, f_ctl = aer["clt"] * 0.01, ctl["clt"] * 0.01
+    return (divide(sw_all - (1 - f_ctl) * sw_clr, threshold(f_ctl)), divide(sw_all - (1 - f_aer) * sw_clr, threshold(f_aer)),
+            divide(lw_all - (1 - f_ctl) * lw_clr, threshold(f_ctl)), divide(lw_all - (1 - f_aer) * lw_clr, threshold(f_aer)))
+
+def test_cloudy_sky_matches_reference(fluxes):
+    aer, ctl = fluxes
+    reference = _reference_cloudy(aer, ctl)
+    for result in (forcings.compute_cloudy_sky(aer, ctl), forcings.compute_cloudy_sky(aer.chunk({"time": 6}), ctl.chunk({"time": 6}))):
+        for r, expected in zip(result, reference):
+            np.testing.assert_array_equal(r.values, expected.values)
+
+def test_cloudy_sky_below_threshold_is_zero(fluxes):
+    aer, ctl = fluxes
+    sw_control, sw_aer, lw_control, lw_aer = forcings.compute_cloudy_sky(aer, ctl)
+    assert np.all(sw_aer.values[0, 0, :3] == 0) and np.all(lw_control.values[0, 0, :3] == 0)
+
+def test_cloudy_sky_default_engine_is_numpy(fluxes, monkeypatch):
+    monkeypatch.setattr(forcings, "_compile_cloudy", lambda: pytest.fail("numba used by default"))
+    aer, ctl = fluxes
+    forcings.compute_all_components(aer.chunk({"time": 6}), ctl.chunk({"time": 6})).compute()
+
+@pytest.mark.skipif(forcings.numba is None, reason="numba not installed")
+@pytest.mark.parametrize("dtype", ["float32", "float64"])
+def test_cloudy_sky_numba_matches_numpy(fluxes, dtype):
+    aer, ctl = (d.astype(dtype) for d in fluxes)
+    aer["clt"][1, 1, 1] = np.nan
+    args = forcings.compute_forcings_allsky(aer, ctl) + forcings.compute_forcings_clearsky(aer, ctl) + (aer["clt"], ctl["clt"])
+    expected = forcings.cloudy_sky_division(*args, engine="numpy")
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", RuntimeWarning)
+        result = forcings.cloudy_sky_division(*[a.chunk({"time": 6}) for a in args], engine="numba")
+        result = [r.compute() for r in result]
+    for r, e in zip(result, expected):
+        assert r.dtype == dtype
+        np.testing.assert_array_equal(r.values, e.values)
+    assert np.isnan(result[1].values[1, 1, 1])
+
+def test_all_components_consistent(fluxes):
+    aer, ctl = fluxes
+    components = forcings.compute_all_components(aer, ctl)
+    sw_all, lw_all = forcings.compute_forcings_allsky(aer, ctl)
+    np.testing.assert_allclose(components["sw_allsky"], sw_all)
+    np.testing.assert_allclose(components["sw_fclear"] + components["sw_fcloudy"], sw_all)
+
+def _no_compute(dsk, keys, **kwargs):
+    pytest.fail("the graph was computed while it was built")
+
+def test_cloudy_sky_stays_lazy(fluxes):
+    import dask
+    aer, ctl = (d.chunk({"time": 6}) for d in fluxes)
+    with dask.config.set(scheduler=_no_compute):
+        result = forcings.compute_cloudy_sky(aer, ctl)
+    assert all(isinstance(r, xr.DataArray) and r.chunks == aer["rsut"].chunks for r in result)
+
+def test_all_components_lazy_matches_eager(fluxes):
+    aer, ctl = fluxes
+    eager = forcings.compute_all_components(aer, ctl)
+    lazy = forcings.compute_all_components(aer.chunk({"time": 6}), ctl.chunk({"time": 6}))
+    assert all(lazy[v].chunks is not None for v in lazy.data_vars)
+    xr.testing.assert_allclose(lazy.compute(), eager)
+    np.testing.assert_allclose(eager["lw_fclear"] + eager["lw_fcloudy"], eager["lw_allsky"])
+    sw_clr, lw_clr = forcings.compute_forcings_clearsky(aer, ctl)
+    np.testing.assert_allclose(eager["lw_clearsky"], lw_clr)
+    for name, expected in zip(("sw_cloudy_control", "sw_cloudy_aer", "lw_cloudy_control", "lw_cloudy_aer"),
+                              forcings.compute_cloudy_sky(aer, ctl)):
+        np.testing.assert_allclose(eager[name], expected)
+
+def test_stack_models_trims_to_shortest_record(fluxes):
+    aer, ctl = fluxes
+    models = {"long": (aer, ctl), "short": (aer.isel(time=slice(0, 12)), ctl.isel(time=slice(0, 12)))}
+    last, _ = forcings.stack_models(models)
+    first, _ = forcings.stack_models(models, keep="first")
+    assert dict(last.sizes) == {"model": 2, "time": 12, "lat": 6, "lon": 8}
+    assert list(last["model"].values) == ["long", "short"]
+    np.testing.assert_array_equal(last["rsut"].sel(model="long"), aer["rsut"].values[-12:])
+    np.testing.assert_array_equal(first["rsut"].sel(model="long"), aer["rsut"].values[:12])
+    with pytest.raises(ValueError):
+        forcings.stack_models(models, keep="middle")
+
+def test_stack_models_rejects_other_grids(fluxes):
+    aer, ctl = fluxes
+    shifted = (aer.assign_coords(lon=aer["lon"] + 1), ctl.assign_coords(lon=ctl["lon"] + 1))
+    with pytest.raises(ValueError, match="regrid"):
+        forcings.stack_models({"a": (aer, ctl), "b": shifted})
+
+def test_multi_model_matches_single_models(fluxes):
+    aer, ctl = fluxes
+    scaled = (aer * 1.1, ctl)
+    components = forcings.compute_multi_model({"a": (aer, ctl), "b": scaled})
+    assert components["sw_fcloudy"].dims == ("model", "time", "lat", "lon")
+    for name, data in (("a", (aer, ctl)), ("b", scaled)):
+        expected = forcings.compute_all_components(*data)
+        np.testing.assert_allclose(components["sw_allsky"].sel(model=name), expected["sw_allsky"])
+        np.testing.assert_allclose(components["lw_cloudy_aer"].sel(model=name), expected["lw_cloudy_aer"])
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+import xarray as xr
+from forcing_tools import cell_area, cell_bounds, global_grid, grid_fingerprint
+from forcing_tools.grid import EARTH_RADIUS, clear_registry
+
+def test_cell_areas_cover_the_sphere():
+    for grid in (global_grid(2.5), global_grid(3.0, 5.0)):
+        assert float(cell_area(grid).sum()) == pytest.approx(4 * np.pi * EARTH_RADIUS**2, rel=1e-12)
+
+def test_bounds_from_centres_match_explicit_bounds():
+    grid = global_grid(2.0)
+    without_bounds = xr.Dataset(coords={"lat": grid["lat"].values, "lon": grid["lon"].values})
+    np.testing.assert_allclose(cell_bounds(without_bounds)[0], grid["lat_bnds"].values)
+    np.testing.assert_allclose(cell_area(without_bounds).values, cell_area(grid).values, rtol=1e-12)
+
+def test_derived_bounds_are_clipped_at_the_poles(fluxes):
+    aer, _ = fluxes  # lat from -75 to 75: the outermost cells are clipped at the poles
+    lat_bnds, _ = cell_bounds(aer)
+    assert lat_bnds[0, 0] == -90.0 and lat_bnds[-1, 1] == 90.0
+    assert float(cell_area(aer).sum()) == pytest.approx(4 * np.pi * EARTH_RADIUS**2, rel=1e-12)
+
+def test_gaussian_grid_uses_its_bounds():
+    # Gauss-Legendre latitudes; the edges are where the cumulative weights reach sin(lat), not the midpoints
+    nodes, weights = np.polynomial.legendre.leggauss(8)
+    edges = np.rad2deg(np.arcsin(np.concatenate([[-1.0], np.cumsum(weights) - 1.0])))
+    edges[-1] = 90.0
+    lon = np.arange(16) * 22.5
+    grid = xr.Dataset(coords={"lat": ("lat", np.rad2deg(np.arcsin(nodes)), {"bounds": "lat_bnds"}), "lon": lon})
+    grid["lat_bnds"] = (("lat", "bnds"), np.stack([edges[:-1], edges[1:]], axis=1))
+    np.testing.assert_allclose(cell_bounds(grid)[0], grid["lat_bnds"].values)
+    area = cell_area(grid)
+    # the Gaussian weights are the area fractions of the latitude bands
+    np.testing.assert_allclose(area.sum("lon") / area.sum(), weights / 2, rtol=1e-10)
+    midpoints = cell_area(grid.drop_vars("lat_bnds"))
+    assert not np.allclose(midpoints.sum("lon") / midpoints.sum(), weights / 2, rtol=1e-3)
+
+def test_wrapping_longitude_bounds():
+    grid = global_grid(30.0)
+    shifted = grid.assign_coords(lon=(grid["lon"] - 15.0) % 360)
+    shifted["lon_bnds"] = (("lon", "bnds"), (grid["lon_bnds"].values - 15.0) % 360)  # first cell [345, 15]
+    assert shifted["lon_bnds"].values[0].tolist() == [345.0, 15.0]
+    np.testing.assert_allclose(cell_area(shifted).values, cell_area(grid).values, rtol=1e-12)
+    descending = grid.isel(lon=slice(None, None, -1))
+    descending["lon_bnds"] = descending["lon_bnds"][:, ::-1]
+    np.testing.assert_allclose(cell_area(descending).values, cell_area(grid).values, rtol=1e-12)
+
+def test_areas_are_memoized_per_grid(fluxes):
+    clear_registry()
+    aer, ctl = fluxes
+    first = cell_area(aer)
+    assert cell_area(ctl["rsut"]).values is first.values
+    assert not first.values.flags.writeable
+    shifted = aer.assign_coords(lon=aer["lon"] + 1.0)
+    assert grid_fingerprint(shifted["lat"], shifted["lon"]) != grid_fingerprint(aer["lat"], aer["lon"])
+    assert cell_area(shifted).values is not first.values
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+from forcing_tools import IncrementalStats, t_test_streaming, time_series
+
+def test_updates_match_the_full_record(tmp_path, fluxes):
+    aer, _ = fluxes
+    rsut = aer["rsut"]
+    state = IncrementalStats(str(tmp_path / "state"))
+    assert state.watermark is None
+    assert state.update(rsut.isel(time=slice(0, 10))) == 10
+    assert state.watermark == 9
+
+    # a new session picks up the watermark and folds in only the later steps of the whole record
+    state = IncrementalStats(str(tmp_path / "state"))
+    assert state.watermark == 9
+    assert state.update(rsut, chunk_size=5) == 14
+    assert state.update(rsut) == 0
+    assert state.watermark == 23
+
+    np.testing.assert_allclose(state.time_series().values, time_series(aer, rsut, plot=False).values, rtol=1e-12)
+    np.testing.assert_allclose(state.variance(), rsut.var("time", ddof=1).values, rtol=1e-10)
+    expected = t_test_streaming(rsut, 100)
+    for result, reference in zip(state.t_test(100), expected):
+        np.testing.assert_allclose(result, reference, rtol=1e-8)
+
+def test_other_grid_is_rejected(tmp_path, fluxes):
+    aer, _ = fluxes
+    state = IncrementalStats(str(tmp_path))
+    state.update(aer["rsut"].isel(time=slice(0, 12)))
+    moved = aer["rsut"].assign_coords(lon=aer["lon"] + 1.0)
+    with pytest.raises(ValueError, match="grid"):
+        state.update(moved)
+    assert state.watermark == 11
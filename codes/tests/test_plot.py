@@ -0,0 +1,64 @@
+import os
+import pickle
+import numpy as np
+import pytest
+import cartopy.mpl.geoaxes
+import matplotlib.pyplot as plt
+from forcing_tools.plot import _reduce_job, _render_job, plot_data, plot_significance
+
+def test_jobs_are_reduced_to_the_2d_mean_before_pickling(fluxes):
+    aer, _ = fluxes
+    field = aer["rsut"].chunk({"time": 6})
+    job = _reduce_job({"field": field, "output": "x", "dataset": aer, "title": "rsut"})
+    assert isinstance(job["field"], np.ndarray) and job["field"].shape == (6, 8)
+    np.testing.assert_allclose(job["field"], aer["rsut"].mean("time").values)
+    assert list(job["dataset"].coords) == ["lat", "lon"] and not job["dataset"].data_vars
+    assert job["title"] == "rsut"
+    assert len(pickle.dumps(job)) < aer["rsut"].nbytes / 4
+
+def test_numpy_fields_need_coordinates(fluxes):
+    aer, _ = fluxes
+    with pytest.raises(ValueError, match="dataset"):
+        _reduce_job({"field": aer["rsut"].values, "output": "x"})
+    job = _reduce_job({"field": aer["rsut"].values[0], "output": "x", "dataset": aer})
+    np.testing.assert_array_equal(job["field"], aer["rsut"].values[0])
+
+def test_render_numpy_field(tmp_path, fluxes, monkeypatch):
+    monkeypatch.setattr(cartopy.mpl.geoaxes.GeoAxes, "coastlines", lambda self, *a, **k: None)
+    aer, ctl = fluxes
+    job = _reduce_job({"field": (aer["rsut"] - ctl["rsut"]).values[0], "output": str(tmp_path / "maps" / "rsut"),
+                       "dataset": aer})
+    output, seconds = _render_job(job)
+    assert output.endswith("rsut.pdf") and os.path.getsize(output) > 0
+    assert os.listdir(str(tmp_path / "maps")) == ["rsut.pdf"]
+
+def test_render_batch_offline(tmp_path, fluxes):
+    from forcing_tools import render_batch
+    aer, ctl = fluxes
+    jobs = [{"field": (aer[v] - ctl[v]).chunk({"time": 12}), "output": str(tmp_path / v), "coastlines": False}
+            for v in ("rsut", "rlut")]
+    results = render_batch(jobs, max_workers=2)
+    assert [output for output, _ in results] == [str(tmp_path / "rsut.pdf"), str(tmp_path / "rlut.pdf")]
+    assert sorted(os.listdir(str(tmp_path))) == ["rlut.pdf", "rsut.pdf"]
+
+def test_plot_data_inputs_agree(fluxes):
+    aer, ctl = fluxes
+    field = aer["rsut"] - ctl["rsut"]
+    extents = []
+    for data, dtype in ((field.values, "ndarray"), (field.chunk({"time": 6}).data, "ndarray"), (field, "xarray")):
+        cs = plot_data(aer, data, dtype=dtype, coastlines=False)
+        extents.append((cs.norm.vmin, cs.norm.vmax))
+        plt.close("all")
+    v_ext = np.abs(field.mean("time").values).max()
+    np.testing.assert_allclose(extents, [(-v_ext, v_ext)] * 3)
+
+def test_plot_significance_hatches_one_layer(fluxes):
+    aer, _ = fluxes
+    p_value = aer["clt"].isel(time=0) / 100
+    cs = plot_data(aer, aer["rsut"].values, coastlines=False)
+    hatched = plot_significance(p_value, ax=cs.axes, alpha=0.1, rasterized=True)
+    assert list(hatched.levels) == [0, 0.1, 1] and hatched.hatches == ["...", None]
+    assert hatched.get_rasterized()
+    same = plot_significance(p_value.values, dataset=aer, ax=cs.axes, alpha=0.1)
+    assert list(same.levels) == list(hatched.levels)
+    plt.close("all")
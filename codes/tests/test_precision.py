@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from forcing_tools import forcings, precision, set_precision, t_test
+from forcing_tools.precision import as_accumulator, as_field, field_dtype
+from forcing_tools.reader import ensemble_mean
+
+def test_policy_is_scoped():
+    assert field_dtype() is None
+    with precision("float32"):
+        assert field_dtype() == np.float32
+        with pytest.raises(ValueError):
+            set_precision("int32")
+    assert field_dtype() is None
+    assert as_field(np.ones(3)).dtype == np.float64
+
+def test_float32_fields_stay_lazy(fluxes):
+    aer, ctl = (d.chunk({"time": 6}) for d in fluxes)
+    expected = forcings.compute_all_components(*fluxes)
+    with precision("float32"):
+        components = forcings.compute_all_components(aer, ctl)
+        assert as_accumulator(aer["rsut"]).dtype == np.float64
+    assert all(components[v].dtype == np.float32 and components[v].chunks is not None for v in components.data_vars)
+    np.testing.assert_allclose(components["sw_allsky"], expected["sw_allsky"], rtol=1e-5, atol=1e-3)
+
+def test_float32_reductions_accumulate_in_float64(fluxes):
+    aer, _ = fluxes
+    ensemble = (aer["rsut"] + 1e4).expand_dims(realization=3).copy()
+    ensemble[1] += 0.25
+    expected_t, expected_p = t_test(aer["rsut"], 24, 100)
+    with precision("float32"):
+        mean, spread = ensemble_mean(ensemble)
+        t_statistics, p_value = t_test(aer["rsut"], 24, 100)
+    assert mean.dtype == spread.dtype == np.float32
+    np.testing.assert_allclose(spread, ensemble.std("realization", ddof=1), rtol=1e-5)
+    np.testing.assert_allclose(t_statistics, expected_t, rtol=1e-5)
+    np.testing.assert_allclose(p_value, expected_p, rtol=1e-4, atol=1e-12)
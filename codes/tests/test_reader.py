@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+import pytest
+import xarray as xr
+
+import synthetic
+from forcing_tools import read_files
+from forcing_tools.reader import ensemble_mean
+
+
+@pytest.fixture
+def tree(tmp_path):
+    paths = synthetic.write_tree(str(tmp_path), experiments=("piClim-control",), variables=("rsdt", "rsut"),
+                                 resolution=30, years=1, missing_fraction=0.1)
+    variables = [os.path.basename(path).split("_")[0] for path in paths]
+    return {variable: (path, variable) for variable, path in zip(variables, paths)}
+
+def test_read_files_serial_by_default(tree):
+    data, timings = read_files(tree)
+    assert [t["name"] for t in timings] == list(tree)
+    assert {"time", "lat", "lon", "rsdt", "rsut"} <= set(data)
+    assert np.ma.isMaskedArray(data["rsut"]) and data["rsut"].mask.any()
+
+def test_read_files_pool_matches_serial(tree):
+    serial, _ = read_files(tree)
+    pooled, _ = read_files(tree, max_workers=2)
+    for name in serial:
+        np.testing.assert_array_equal(np.ma.filled(serial[name], -1), np.ma.filled(pooled[name], -1))
+
+def test_read_files_fill_nan(tree):
+    masked, _ = read_files(tree)
+    filled, _ = read_files(tree, fill_nan=True)
+    assert type(filled["rsut"]) is np.ndarray
+    np.testing.assert_array_equal(np.isnan(filled["rsut"]), masked["rsut"].mask)
+    np.testing.assert_allclose(filled["rsut"][~masked["rsut"].mask], masked["rsut"].compressed())
+
+def test_ensemble_mean_matches_numpy(fluxes):
+    aer, _ = fluxes
+    ensemble = xr.concat([aer + i * aer["rsdt"] * 0.01 for i in range(4)], dim="realization")
+    mean, spread = ensemble_mean(ensemble.chunk({"time": 6}))
+    np.testing.assert_allclose(mean["rsut"], ensemble["rsut"].values.mean(axis=0))
+    np.testing.assert_allclose(spread["rsut"], ensemble["rsut"].values.std(axis=0, ddof=1))
+    assert "realization" not in mean.dims
+
+def test_ensemble_mean_single_and_empty(fluxes):
+    aer, _ = fluxes
+    ensemble = aer["rlut"].expand_dims("realization")
+    mean, spread = ensemble_mean(ensemble)
+    np.testing.assert_array_equal(mean, aer["rlut"])
+    assert (spread == 0).all()
+    with pytest.raises(ValueError):
+        ensemble_mean(ensemble.isel(realization=slice(0, 0)))
+
+def test_read_files_fill_nan_packed(tmp_path):
+    from netCDF4 import Dataset
+    path = str(tmp_path / "rsut_packed.nc")
+    with Dataset(path, "w") as nc:
+        for name, size in (("time", 2), ("lat", 3), ("lon", 4)):
+            nc.createDimension(name, size)
+            nc.createVariable(name, "f8", (name,))[:] = np.arange(size)
+        variable = nc.createVariable("rsut", "i2", ("time", "lat", "lon"), fill_value=-999)
+        variable.setncatts({"scale_factor": 0.5, "add_offset": 100.0, "missing_value": np.int16(-1)})
+        values = np.ma.masked_array(np.arange(24.0).reshape(2, 3, 4) + 100, mask=False)
+        values[0, 0, 0] = np.ma.masked
+        variable[:] = values
+        variable.set_auto_maskandscale(False)
+        variable[1, 2, 3] = -1
+    masked, _ = read_files({"rsut": (path, "rsut")})
+    filled, _ = read_files({"rsut": (path, "rsut")}, fill_nan=True, dtype="float32")
+    assert filled["rsut"].dtype == np.float32 and np.isnan(filled["rsut"]).sum() == 2
+    np.testing.assert_array_equal(np.isnan(filled["rsut"]), masked["rsut"].mask)
+    np.testing.assert_allclose(filled["rsut"][~masked["rsut"].mask], masked["rsut"].compressed())
+
+def test_read_files_empty():
+    for max_workers in (1, 4):
+        assert read_files({}, max_workers=max_workers) == ({}, [])
@@ -0,0 +1,64 @@
+import os
+import numpy as np
+import pytest
+import xarray as xr
+from forcing_tools import cell_area, conservative_weights, global_grid, regrid
+from forcing_tools import regridding
+
+@pytest.fixture
+def field():
+    source = global_grid(3.0)
+    rng = np.random.default_rng(3)
+    values = rng.uniform(200, 300, (4, source.sizes["lat"], source.sizes["lon"]))
+    data = xr.Dataset({"rlut": (("time", "lat", "lon"), values)}, coords=source.coords)
+    data["lat_bnds"], data["lon_bnds"] = source["lat_bnds"], source["lon_bnds"]
+    return data
+
+def _integral(data):
+    return (data * cell_area(data)).sum(("lat", "lon"))
+
+def test_regridding_conserves_the_global_integral(field):
+    target = global_grid(5.0, 4.0)
+    regridded = regrid(field, target)
+    assert regridded["rlut"].shape == (4, 36, 90)
+    assert "lat_bnds" not in regridded
+    np.testing.assert_allclose(_integral(regridded["rlut"]).values,
+                               _integral(field["rlut"]).values, rtol=1e-12)
+
+def test_constant_field_stays_constant(field):
+    constant = xr.full_like(field["rlut"], 240.0)
+    np.testing.assert_allclose(regrid(constant, global_grid(5.0)).values, 240.0, rtol=1e-12)
+
+def test_missing_cells_are_renormalised(field):
+    data = xr.full_like(field["rlut"], 240.0)
+    data[:, :5] = np.nan
+    regridded = regrid(data, global_grid(5.0)).values
+    assert np.isnan(regridded[:, :3]).all()  # only covered by missing source cells
+    np.testing.assert_allclose(regridded[:, 3:], 240.0, rtol=1e-12)
+
+def test_dask_input_stays_lazy(field):
+    lazy = regrid(field["rlut"].chunk({"time": 1}), global_grid(5.0))
+    assert lazy.chunks is not None and lazy.chunks[0] == (1, 1, 1, 1)
+    np.testing.assert_allclose(lazy.values, regrid(field["rlut"], global_grid(5.0)).values)
+
+def test_weights_are_cached_on_disk(field, tmp_path):
+    target = global_grid(5.0)
+    regridding._WEIGHTS.clear()
+    weights = conservative_weights(field, target, cache_dir=str(tmp_path))
+    assert [name for name in os.listdir(str(tmp_path)) if name.endswith(".npz")] == os.listdir(str(tmp_path))
+    regridding._WEIGHTS.clear()
+    reloaded = conservative_weights(field, target, cache_dir=str(tmp_path))
+    assert (weights != reloaded).nnz == 0
+    assert conservative_weights(field, target) is reloaded
+
+def test_wrapping_source_bounds():
+    grid = global_grid(30.0)
+    values = np.random.default_rng(4).uniform(100, 200, (6, 12))
+    source = xr.Dataset({"x": (("lat", "lon"), values)},
+                        coords={"lat": grid["lat"].values, "lon": (grid["lon"].values - 15.0) % 360})
+    source["lat_bnds"] = (("lat", "bnds"), grid["lat_bnds"].values)
+    source["lon_bnds"] = (("lon", "bnds"), (grid["lon_bnds"].values - 15.0) % 360)  # first cell [345, 15]
+    target = global_grid(10.0)
+    weights = conservative_weights(source, target)
+    np.testing.assert_allclose(np.asarray(weights.sum(axis=1)).ravel(), 1.0, rtol=1e-12)
+    np.testing.assert_allclose(_integral(regrid(source, target)["x"]), _integral(source["x"]), rtol=1e-12)
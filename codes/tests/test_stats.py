@@ -0,0 +1,126 @@
+import numpy as np
+import xarray as xr
+import pytest
+from forcing_tools import global_mean, precision
+from forcing_tools.stats import annual_mean, seasonal_mean, climatology
+from forcing_tools.grid import cell_area
+
+def test_global_mean_dataarray_with_data_main(fluxes):
+    aer, _ = fluxes
+    area_mean, mean = global_mean(aer["rsut"], aer)
+    expected_series, expected = global_mean(aer["rsut"])
+    assert isinstance(area_mean, np.ndarray) and area_mean.shape == (aer.sizes["time"],)
+    np.testing.assert_allclose(area_mean, expected_series.values, rtol=1e-12)
+    np.testing.assert_allclose(mean, expected, rtol=1e-12)
+
+def test_global_mean_dataarray_dimension_order(fluxes):
+    aer, _ = fluxes
+    _, mean = global_mean(aer["rsut"].transpose("lat", "lon", "time"), aer)
+    np.testing.assert_allclose(mean, global_mean(aer["rsut"])[1], rtol=1e-12)
+
+def test_global_mean_is_area_weighted(fluxes):
+    aer, _ = fluxes
+    field = xr.ones_like(aer["rsut"]) * (aer["lat"] + 100)
+    area = cell_area(aer)
+    expected = float((area * (aer["lat"] + 100)).sum() / area.sum())
+    np.testing.assert_allclose(global_mean(field)[1], expected, rtol=1e-12)
+    np.testing.assert_allclose(global_mean(field.values, aer)[1], expected, rtol=1e-12)
+
+def test_global_mean_masked_and_nan_agree(fluxes):
+    aer, _ = fluxes
+    values = aer["rsut"].values.copy()
+    values[:, 1, 2] = np.nan
+    masked = np.ma.masked_invalid(values)
+    np.testing.assert_allclose(global_mean(masked, aer)[1], global_mean(values, aer)[1], rtol=1e-12)
+    np.testing.assert_allclose(global_mean(values, aer)[1], global_mean(aer["rsut"].copy(data=values))[1], rtol=1e-12)
+
+def test_global_mean_float32_policy(fluxes):
+    aer, _ = fluxes
+    expected = global_mean(aer["rsut"].values, aer)[1]
+    with precision("float32"):
+        np.testing.assert_allclose(global_mean(aer["rsut"].values, aer)[1], expected, rtol=1e-6)
+
+def test_moments_merge_equals_single_pass():
+    from forcing_tools import Moments
+    data = np.random.default_rng(1).normal(5.0, 2.0, (50, 4, 3))
+    parts = [Moments.from_chunk(data[a:b]) for a, b in ((0, 7), (7, 30), (30, 50))]
+    merged = Moments()
+    for part in parts:
+        merged.merge(part)
+    assert merged.count == 50
+    np.testing.assert_allclose(merged.mean, data.mean(axis=0), rtol=1e-12)
+    np.testing.assert_allclose(merged.variance(ddof=1), data.var(axis=0, ddof=1), rtol=1e-12)
+
+def test_t_test_streaming_matches_t_test_nd(fluxes):
+    from forcing_tools import t_test_nd, t_test_streaming
+    aer, _ = fluxes
+    expected = t_test_nd(aer["rsut"].values, 24, 100)
+    for data in (aer["rsut"].values, aer["rsut"].chunk({"time": 5})):
+        result = t_test_streaming(data, 100, n=24, chunk_size=7)
+        np.testing.assert_allclose(result[0], expected[0], rtol=1e-10)
+        np.testing.assert_allclose(result[1], expected[1], rtol=1e-8, atol=1e-300)
+
+def _monthly(calendar="noleap", start="2001-03-01", periods=34):
+    time = xr.date_range(start, periods=periods, freq="MS", calendar=calendar, use_cftime=True)
+    values = np.random.default_rng(2).normal(size=(periods, 3, 4))
+    return xr.DataArray(values, dims=("time", "lat", "lon"), coords={"time": time})
+
+def _weighted_groupby(data, key):
+    weights = data["time"].dt.days_in_month.astype("float64")
+    return (data * weights).groupby(key).sum() / weights.groupby(key).sum()
+
+@pytest.mark.parametrize("calendar", ["noleap", "360_day", "gregorian"])
+def test_annual_mean_matches_weighted_groupby(calendar):
+    data = _monthly(calendar)
+    expected = _weighted_groupby(data, "time.year")
+    for values in (data, data.chunk({"time": 12})):
+        np.testing.assert_allclose(annual_mean(values).transpose("year", ...), expected, rtol=1e-12)
+    assert list(annual_mean(data)["year"].values) == [2001, 2002, 2003]
+
+def test_annual_mean_irregular_axis_falls_back():
+    data = _monthly().drop_isel(time=[5, 6])
+    expected = _weighted_groupby(data, "time.year")
+    np.testing.assert_allclose(annual_mean(data), expected.values, rtol=1e-12)
+
+def test_seasonal_mean_keeps_complete_seasons():
+    data = _monthly()
+    seasonal = seasonal_mean(data)
+    # March 2001 to December 2003: MAM 2001 to SON 2003, the lone December is left out
+    assert seasonal.sizes["time"] == 11
+    assert list(seasonal["season"].values[:4]) == ["MAM", "JJA", "SON", "DJF"] and seasonal["year"].values[3] == 2002
+    months = data.isel(time=slice(9, 12))
+    days = months["time"].dt.days_in_month
+    np.testing.assert_allclose(seasonal.isel(time=3), (months * days).sum("time") / days.sum(), rtol=1e-12)
+    # a gap drops its season and takes the grouped fallback
+    np.testing.assert_allclose(seasonal_mean(data.drop_isel(time=[1])), seasonal.isel(time=slice(1, None)), rtol=1e-12)
+
+def test_climatology_matches_weighted_groupby():
+    data = _monthly()
+    np.testing.assert_allclose(climatology(data), _weighted_groupby(data, "time.month"), rtol=1e-12)
+    seasons = climatology(data, freq="season")
+    expected = _weighted_groupby(data, "time.season")
+    np.testing.assert_allclose(seasons, expected.sel(season=list(seasons["season"].values)), rtol=1e-12)
+    with pytest.raises(ValueError):
+        climatology(data, freq="year")
+
+def test_moments_leave_out_masked_values():
+    from forcing_tools import Moments, t_test_streaming
+    data = np.random.default_rng(3).normal(5.0, 2.0, (40, 3, 4))
+    mask = np.zeros(data.shape, dtype=bool)
+    mask[5:12, 0, 0] = True
+    mask[:, 1, 1] = True  # no valid value at all
+    masked = np.ma.masked_array(np.where(mask, 1e20, data), mask=mask)
+
+    moments = Moments()
+    for start in range(0, 40, 9):
+        moments.update(masked[start:start + 9])
+    expected = np.ma.masked_invalid(np.where(mask, np.nan, data))
+    assert moments.count[0, 0] == 33 and moments.count[1, 1] == 0 and moments.count[2, 3] == 40
+    np.testing.assert_allclose(moments.mean[~mask.all(axis=0)], expected.mean(axis=0).compressed(), rtol=1e-12)
+    np.testing.assert_allclose(moments.variance()[~mask.all(axis=0)], expected.var(axis=0, ddof=1).compressed(), rtol=1e-12)
+    assert np.isnan(moments.variance()[1, 1])
+
+    t_masked, _ = t_test_streaming(masked, 5.0, chunk_size=9)
+    t_nan, _ = t_test_streaming(np.where(mask, np.nan, data), 5.0, chunk_size=9)
+    np.testing.assert_array_equal(t_masked, t_nan)
+    assert np.all(np.abs(t_masked[~mask.all(axis=0)]) < 10) and np.isnan(t_masked[1, 1])
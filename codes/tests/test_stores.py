@@ -0,0 +1,102 @@
+import json
+import os
+import numpy as np
+import pytest
+import synthetic
+from forcing_tools import StoreCatalog, ChunkCache
+
+fsspec = pytest.importorskip("fsspec")
+
+@pytest.fixture(params=[2, 3], ids=["zarr_v2", "zarr_v3"])
+def stores(request, tmp_path):
+    paths = synthetic.write_tree(str(tmp_path / "bucket"), experiments=("piClim-control",),
+                                 variables=("rsdt", "rsut"), resolution=30, years=1, fmt="zarr",
+                                 zarr_format=request.param)
+    return request.param, synthetic.write_store_catalog(paths, str(tmp_path / "stores.csv"))
+
+def test_stores_are_written_in_the_requested_format(stores, tmp_path):
+    zarr_format, csv_path = stores
+    zstore = StoreCatalog.load(csv_path).stores("SYNTH-ESM", "piClim-control", variables=("rsdt",))["rsdt"]
+    assert os.path.exists(os.path.join(zstore, ".zmetadata" if zarr_format == 2 else "zarr.json"))
+    assert os.path.exists(os.path.join(zstore, "zarr.json")) == (zarr_format == 3)
+
+def test_second_session_reads_from_the_cache(stores, tmp_path):
+    _, csv_path = stores
+    cache_dir = str(tmp_path / "cache")
+    values = []
+    for session in range(2):
+        catalog = StoreCatalog.load(csv_path, cache_dir=cache_dir)
+        data = catalog.open_dataset("SYNTH-ESM", "piClim-control", variables=("rsdt", "rsut"))
+        values.append(data["rsut"].values)
+        cache = catalog.cache("file")
+        assert cache.hits > 0
+        if session == 1:
+            assert cache.misses == 0
+    np.testing.assert_array_equal(values[0], values[1])
+    assert cache.size == sum(os.path.getsize(p) for p, _, _ in cache._entries())
+
+def _disk_size(directory):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(directory) for f in files)
+
+def test_eviction_keeps_the_size_without_rescanning(stores, tmp_path, monkeypatch):
+    _, csv_path = stores
+    cache_dir = str(tmp_path / "cache")
+    catalog = StoreCatalog.load(csv_path, cache_dir=cache_dir)
+    data = catalog.open_dataset("SYNTH-ESM", "piClim-control", variables=("rsdt", "rsut"))
+    data["rsdt"].values
+    cache = catalog.cache("file")
+    total = cache.size
+    assert total == _disk_size(cache_dir)
+
+    monkeypatch.setattr(ChunkCache, "_entries", lambda self: pytest.fail("directory rescanned"))
+    data["rsut"].values  # read last, so its chunk is the one kept
+    newest = next(reversed(cache._index))
+    cache.evict(cache._index[newest])
+    assert list(cache._index) == [newest]
+    assert cache.size == _disk_size(cache_dir) == os.path.getsize(newest)
+    cache.evict(0)
+    assert cache.size == _disk_size(cache_dir) == 0
+
+def test_cache_is_read_only(tmp_path):
+    cache = ChunkCache(fsspec.filesystem("file"), str(tmp_path / "cache"))
+    target = str(tmp_path / "object")
+    for write in (lambda: cache.open(target, "wb"), lambda: cache.pipe_file(target, b"x"), lambda: cache.rm_file(target)):
+        with pytest.raises(PermissionError):
+            write()
+    assert not os.path.exists(target)
+
+def test_cache_shared_by_threads(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+    target = fsspec.filesystem("file")
+    objects = {}
+    for i in range(8):
+        path = str(tmp_path / "bucket" / "chunk{}".format(i))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        objects[path] = bytes([i]) * 1000
+        with open(path, "wb") as f:
+            f.write(objects[path])
+    cache_dir = str(tmp_path / "cache")
+    cache = ChunkCache(target, cache_dir, max_size=5000)
+    paths = list(objects) * 50
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(cache.cat_file, paths))
+    assert results == [objects[path] for path in paths]
+    assert cache.hits + cache.misses == len(paths)
+    assert cache.size == sum(cache._index.values()) == _disk_size(cache_dir) <= 5000
+    assert not [f for _, _, files in os.walk(cache_dir) for f in files if ".tmp" in f]
+
+def test_ensemble_leaves_out_merged_members(tmp_path):
+    import pandas as pd
+    paths = synthetic.write_tree(str(tmp_path / "bucket"), experiments=("piClim-control",), variables=("rsdt",),
+                                 members=2, resolution=30, years=1, fmt="zarr")
+    csv_path = synthetic.write_store_catalog(paths, str(tmp_path / "stores.csv"))
+    table = pd.read_csv(csv_path, dtype=str)
+    merged = table[table["member_id"] == "r1i1p1f1"].assign(member_id="r12i1p1f1")
+    catalog = StoreCatalog(pd.concat([table, merged]))
+
+    ensemble = catalog.open_ensemble("SYNTH-ESM", "piClim-control", variables=("rsdt",))
+    assert list(ensemble["realization"].values) == ["r1i1p1f1", "r2i1p1f1"]
+    with pytest.raises(ValueError, match="r12i1p1f1"):
+        catalog.open_ensemble("SYNTH-ESM", "piClim-control", variables=("rsdt",), members=["r1i1p1f1", "r12i1p1f1"])
+    with pytest.raises(KeyError, match="pre-merged"):
+        StoreCatalog(merged).open_ensemble("SYNTH-ESM", "piClim-control", variables=("rsdt",))
@@ -0,0 +1,61 @@
+import time
+import pytest
+from forcing_tools import trace, compute_all_components, compute_cloudy_sky
+
+@trace.traced
+def _inner(delay):
+    time.sleep(delay)
+
+@trace.traced
+def _outer(delay):
+    _inner(delay)
+    _inner(delay)
+    time.sleep(delay)
+
+@trace.traced
+def _recursive(n, delay):
+    time.sleep(delay)
+    if n:
+        _recursive(n - 1, delay)
+
+def _rows(table):
+    return {line.split()[0]: line.split()[1:] for line in table.splitlines()[1:]}
+
+def test_nested_calls_are_reported_as_self_time():
+    with trace.tracing() as calls:
+        _outer(0.05)
+    outer = [c for c in calls if c["name"].endswith("_outer")][0]
+    assert outer["seconds"] >= 0.15
+    assert 0.05 <= outer["self_seconds"] < 0.1
+
+    rows = _rows(trace.summary(calls))
+    self_total = sum(float(row[1]) for row in rows.values())
+    assert self_total == pytest.approx(outer["seconds"], abs=0.01)
+    assert float(rows["test_trace._inner"][1]) == pytest.approx(0.1, abs=0.02)
+
+def test_recursive_calls_are_counted_once_inclusive():
+    with trace.tracing() as calls:
+        _recursive(2, 0.02)
+    calls_, self_s, incl_s = _rows(trace.summary(calls))["test_trace._recursive"][:3]
+    assert calls_ == "3"
+    assert float(self_s) == pytest.approx(float(incl_s), abs=0.005)
+
+def test_dask_tasks_are_timed_at_compute(fluxes):
+    aer, ctl = (data.chunk({"time": 6}) for data in fluxes)
+    trace.reset()
+    with trace.tracing() as calls:
+        components = compute_all_components(aer, ctl)
+        assert not [c for c in trace.records() if c.get("phase") == "compute"]
+        components.compute()
+    compute = [c for c in calls if c.get("phase") == "compute"]
+    assert compute and all(c["tasks"] > 0 for c in compute)
+    assert {c["name"] for c in compute} <= {c["name"] for c in calls if c.get("phase") == "build"}
+    assert "compute s" in trace.summary(calls).splitlines()[0]
+
+def test_computing_outside_the_block_is_not_recorded(fluxes):
+    aer, ctl = (data.chunk({"time": 6}) for data in fluxes)
+    with trace.tracing() as calls:
+        result = compute_cloudy_sky(aer, ctl)
+    [x.compute() for x in result]
+    assert not [c for c in calls if c.get("phase") == "compute"]
+    assert trace._timer._callback not in trace.Callback.active
@@ -0,0 +1,52 @@
+import os
+import numpy as np
+import pytest
+import xarray as xr
+from forcing_tools import forcings, quantize, read_forcings, write_forcings
+from forcing_tools.writer import chunk_sizes
+
+@pytest.mark.parametrize("dtype, keepbits", [(np.float32, 7), (np.float32, 0), (np.float64, 23)])
+def test_quantize_error_bound(dtype, keepbits):
+    values = np.random.default_rng(1).normal(0, 100, 1000).astype(dtype)
+    rounded = quantize(values, keepbits)
+    assert rounded.dtype == dtype
+    assert np.all(np.abs(rounded - values) <= np.abs(values) * 2.0**-(keepbits + 1))
+
+def test_quantize_keeps_special_values():
+    values = np.array([np.nan, np.inf, -np.inf, 0.0, 1.0], dtype=np.float32)
+    rounded = quantize(values, 3)
+    np.testing.assert_array_equal(rounded, values)
+    with pytest.raises(TypeError):
+        quantize(np.arange(3), 3)
+    with pytest.raises(ValueError):
+        quantize(values, 24)
+
+def test_chunk_sizes_layouts():
+    assert chunk_sizes(("time", "lat", "lon"), (120, 96, 144), "map", target=96 * 144 * 10) == (10, 96, 144)
+    time, lat, lon = chunk_sizes(("time", "lat", "lon"), (120, 96, 144), "timeseries", target=120 * 100)
+    assert time == 120 and lat == lon == 10
+    with pytest.raises(ValueError):
+        chunk_sizes(("time",), (12,), "region")
+
+@pytest.mark.parametrize("name", ["forcings.nc", "forcings.zarr"])
+def test_write_read_round_trip(tmp_path, fluxes, name):
+    components = forcings.compute_all_components(*fluxes).astype(np.float32)
+    path = write_forcings(components, str(tmp_path / name), layout="timeseries")
+    assert os.listdir(str(tmp_path)) == [name]
+    data = read_forcings(path)
+    xr.testing.assert_equal(data.compute(), components)
+    assert data["sw_fcloudy"].attrs["units"] == "W m-2" and data.attrs["chunk_layout"] == "timeseries"
+
+@pytest.mark.parametrize("layout", ["map", "timeseries"])
+@pytest.mark.parametrize("name", ["forcings.nc", "forcings.zarr"])
+def test_write_read_round_trip_dask(tmp_path, fluxes, name, layout):
+    aer, ctl = (d.chunk({"time": 6}) for d in fluxes)
+    components = forcings.compute_all_components(aer, ctl)
+    data = read_forcings(write_forcings(components, str(tmp_path / name), layout=layout))
+    xr.testing.assert_allclose(data.compute(), components.compute())
+
+def test_write_quantized(tmp_path, fluxes):
+    components = forcings.compute_all_components(*fluxes)[["sw_allsky"]]
+    data = read_forcings(write_forcings(components, str(tmp_path / "q.nc"), keepbits=10)).compute()
+    np.testing.assert_allclose(data["sw_allsky"], components["sw_allsky"], rtol=2.0**-11, atol=0)
+    assert "10 significant mantissa bits" in data.attrs["quantization"]
@@ -7,7 +7,8 @@ Created on Wed Aug  5 21:18:22 2020
 """
 
 import numpy as np
-from netCDF4 import Dataset
+from forcing_tools.catalog import Catalog
+from forcing_tools.reader import read_files
 
 class RadiativeFluxData: 
     """
@@ -39,75 +40,36 @@ class RadiativeFluxData:
         self.rlutcs_c = np.nan  # (time, lat , lon)
 
         
-    def read(self, path='/home/rpinto/KlimaData/CMIP6/RFMIP/', read_metadata=True):
+    def read(self, path='/home/rpinto/KlimaData/CMIP6/RFMIP/', read_metadata=True, max_workers=1, dtype=None, fill_nan=False, catalog=None):
         """
         Read data
         Needs 3 files corresponding to control sim and 3 files for sim incl anthropogenic aerosols
+        max_workers: number of files read at the same time by a process pool; 1 (default) reads them one after another.
+        Per-file read times are stored in self.timings
+        dtype: e.g. 'float32' to keep the fluxes in single precision. Default: None (the forcing_tools
+               precision policy, see forcing_tools.precision.set_precision)
+        fill_nan: True to get plain float arrays with missing values as NaN instead of masked arrays
+        catalog: forcing_tools.catalog.Catalog of the CMIP6 tree. Default: None (the index saved in path is
+                 loaded; path is scanned and the index saved only when there is none, see Catalog.load_or_build)
         """
 
-        # incl anthropogenic aerosols
-        file_rsdt_aer = path+"piClim-spAer-aer/rsdt/rsdt_Amon_NorESM2-LM_piClim-spAer-aer_r1i1p1f1_gn_000101-003012.nc"
-        file_rsut_aer = path+"piClim-spAer-aer/rsut/rsut_Amon_NorESM2-LM_piClim-spAer-aer_r1i1p1f1_gn_000101-003012.nc"
-        file_rlut_aer = path+"piClim-spAer-aer/rlut/rlut_Amon_NorESM2-LM_piClim-spAer-aer_r1i1p1f1_gn_000101-003012.nc"
-
-        # control- without anthro aerosols
-        file_rsdt_c = path+"piClim-control/rsdt/rsdt_Amon_NorESM2-LM_piClim-control_r1i1p1f1_gn_000101-003012.nc"
-        file_rsut_c = path+"piClim-control/rsut/rsut_Amon_NorESM2-LM_piClim-control_r1i1p1f1_gn_000101-003012.nc"
-        file_rlut_c = path+"piClim-control/rlut/rlut_Amon_NorESM2-LM_piClim-control_r1i1p1f1_gn_000101-003012.nc"
-
-        file_rsutcs_aer = path+"piClim-spAer-aer/rsutcs/rsutcs_Amon_NorESM2-LM_piClim-spAer-aer_r1i1p1f1_gn_000101-003012.nc"
-        file_rlutcs_aer = path+"piClim-spAer-aer/rlutcs/rlutcs_Amon_NorESM2-LM_piClim-spAer-aer_r1i1p1f1_gn_000101-003012.nc"
-        file_rsutcs_c = '/home/rpinto/KlimaData/CMIP6/RFMIP/piClim-control/rsutcs/rsutcs_Amon_NorESM2-LM_piClim-control_r1i1p1f1_gn_000101-003012.nc'
-        file_rlutcs_c = '/home/rpinto/KlimaData/CMIP6/RFMIP/piClim-control/rlutcs/rlutcs_Amon_NorESM2-LM_piClim-control_r1i1p1f1_gn_000101-003012.nc'
-
-        
-        # read experiment
-        with Dataset(file_rsdt_aer) as nc:
-            
-            self.rsdt_aer = nc.variables['rsdt'][:]
-
-            # read only for first variable and assume the others are the same. To compare, see above the assert. But not sure if that would work
-            self.time = nc.variables['time'][:] 
-            self.lat = nc.variables['lat'][:]
-            self.lon = nc.variables['lon'][:]
-
-        with Dataset(file_rsut_aer) as nc:
-            
-            self.rsut_aer = nc.variables['rsut'][:]
-
-        with Dataset(file_rlut_aer) as nc:
-            
-            self.rlut_aer = nc.variables['rlut'][:]
-
-        # read control
-        with Dataset(file_rsdt_c) as nc:
-            
-            self.rsdt_c = nc.variables['rsdt'][:]
-
-        with Dataset(file_rsut_c) as nc:
-            
-            self.rsut_c = nc.variables['rsut'][:]
-
-        with Dataset(file_rlut_c) as nc:
-            
-            self.rlut_c = nc.variables['rlut'][:]
-
-        # clear sky    
-           
-        with Dataset(file_rsutcs_aer) as nc:
-            
-            self.rsutcs_aer = nc.variables['rsutcs'][:]
-
-        with Dataset(file_rlutcs_aer) as nc:
-            
-            self.rlutcs_aer = nc.variables['rlutcs'][:]
-
-        # read control
-
-        with Dataset(file_rsutcs_c) as nc:
-            
-            self.rsutcs_c = nc.variables['rsutcs'][:]
-
-        with Dataset(file_rlutcs_c) as nc:
-            
-            self.rlutcs_c = nc.variables['rlutcs'][:]
+        if catalog is None:
+            catalog = Catalog.load_or_build(path)
+
+        # incl anthropogenic aerosols (aer) and control- without anthro aerosols (c)
+        variables = ("rsdt", "rsut", "rlut", "rsutcs", "rlutcs")
+        files = {}
+        for experiment, suffix in (("piClim-spAer-aer", "_aer"), ("piClim-control", "_c")):
+            found = catalog.files("NorESM2-LM", experiment, variables=variables, member_id="r1i1p1f1", grid_label="gn")
+            for var in variables:
+                (file,) = found[var]  # one file covers the whole run
+                files[var + suffix] = (file, var)
+
+        # read all files; time, lat and lon are checked to be the same in every file
+        data, self.timings = read_files(files, max_workers=max_workers, dtype=dtype, fill_nan=fill_nan)
+
+        self.time = data['time']
+        self.lat = data['lat']
+        self.lon = data['lon']
+        for name in files:
+            setattr(self, name, data[name])